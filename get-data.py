@@ -1,87 +1,42 @@
 #!/usr/bin/env python3
+""" Print property tables of the selected molecules
 
-from ilthermo.models import *
-from sqlalchemy import or_
+    ./get-data.py density:343
+    ./get-data.py density:298 density:343 viscosity:343 cp:343 diffusion:343 hvap -o tables/
 
-mols = session.query(Molecule)
-mols_selected = mols.filter(Molecule.selected == True)
+Each table has one line per molecule with the point nearest to the requested
+temperature (liquid, below 200 kPa); hvap takes the lowest-temperature point.
+With --no-outliers, papers flagged by python -m ilthermo.consensus are skipped.
+"""
 
-density = session.query(Property).filter(Property.name == 'Density').first()
-viscosity = session.query(Property).filter(Property.name == 'Viscosity').first()
-cp = session.query(Property).filter(Property.name == 'Heat capacity at constant pressure').first()
-diffusion = session.query(Property).filter(Property.name == 'Self-diffusion coefficient').first()
-hvap = session.query(Property).filter(Property.name == 'Enthalpy of vaporization or sublimation').first()
+import os
+import argparse
+from ilthermo.extract import extract, PROPERTIES
 
 
-def print_value(mol, T, P, val):
-    print('%i %s.%s %i %i %.3f 1.0 %s %s %s %s %s' % (
-        mol.id, mol.cation.smiles, mol.anion.smiles, T, P, val, mol.cation.smiles, mol.anion.smiles,
-        mol.cation.category, mol.anion.category, mol.name.replace(' ', '_')))
-
-
-def get_hvap():
-    for mol in mols_selected:
-        datas = mol.datas.filter(Data.property == hvap).order_by(Data.t).all()
-        if datas != []:
-            data = datas[0]
-            print_value(mol, int(data.t), 0, data.value)
-
-
-def get_density(T):
-    for mol in mols_selected:
-        datas = mol.datas.filter(Data.property == density) \
-            .filter(Data.phase == 'Liquid') \
-            .filter(or_(Data.p == None, Data.p < 200)) \
-            .all()
-        datas.sort(key=lambda x: abs(x.t - T))
-        if datas != []:
-            data = datas[0]
-            P = int(data.p / 100) if data.p != None else 1
-            print_value(mol, int(data.t), P, data.value / 1000)
-
-
-def get_viscosity(T):
-    for mol in mols_selected:
-        datas = mol.datas.filter(Data.property == viscosity) \
-            .filter(Data.phase == 'Liquid') \
-            .filter(or_(Data.p == None, Data.p < 200)) \
-            .all()
-        datas.sort(key=lambda x: abs(x.t - T))
-        if datas != []:
-            data = datas[0]
-            P = int(data.p / 100) if data.p != None else 1
-            print_value(mol, int(data.t), P, data.value * 1000)
-
-
-def get_cp(T):
-    for mol in mols_selected:
-        datas = mol.datas.filter(Data.property == cp) \
-            .filter(Data.phase == 'Liquid') \
-            .filter(or_(Data.p == None, Data.p < 200)) \
-            .all()
-        datas.sort(key=lambda x: abs(x.t - T))
-        if datas != []:
-            data = datas[0]
-            P = int(data.p / 100) if data.p != None else 1
-            print_value(mol, int(data.t), P, data.value)
-
-
-def get_diffusion(T):
-    for mol in mols_selected:
-        datas = mol.datas.filter(Data.property == diffusion) \
-            .filter(Data.phase == 'Liquid') \
-            .filter(or_(Data.p == None, Data.p < 200)) \
-            .all()
-        datas.sort(key=lambda x: abs(x.t - T))
-        if datas != []:
-            data = datas[0]
-            P = int(data.p / 100) if data.p != None else 1
-            print_value(mol, int(data.t), P, data.value)
+def parse_table(arg):
+    key, _, T = arg.partition(':')
+    if key not in PROPERTIES:
+        raise argparse.ArgumentTypeError('unknown property %s, choose from %s' % (key, ', '.join(PROPERTIES)))
+    return key, int(T) if T else None
 
 
 if __name__ == '__main__':
-    get_density(343)
-    # get_viscosity(343)
-    # get_cp(343)
-    # get_diffusion(343)
-    # get_hvap()
+    parser = argparse.ArgumentParser(description='Extract property tables of the selected molecules')
+    parser.add_argument('tables', nargs='*', type=parse_table, default=[('density', 343)],
+                        help='property:T, e.g. density:343')
+    parser.add_argument('-o', '--out', help='write each table to OUT/property-T.txt instead of stdout')
+    parser.add_argument('--no-outliers', action='store_true',
+                        help='skip papers that disagree with the cross-paper consensus')
+    args = parser.parse_args()
+
+    results = extract(args.tables, outliers=not args.no_outliers)
+    for (key, T), lines in results.items():
+        if args.out:
+            os.makedirs(args.out, exist_ok=True)
+            name = key if T is None else '%s-%i' % (key, T)
+            with open(os.path.join(args.out, name + '.txt'), 'w') as f:
+                f.writelines(line + '\n' for line in lines)
+        else:
+            for line in lines:
+                print(line)
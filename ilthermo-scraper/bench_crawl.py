@@ -0,0 +1,103 @@
+#! /usr/bin/env python3
+""" End-to-end crawl throughput against the local mock server
+
+    ./bench_crawl.py [-j 8] [-p 4] [--latency 0.05] [--error-rate 0.02] [--malformed-rate 0.01] [--json]
+
+Starts mockserver.py, runs ilscraper.py against it in a temporary directory
+with a fresh ilthermo.db and no response cache, and reports datasets/s and
+data points/s of the whole crawl.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+import mockserver
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Log.write lines of ilscraper that report a failed request, parse or split; the
+# species and datasets given up after retries end with 'Skip this...'/'Skipping...'
+ERROR_MARKERS = ('Server error', 'Connection error', 'Cannot ', 'Search failed', 'Get data failed',
+                 'No result', 'Special case error', 'Unrecognized conditions')
+
+
+def run(fixtures, workers=1, latency=0, jitter=0, error_rate=0, malformed_rate=0, keep=None, processes=1):
+    server = mockserver.serve(fixtures, latency=latency, jitter=jitter,
+                              error_rate=error_rate, malformed_rate=malformed_rate)
+    workdir = keep or tempfile.mkdtemp()
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        with open(os.path.join(workdir, 'complex_mol.txt'), 'w') as f:
+            f.writelines(name + '\n' for name in fixtures.seeds())
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, os.path.join(HERE, 'ilscraper.py'), '--no-cache',
+                               '-j', str(workers), '-p', str(processes), '--url', 'http://127.0.0.1:%i' % server.server_port],
+                              cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        wall = time.perf_counter() - t0
+        log = proc.stderr.decode(errors='replace').splitlines()
+
+        db = sqlite3.connect(os.path.join(workdir, 'ilthermo.db'))
+        datasets, = db.execute('SELECT count(*) FROM dataset WHERE searched').fetchone()
+        points, = db.execute('SELECT count(*) FROM data').fetchone()
+        ions, = db.execute('SELECT count(*) FROM ion').fetchone()
+        db.close()
+    finally:
+        server.shutdown()
+        if not keep:
+            shutil.rmtree(workdir)
+
+    return {
+        'workers': workers,
+        'processes': processes,
+        'latency': latency,
+        'error_rate': error_rate,
+        'malformed_rate': malformed_rate,
+        'exit_code': proc.returncode,
+        'wall_s': wall,
+        'requests': server.RequestHandlerClass.requests,
+        'ions': ions,
+        'datasets': datasets,
+        'points': points,
+        'datasets_per_s': datasets / wall,
+        'points_per_s': points / wall,
+        'errors': sum(line.startswith(ERROR_MARKERS) for line in log),
+        'skipped': sum(line.rstrip().endswith(('Skip this...', 'Skipping...')) for line in log),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark ilscraper.py against mockserver.py')
+    parser.add_argument('-j', '--workers', type=int, nargs='+', default=[1],
+                        help='download workers, several values run several crawls')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='worker processes of a sharded crawl, -j is then per process')
+    parser.add_argument('--fixtures', help='directory of recorded responses (default: synthetic)')
+    parser.add_argument('--sets', type=int, default=3, help='synthetic datasets per molecule')
+    parser.add_argument('--points', type=int, default=30, help='synthetic points per dataset')
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--malformed-rate', type=float, default=0)
+    parser.add_argument('--keep', help='crawl in this directory and keep the database')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    fixtures = mockserver.DirectoryFixtures(args.fixtures) if args.fixtures \
+        else mockserver.Fixtures(args.sets, args.points)
+    reports = [run(fixtures, workers, args.latency, args.jitter, args.error_rate, args.malformed_rate, args.keep,
+                   args.processes)
+               for workers in args.workers]
+
+    if args.json:
+        json.dump(reports, sys.stdout, indent=1)
+        print()
+    else:
+        for r in reports:
+            print('-p %-3i -j %-3i %7.1f s %6i requests %5i datasets %8i points %8.1f datasets/s %10.0f points/s%s' % (
+                r['processes'], r['workers'], r['wall_s'], r['requests'], r['datasets'], r['points'],
+                r['datasets_per_s'], r['points_per_s'], '' if r['exit_code'] == 0 else '  (exit %i)' % r['exit_code']))
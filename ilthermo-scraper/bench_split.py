@@ -0,0 +1,85 @@
+#! /usr/bin/env python3
+""" Accuracy and throughput of ionname.split_molecule on a corpus of component names
+
+    ./bench_split.py [split_corpus.tsv] [--repeat N] [--json]
+
+The corpus has one `name<TAB>cation<TAB>anion` line per component; any extra
+plain name list (e.g. complex_mol.txt) can be passed with --names to measure
+throughput on it as well.
+"""
+
+import sys
+import json
+import time
+import argparse
+import ionname
+
+
+def load_corpus(path):
+    corpus = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            name, cation, anion = line.rstrip('\n').split('\t')
+            corpus.append((name, cation, anion))
+    return corpus
+
+
+def throughput(names, repeat):
+    """ names/s without and with the memo cache.
+    """
+    cold = warm = 0
+    for i in range(repeat):
+        ionname.split_molecule.cache_clear()
+        t0 = time.perf_counter()
+        ionname.split_many(names)
+        t1 = time.perf_counter()
+        ionname.split_many(names)
+        t2 = time.perf_counter()
+        cold += t1 - t0
+        warm += t2 - t1
+    return len(names) * repeat / cold, len(names) * repeat / warm
+
+
+def run(corpus, extra_names=(), repeat=200):
+    results = ionname.split_many(name for name, cation, anion in corpus)
+    wrong = []
+    for (name, cation, anion), result in zip(corpus, results):
+        if (result.cation, result.anion) != (cation, anion):
+            wrong.append({'name': name, 'expected': [cation, anion],
+                          'got': [result.cation, result.anion], 'error': result.error})
+
+    names = [name for name, cation, anion in corpus] + list(extra_names)
+    cold, warm = throughput(names, repeat)
+    return {
+        'names': len(corpus),
+        'correct': len(corpus) - len(wrong),
+        'accuracy': (len(corpus) - len(wrong)) / max(len(corpus), 1),
+        'errors': sum(r.error is not None for r in results),
+        'names_per_s': cold,
+        'names_per_s_cached': warm,
+        'wrong': wrong,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark ionname.split_molecule')
+    parser.add_argument('corpus', nargs='?', default='split_corpus.tsv')
+    parser.add_argument('--names', help='plain list of extra names for the throughput run')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    extra = [line.rstrip('\n') for line in open(args.names)] if args.names else []
+    report = run(load_corpus(args.corpus), extra, args.repeat)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    else:
+        print('Accuracy: %i/%i (%.1f%%), %i errors' % (
+            report['correct'], report['names'], report['accuracy'] * 100, report['errors']))
+        print('Throughput: %.0f names/s, %.0f names/s cached' % (report['names_per_s'], report['names_per_s_cached']))
+        for w in report['wrong']:
+            print('  %s\n    expected %s, got %s %s' % (w['name'], w['expected'], w['got'], w['error'] or ''))
@@ -0,0 +1,122 @@
+""" On-disk cache of raw responses
+
+Each response is stored gzip-compressed in a file named by the sha1 of its URL
+and query parameters, so a re-run after a parser fix (or a --replay run) never
+needs to download the same page twice.
+"""
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+
+
+class ResponseCache:
+    def __init__(self, path, ttl=None, max_size=None, offline=False):
+        """ `ttl` is the age in seconds after which an entry is refetched, and
+        `max_size` the total bytes kept on disk before the least recently used
+        entries are evicted. None disables either limit. An `offline` cache
+        never expires entries, since there is nothing to refetch them from.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self.size = None
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(url, params={}):
+        request = json.dumps([url, sorted((str(k), str(v)) for k, v in params.items())])
+        return hashlib.sha1(request.encode()).hexdigest()
+
+    def file(self, key):
+        return os.path.join(self.path, key[:2], key + '.gz')
+
+    def iter_chunks(self, url, params={}, chunk_size=65536):
+        """ Return an iterator of the cached text in chunks, or None if missing or expired.
+
+        An entry evicted by another crawl process while it is opened counts as missing.
+        """
+        f = self.file(self.key(url, params))
+        try:
+            if self.ttl is not None and not self.offline and time.time() - os.path.getmtime(f) > self.ttl:
+                return None
+            fp = gzip.open(f, 'rt', encoding='utf-8')
+        except OSError:
+            return None
+        try:
+            os.utime(f, (time.time(), os.path.getmtime(f)))     # atime marks recent use
+        except FileNotFoundError:
+            fp.close()
+            return None
+
+        def read():
+            with fp:
+                for chunk in iter(lambda: fp.read(chunk_size), ''):
+                    yield chunk
+        return read()
+
+    def tee(self, url, params, chunks):
+        """ Pass text chunks through, storing them once the stream has been read to the end.
+        """
+        f = self.file(self.key(url, params))
+        os.makedirs(os.path.dirname(f), exist_ok=True)
+        tmp = '%s.%d.%d' % (f, os.getpid(), threading.get_ident())
+        try:
+            with gzip.open(tmp, 'wt', encoding='utf-8') as fp:
+                for chunk in chunks:
+                    fp.write(chunk)
+                    yield chunk
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.install(tmp, f)
+
+    def install(self, tmp, f):
+        with self.lock:
+            old = os.path.getsize(f) if os.path.exists(f) else 0
+            os.replace(tmp, f)
+            if self.max_size is not None:
+                self.size = self.disk_usage() if self.size is None else self.size + os.path.getsize(f) - old
+                if self.size > self.max_size:
+                    self.evict()
+
+    def discard(self, url, params={}):
+        f = self.file(self.key(url, params))
+        with self.lock:
+            try:
+                size = os.path.getsize(f)
+                os.remove(f)
+            except FileNotFoundError:
+                return
+            if self.size is not None:
+                self.size -= size
+
+    def entries(self):
+        for d in os.listdir(self.path):
+            d = os.path.join(self.path, d)
+            if os.path.isdir(d):
+                for f in os.listdir(d):
+                    if f.endswith('.gz'):
+                        yield os.path.join(d, f)
+
+    def disk_usage(self):
+        return sum(os.path.getsize(f) for f in self.entries())
+
+    def evict(self):
+        """ Drop least recently used entries until 10% below max_size.
+        """
+        files = sorted(self.entries(), key=os.path.getatime)
+        target = self.max_size * 0.9
+        for f in files:
+            if self.size <= target:
+                break
+            try:
+                self.size -= os.path.getsize(f)
+                os.remove(f)
+            except FileNotFoundError:   # removed by another crawl process
+                pass
@@ -0,0 +1,100 @@
+""" Concurrent crawl engine
+
+Downloads and parsing of ilsearch/ilset pages run on a pool of worker threads,
+while the calling thread stays the only one touching the database. Results are
+consumed in the same order the serial crawler in ilscraper.main would produce
+them, so the species queue and DataSet.searched bookkeeping are unchanged.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import ilscraper
+from ilscraper import *
+
+
+def crawl(workers=8, lookahead=None, root=None, window=None):
+    """ Crawl with `workers` download threads.
+
+    `lookahead` species searches are kept in flight ahead of the one being
+    written, and at most `window` (default 4 * workers) dataset downloads of
+    that species. `root` overrides ilscraper.root_url, e.g. for a local test server.
+    """
+    root = root or ilscraper.root_url
+    lookahead = lookahead or workers
+    window = window or 4 * workers
+
+    prp_table = get_prp_table(root + '/ILT2/ilprpls')
+    prp_index = put_prp_table(prp_table)
+
+    search_queue = init_search_queue()
+    pending = deque()   # (species, future of its paper table), in queue order
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+
+        def fill():
+            while len(pending) < lookahead and not search_queue.empty():
+                name = search_queue.get()
+                pending.append((name, pool.submit(
+                    get_paper_table, root + '/ILT2/ilsearch', search_params(name))))
+
+        fill()
+        while pending:
+            print('There are %d species in queue' % (search_queue.qsize() + len(pending)))
+            ilscraper.metrics.gauge('queue_depth', search_queue.qsize() + len(pending))
+            search_name, future = pending.popleft()
+            print('Search species:', search_name)
+
+            try:
+                paper_table = future.result()
+            except SearchFailedError:
+                Log.write('Cannot search. Skip this...')
+                fill()
+                continue
+            except SpecialCaseError:
+                Log.write('Special case error. Skip this...')
+                fill()
+                continue
+
+            print('Get %d papers, ' % len(paper_table), end='')
+
+            paper_table = filter_paper_table(paper_table)
+            print('%d need to be downloaded' % len(paper_table))
+
+            lines = deque(paper_table)
+            datasets = deque()  # (line, future of its data table), at most `window`
+
+            def submit():
+                while lines and len(datasets) < window:
+                    line = lines.popleft()
+                    datasets.append((line, pool.submit(get_data_table, root + '/ILT2/ilset', {'set': line['code']})))
+                ilscraper.metrics.gauge('pending_datasets', len(lines) + len(datasets))
+
+            submit()
+            fill()
+
+            for idx in range(len(paper_table)):
+                line, future = datasets.popleft()
+                submit()
+                if ingest.dataset(line['code']):
+                    future.cancel()
+                    continue
+
+                print('[%d%%] Search paper %s (%s)...' % (idx*100/len(paper_table), line['code'], line['ref']), end='')
+
+                try:
+                    paper_info, molecule_info, data_table = future.result()
+                except SearchFailedError:
+                    Log.write('Cannot get data from paper. Skipping...')
+                    continue
+                except SpecialCaseError:
+                    Log.write('Cannot read data from paper properly. Skipping...')
+                    continue
+
+                store_data_table(line, prp_index, paper_info, molecule_info, data_table, search_queue)
+
+            finish_search(search_name)
+            fill()
+            print('\n')
+
+    print('Finished')
@@ -1,19 +1,33 @@
 """ Database engine
+
+Importing this module opens no database. The writer calls connect() first,
+so crawl worker processes that only download and parse never touch the file.
 """
 
 import sqlalchemy
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy import create_engine, exists, and_
-from sqlalchemy import Column, Integer, Float, Text, Boolean, String, ForeignKey, UniqueConstraint
+from sqlalchemy import create_engine, event, exists, and_, DDL
+from sqlalchemy import Column, Integer, Float, Text, Boolean, String, ForeignKey, UniqueConstraint, Index
 
 Base = declarative_base()
 metadata = Base.metadata
 
 db_file = 'sqlite:///ilthermo.db'
 
-engine = create_engine(db_file, echo=False)
-Session = sessionmaker(engine)
+engine = None
+
+
+def set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA cache_size=-65536')  # 64 MB
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+Session = sessionmaker()
 session = Session()
 
 
@@ -36,7 +50,7 @@ class Paper(Base):
 class DataSet(Base):
     __tablename__ = 'dataset'
     id = Column(Integer, primary_key=True)
-    code = Column(String(5))
+    code = Column(String(5), index=True)
     searched = Column(Boolean)
 
 
@@ -64,6 +78,7 @@ class Molecule(Base):
 
 class Data(Base):
     __tablename__ = 'data'
+    __table_args__ = (Index('ix_data_molecule_property', 'molecule_id', 'property_id', 'phase', 't'),)
     id = Column(Integer, primary_key=True)
     molecule_id = Column(Integer, ForeignKey(Molecule.id))
     paper_id = Column(Integer, ForeignKey(Paper.id))
@@ -79,4 +94,54 @@ class Data(Base):
     property = relationship('Property', foreign_keys='Data.property_id')
 
 
-metadata.create_all(engine)
+class DataGroup(Base):
+    """ Data points of one molecule, property, paper and phase.
+
+    Their bounding box over (property id, t, p) has the same id in the
+    data_bounds R*Tree; rows without t or p count as 298.15 K and 101.325 kPa.
+    """
+    __tablename__ = 'data_group'
+    __table_args__ = (UniqueConstraint('molecule_id', 'property_id', 'paper_id', 'phase', name='data_group_key'),)
+    id = Column(Integer, primary_key=True)
+    molecule_id = Column(Integer, ForeignKey(Molecule.id))
+    property_id = Column(Integer, ForeignKey(Property.id))
+    paper_id = Column(Integer, ForeignKey(Paper.id))
+    phase = Column(String(20))
+    n = Column(Integer)
+
+
+event.listen(DataGroup.__table__, 'after_create', DDL(
+    'CREATE VIRTUAL TABLE IF NOT EXISTS data_bounds USING rtree('
+    'id, property_min, property_max, t_min, t_max, p_min, p_max)').execute_if(dialect='sqlite'))
+event.listen(DataGroup.__table__, 'after_drop', DDL('DROP TABLE IF EXISTS data_bounds').execute_if(dialect='sqlite'))
+
+
+class CrawlRun(Base):
+    """ One ilscraper run, DataSet codes with an id above dataset_id were first listed during it.
+    """
+    __tablename__ = 'crawl_run'
+    id = Column(Integer, primary_key=True)
+    mode = Column(String(10))   # 'crawl' or 'update'
+    started = Column(Float)
+    finished = Column(Float)
+    dataset_id = Column(Integer)
+    species = Column(Integer)
+    datasets = Column(Integer)
+    points = Column(Integer)
+    response_bytes = Column(Integer)
+
+
+
+def connect(url=None):
+    """ Bind session to `url` (default db_file), create missing tables and return the engine.
+    """
+    global engine
+    session.close()
+    if engine is not None:
+        engine.dispose()
+    engine = create_engine(url or db_file, echo=False)
+    event.listen(engine, 'connect', set_pragmas)
+    Session.configure(bind=engine)
+    session.bind = engine
+    metadata.create_all(engine)
+    return engine
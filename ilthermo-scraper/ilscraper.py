@@ -1,28 +1,45 @@
 #! /usr/bin/env python3
 
+import os
 import sys
+import codecs
 import requests 
 import json
 import re
 import time
 from queue import Queue
+from sqlalchemy import func
 from db import *
-from ionname import split_molecule
+from ionname import split_molecule, split_many, SplitError
+from jsonstream import iter_items
+from ingest import Ingest
+from metrics import Metrics
 
 
 root_url = 'http://ilthermo.boulder.nist.gov'
+chunk_size = 65536
+response_cache = None   # cache.ResponseCache, set from the command line
+refresh_listings = False    # bypass the cache for ilprpls/ilsearch, set by --update
+ingest = Ingest(session)
+metrics = Metrics()
 
 class Log:
-    logfile = open('ilscraper-%s.log' % time.strftime('%y%m%d-%H%M%S'), 'w')
+    logfile = None
+
+    @staticmethod
+    def open():
+        if Log.logfile is None:
+            Log.logfile = open('ilscraper-%s.log' % time.strftime('%y%m%d-%H%M%S'), 'w')
+        return Log.logfile
     
     @staticmethod
     def write(*args, **kwargs):
         print(*args, **kwargs, file=sys.stderr)
-        print(*args, **kwargs, file=Log.logfile)
+        print(*args, **kwargs, file=Log.open())
     
     @staticmethod
     def flush():
-        Log.logfile.flush()
+        Log.open().flush()
 
 
 class SearchFailedError(Exception):
@@ -35,44 +52,84 @@ class SpecialCaseError(Exception):
         super().__init__(args)
 
 
-def get_page(url, params={}, try_times=5):
+def open_page(url, params={}, try_times=5, fresh=False):
+    """ Return an iterator of the response text in chunks, read from the cache or streamed from the server.
+
+    A `fresh` response is always downloaded, and replaces the cached one.
+    """
+    if response_cache is not None and not fresh:
+        chunks = response_cache.iter_chunks(url, params, chunk_size)
+        if chunks is not None:
+            metrics.count('cache_hits')
+            return chunks
+        if response_cache.offline:
+            raise ConnectionAbortedError()
+
+    endpoint = url.rsplit('/', 1)[-1]
     while try_times > 0:
         try:
-            r = requests.get(url, params=params)
-            break 
-        except ConnectionError:
+            with metrics.timer('request', endpoint=endpoint) as fields:
+                r = requests.get(url, params=params, stream=True)
+                fields.update(status=r.status_code)
+            metrics.count('requests')
+            if r.status_code < 500:
+                break
+            r.close()
+            Log.write('Server error %i. trying...' % r.status_code)
+        except (ConnectionError, requests.ConnectionError, requests.Timeout):
             Log.write('Connection error. trying...')
-            try_times -= 1
+        metrics.count('retries')
+        try_times -= 1
 
     if try_times <= 0:
         raise ConnectionAbortedError()
-        return None
-    else:
-        return r.text
 
+    chunks = read_response(r)
+    if response_cache is not None and r.status_code == 200:
+        chunks = response_cache.tee(url, params, chunks)
+    return chunks
 
-def add_or_query(row, unique_key):
-    
-    filter_dict = {unique_key: row.__dict__[unique_key]}
 
-    result = session.query(row.__class__).filter_by(**filter_dict).first()
-    if not result:
-        session.add(row)
-        session.flush()
-    else:
-        row.id = result.id 
+def read_response(r):
+    decoder = codecs.getincrementaldecoder(r.encoding or 'utf-8')(errors='replace')
+    with r:
+        for chunk in r.iter_content(chunk_size):
+            metrics.count('response_bytes', len(chunk))
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
 
 
-def get_prp_table(prp_url, try_times=5):
-    """ Get property --> prpcode table.
+def get_page(url, params={}, try_times=5, fresh=False):
+    """ Whole response text, see open_page.
     """
     try:
-        prp_table_raw = get_page(prp_url, try_times=try_times)
+        return ''.join(open_page(url, params, try_times, fresh))
     except ConnectionAbortedError:
-        Log.write('Cannot get prp table. Using local version instead...')
-        prp_table_raw = ''.join([line for line in open('ilprpls.json', 'r').readlines()])   # using local version instead
+        raise
+    except (OSError, EOFError):     # dropped connection or broken cache file
+        if response_cache is not None:
+            response_cache.discard(url, params)
+        raise ConnectionAbortedError()
+
 
-    prp_table_json = json.loads(prp_table_raw)
+def get_prp_table(prp_url, try_times=5):
+    """ Get property --> prpcode table.
+    """
+    prp_table_json = None
+    for attempt in range(try_times):
+        try:
+            prp_table_json = json.loads(get_page(prp_url, try_times=try_times, fresh=refresh_listings))
+            break
+        except ConnectionAbortedError:
+            break
+        except json.JSONDecodeError:
+            metrics.count('parse_errors')
+            Log.write('Cannot parse prp table. Try downloading again...')
+            if response_cache is not None:
+                response_cache.discard(prp_url)
+    if prp_table_json is None:
+        Log.write('Cannot get prp table. Using local version instead...')
+        prp_table_json = json.load(open('ilprpls.json', 'r'))   # using local version instead
     prp_table = {}
 
     for plist in prp_table_json['plist']:
@@ -85,12 +142,20 @@ def get_paper_table(search_url, params, try_times=5):
     """ Return formatted paper table.
     """
     try:
-        search_result_raw = get_page(search_url, params, try_times)
+        search_result_raw = get_page(search_url, params, try_times, fresh=refresh_listings)
     except ConnectionAbortedError:
         Log.write('Search failed')
         raise SearchFailedError()
 
-    search_result_json = json.loads(search_result_raw)
+    try:
+        with metrics.timer('parse', endpoint='ilsearch'):
+            search_result_json = json.loads(search_result_raw)
+    except json.JSONDecodeError:
+        metrics.count('parse_errors')
+        Log.write('Cannot parse search result:', params['cmp'])
+        if response_cache is not None:
+            response_cache.discard(search_url, params)
+        raise SearchFailedError()
 
     try:
         data_header = search_result_json['header']
@@ -120,24 +185,78 @@ def get_paper_table(search_url, params, try_times=5):
     return paper_table
 
 
-def get_data_table(search_url, params, try_times=5):
-    
-    parse_success = False 
+def data_columns(dhead):
+    """ Positions (T, P) of the conditions in a data line, None if they are not T and/or P.
+    """
+    units = [u[0] for u in dhead]
+    if len(units) > 3:
+        return None
+    t_idx = None
+    p_idx = None
+    for i in range(len(units) - 1):
+        if units[i] == "Temperature, K":
+            t_idx = i
+        elif units[i] == "Pressure, kPa":
+            p_idx = i
+        else:
+            return None
+    return t_idx, p_idx
+
+
+def data_row(line, columns):
+    t_idx, p_idx = columns
+    return (line[t_idx][0] if t_idx is not None else None,
+            line[p_idx][0] if p_idx is not None else None,
+            line[-1][0],
+            line[-1][1])
+
+
+def parse_data_set(chunks):
+    """ Parse an ilset response while it streams in.
+
+    Return (all members except data, list of (t, p, value, err) tuples).
+    Points are converted as soon as dhead is known; if it comes after the
+    data, the points read so far are kept as parsed until then.
+    """
+    search_data = {}
+    data_table = []
+    columns = None
+    for key, value in iter_items(chunks, 'data'):
+        if key == 'data':
+            if columns is None:
+                data_table.append(value)
+            elif columns:
+                data_table.append(data_row(value, columns))
+        else:
+            search_data[key] = value
+            if key == 'dhead':
+                columns = data_columns(value) or False
+                data_table = [data_row(line, columns) for line in data_table] if columns else []
+    return search_data, data_table
 
-    while not parse_success:
 
+def get_data_table(search_url, params, try_times=5):
+    
+    for attempt in range(try_times):
         try:
-            search_result_raw = get_page(search_url, params, try_times)
+            chunks = open_page(search_url, params, try_times)
         except ConnectionAbortedError:
             Log.write('Get data failed')
             raise SearchFailedError()
 
         try:
-            search_data = json.loads(search_result_raw)
-            parse_success = True 
-        except json.JSONDecodeError:
+            with metrics.timer('stream', endpoint='ilset'):
+                search_data, data_table = parse_data_set(chunks)
+            break
+        except (json.JSONDecodeError, OSError, EOFError):
+            metrics.count('parse_errors')
+            chunks.close()
+            if response_cache is not None:
+                response_cache.discard(search_url, params)
             Log.write('Cannot parse. Try downloading again...')
-
+    else:
+        Log.write('Cannot parse. Giving up')
+        raise SearchFailedError()
 
     paper_info = {
         'title': search_data['ref']['title'], 
@@ -156,156 +275,203 @@ def get_data_table(search_url, params, try_times=5):
         }
         
     try:
-        molecule_info['cation'], molecule_info['anion'] = split_molecule(molecule_info['name'])
-    except AssertionError:
-        Log.write('Cannot split molecule:', molecule_info['name'])
+        with metrics.timer('split'):
+            molecule_info['cation'], molecule_info['anion'] = split_molecule(molecule_info['name'])
+    except SplitError as e:
+        metrics.count('split_errors')
+        Log.write('Cannot split molecule:', molecule_info['name'], '(%s)' % e)
         raise SpecialCaseError()
     
-    # return data info: list[t, p, value, err]
-    units = [u[0] for u in search_data['dhead']]
-    if len(units) > 3:
-        Log.write('Not equal 2 condition:', units)
+    if data_columns(search_data['dhead']) is None:
+        Log.write('Unrecognized conditions:', [u[0] for u in search_data['dhead']])
         raise SpecialCaseError()
-    p_idx = None 
-    t_idx = None
-    data_table = []
-    for i in range(len(units) - 1):
-        if units[i] == "Temperature, K":
-            t_idx = i
-        elif units[i] == "Pressure, kPa":
-            p_idx = i
-        else:
-            print('Unit unrecognizable:', units[i])
-            raise SpecialCaseError()
-
-    def get_prp(line, idx):
-        if idx is not None:
-            return line[idx][0]
-        else:
-            return None
 
-    for line in search_data['data']:
-        data_table.append([
-            get_prp(line, t_idx),
-            get_prp(line, p_idx),
-            line[-1][0],
-            line[-1][1]
-        ])
-    
     return paper_info, molecule_info, data_table
 
 
 def put_prp_table(prp_table):
-    
-    prp_table_tuple = [i for i in prp_table.items()]
-    prp_table_tuple.sort(key=lambda x:x[0])     # sort by name, alphabet order
-
-    if not session.query(Property).first():   # table exists
-           
-        session.bulk_save_objects([
-            Property(name=line[0]) for line in prp_table_tuple
-        ])
+    """ Add properties not in the database yet, return name --> id.
+    """
+    exist = {name for name, in session.query(Property.name)}
+    new = sorted(name for name in prp_table if name not in exist)     # alphabet order
+    if new:
+        session.bulk_save_objects([Property(name=name) for name in new])
         session.commit()
 
-        return dict([(row[0], i) for row, i in zip(prp_table_tuple, range(len(prp_table_tuple)))]) # name-->idx
-    else:
-        prps = session.query(Property).all()
-
-        return dict([(prp.name, prp.id) for prp in prps])
+    return dict(session.query(Property.name, Property.id))
 
 
 def put_ion(name, charge):
-    ion = Ion(charge=charge, name=name, searched=False)
-    add_or_query(ion, 'name')
+    """ Return True if the ion is new.
+    """
+    return ingest.ion(name, charge)[1]
 
 
 def put_molecule(molecule_info):
-    
-    cation = session.query(Ion).filter_by(name=molecule_info['cation']).first()
-    anion = session.query(Ion).filter_by(name=molecule_info['anion']).first()
-    
-    molecule = Molecule(
-        code=molecule_info['code'],
-        name=molecule_info['name'],
-        cation_id=cation.id, 
-        anion_id=anion.id, 
-        formula=molecule_info['formula'])
-    add_or_query(molecule, 'name')
-
-    molecule_info['id'] = molecule.id
+    molecule_info['id'] = ingest.molecule(molecule_info)
     
 
 def put_paper(paper_info):
-    
-    paper = Paper(
-        year=paper_info['year'], 
-        title=paper_info['title'],
-        author=paper_info['author'])
-
-    add_or_query(paper, 'title')
-    paper_info['id'] = paper.id 
+    paper_info['id'] = ingest.paper(paper_info)
 
 
 def put_data(data_table, paper_info, molecule_id):
-    
-    data = []
-    for line in data_table:
-        data.append(Data(
-            molecule_id=molecule_id,
-            paper_id=paper_info['id'],
-            property_id=paper_info['property_id'],
-            phase=paper_info['phase'], # check phase string first!
-            t=line[0],
-            p=line[1],
-            value=line[2],
-            stderr=line[3]
-        ))
-    
-    session.bulk_save_objects(data) 
+    # check phase string first!
+    prefix = (molecule_id, paper_info['id'], paper_info['property_id'], paper_info['phase'])
+    ingest.data(prefix + line for line in data_table)
+
+
+def search_params(name):
+    return {
+        'cmp': name,
+        'ncmp': 1,
+        'year': '',
+        'auth': '',
+        'keyw': '',
+        'prp': ''
+        }
 
 
-def main():
-    
-    # First we get table
-    prp_table = get_prp_table(root_url + '/ILT2/ilprpls')
-    prp_index = put_prp_table(prp_table)
+def start_run(update=False):
+    """ Record a new CrawlRun, or resume the last one if it did not finish.
+
+    An update run marks every ion unsearched, so the current listings of all
+    known species are fetched and diffed against the DataSet codes: only
+    unseen codes are downloaded, and only the ions of new molecules are
+    searched beyond that. An interrupted update continues with the species
+    it has not listed yet.
+    """
+    mode = 'update' if update else 'crawl'
+    run = session.query(CrawlRun).order_by(CrawlRun.id.desc()).first()
+    if run is not None and run.finished is None and run.mode == mode:
+        Log.write('Resuming %s run %i' % (mode, run.id))
+        return run
+
+    run = CrawlRun(mode=mode, started=time.time(), dataset_id=session.query(func.max(DataSet.id)).scalar() or 0,
+                   species=0, datasets=0, points=0, response_bytes=0)
+    session.add(run)
+    if update:
+        session.query(Ion).update({Ion.searched: False})
+    session.commit()
+    return run
+
+
+def finish_run(run):
+    """ Close the run with the counters of this process.
+    """
+    counters = metrics.summary()['counters']
+    run.finished = time.time()
+    for key in ('species', 'datasets', 'points', 'response_bytes'):
+        setattr(run, key, (getattr(run, key) or 0) + counters.get(key, 0))
+    session.commit()
+    Log.write('Run %i (%s): %i datasets, %i points, %.1f kB downloaded' % (
+        run.id, run.mode, run.datasets, run.points, run.response_bytes / 1024))
+
+
+def seed_species():
+    """ [(ion name, charge)] that start a crawl of an empty database, from complex_mol.txt.
+    """
+    try:
+        mol_list = open('complex_mol.txt', 'r')
+    except IOError:
+        return [('fluoride', -1)]
+    seeds = []
+    with mol_list:
+        for name, cation, anion, error in split_many(line.rstrip('\n') for line in mol_list):
+            if error:
+                Log.write('Cannot split molecule:', name, '(%s)' % error)
+                continue
+            seeds += [(cation, 1), (anion, -1)]
+    return seeds
 
-    search_history = set() # set of ions searched
-    search_history.update([ion.name for ion in session.query(Ion).all()])
 
+def init_search_queue():
+    """ Fill the species queue with unsearched ions, or seed it.
+    """
+    ingest.load()
     search_queue = Queue()
     exist_ions = [ion.name for ion in session.query(Ion).filter_by(searched=False)]
     if exist_ions:
         list(map(search_queue.put, exist_ions))
     else:
-        try:
-            mol_list = open('complex_mol.txt', 'r')
-            for line in mol_list:
-                cation, anion = split_molecule(line.rstrip('\n'))
-                put_ion(cation, 1)
-                put_ion(anion, -1)
-                search_queue.put(cation)
-                search_queue.put(anion)
-        except IOError:
-            search_queue.put('fluoride')
-            put_ion('fluoride', -1)
+        for name, charge in seed_species():
+            put_ion(name, charge)
+            search_queue.put(name)
 
-    session.commit()
+    ingest.commit()
+    return search_queue
+
+
+def missing_replay(root):
+    """ Requests a replay starts with that are not in the response cache.
+    """
+    requests = [(root + '/ILT2/ilprpls', {})]
+    requests += [(root + '/ILT2/ilsearch', search_params(name)) for name, charge in seed_species()]
+    return ['%s %s' % (url, params.get('cmp', '')) for url, params in requests
+            if not os.path.exists(response_cache.file(response_cache.key(url, params)))]
+
+
+def filter_paper_table(paper_table):
+    """ Register datasets of a search result and return those not searched yet.
+    """
+    return [line for line in paper_table if not ingest.dataset(line['code'])]
+
+
+def store_data_table(line, prp_index, paper_info, molecule_info, data_table, search_queue):
+    """ Queue one downloaded dataset for writing and the new ions it contains for searching.
+    """
+    t0 = time.perf_counter()
+    ingest.mark_dataset(line['code'])
+
+    paper_info['phase'] = line['phase']
+    paper_info['property_id'] = prp_index[line['property']]
+    paper_info['molecule'] = line['molecule']
+    molecule_info['code'] = line['molecule_code']
+
+    print('Get %d data points' % len(data_table))
+
+    if put_ion(molecule_info['cation'], 1):
+        search_queue.put(molecule_info['cation'])
+    if put_ion(molecule_info['anion'], -1):
+        search_queue.put(molecule_info['anion'])
+
+    put_molecule(molecule_info)
+    put_paper(paper_info)
+    put_data(data_table, paper_info, molecule_info['id'])
+    metrics.observe('db_stage', time.perf_counter() - t0, points=len(data_table))
+    metrics.count('datasets')
+    metrics.count('points', len(data_table))
+
+
+def finish_search(search_name):
+    """ Mark the species searched and commit its whole search result at once.
+    """
+    ingest.mark_ion(search_name)
+    with metrics.timer('db_commit'):
+        ingest.commit()
+    metrics.count('species')
+    Log.flush()
+
+
+def main(root=None):
+    """ Serial crawl, `root` overrides root_url, e.g. for a local mock server.
+    """
+    root = root or root_url
+
+    # First we get table
+    prp_table = get_prp_table(root + '/ILT2/ilprpls')
+    prp_index = put_prp_table(prp_table)
+
+    search_queue = init_search_queue()
 
     while not search_queue.empty():
         print('There are %d species in queue' % search_queue.qsize())
+        metrics.gauge('queue_depth', search_queue.qsize())
         search_name = search_queue.get()
         print('Search species:', search_name)
 
         try:
-            paper_table = get_paper_table(root_url + '/ILT2/ilsearch', params={
-                'cmp': search_name, 
-                'ncmp': 1,
-                'year': '',
-                'auth': '',
-                'keyw': '',
-                'prp': ''
-                })
+            paper_table = get_paper_table(root + '/ILT2/ilsearch', params=search_params(search_name))
         except SearchFailedError:
             Log.write('Cannot search. Skip this...')
             continue
@@ -315,62 +481,27 @@ def main():
 
         print('Get %d papers, ' % len(paper_table), end='')
 
-        paper_table_new = []
-        for line in paper_table:
-            if not session.query(exists().where(and_(DataSet.code == line['code'], DataSet.searched == True))).scalar():
-                paper_table_new.append(line)
-                session.add(DataSet(code=line['code'], searched=False))
-
-        session.commit()
-        paper_table = paper_table_new
+        paper_table = filter_paper_table(paper_table)
         print('%d need to be downloaded' % len(paper_table))
 
         for idx, line in enumerate(paper_table):
-            if session.query(DataSet).filter_by(code=line['code']).first().searched:
+            if ingest.dataset(line['code']):
                 continue
 
             print('[%d%%] Search paper %s (%s)...' % (idx*100/len(paper_table), line['code'], line['ref']), end='')
 
             try:
-                paper_info, molecule_info, data_table = get_data_table(root_url + '/ILT2/ilset', params={'set': line['code']})
+                paper_info, molecule_info, data_table = get_data_table(root + '/ILT2/ilset', params={'set': line['code']})
             except SearchFailedError:
                 Log.write('Cannot get data from paper. Skipping...')
                 continue
             except SpecialCaseError:
                 Log.write('Cannot read data from paper properly. Skipping...')
                 continue 
-            
-            session.query(DataSet).filter_by(code=line['code']).update({DataSet.searched: True})
-
-            paper_info['phase'] = line['phase']
-            paper_info['property_id'] = prp_index[line['property']]
-            paper_info['molecule'] = line['molecule']
-            molecule_info['code'] = line['molecule_code']
-
-            print('Get %d data points' % len(data_table))
 
-            if not session.query(Ion).filter_by(name=molecule_info['cation']).first():
-                search_queue.put(molecule_info['cation'])
-                put_ion(molecule_info['cation'], 1)
-            if not session.query(Ion).filter_by(name=molecule_info['anion']).first():
-                search_queue.put(molecule_info['anion'])
-                put_ion(molecule_info['anion'], -1)
+            store_data_table(line, prp_index, paper_info, molecule_info, data_table, search_queue)
 
-            put_molecule(molecule_info)
-            put_paper(paper_info)
-
-            if len(data_table) > 20:
-                session.commit()
-
-            put_data(data_table, paper_info, molecule_info['id'])
-            session.commit()
-
-
-            session.commit()
-            Log.flush()
-
-        session.query(Ion).filter_by(name=search_name).update({Ion.searched: True})
-        session.commit()
+        finish_search(search_name)
         print('\n')
 
     print('Finished')
@@ -378,4 +509,90 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='Crawl ILThermo into ilthermo.db')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of concurrent download workers (1 = serial crawl), '
+                             'per worker process with --processes')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='number of download/parse worker processes feeding one writer (1 = no sharding)')
+    parser.add_argument('--batch', type=int, default=200000,
+                        help='data points per commit of the writer with --processes')
+    parser.add_argument('--url', default=root_url,
+                        help='base URL of the ILThermo server, e.g. http://127.0.0.1:8000 for mockserver.py')
+    parser.add_argument('--lookahead', type=int, default=None,
+                        help='number of species searches prefetched ahead of the writer')
+    parser.add_argument('--cache', default='ilscraper-cache',
+                        help='directory of the response cache')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always download, do not read or write the response cache')
+    parser.add_argument('--cache-ttl', type=float, default=None,
+                        help='refetch cached responses older than this many days')
+    parser.add_argument('--cache-size', type=float, default=4096,
+                        help='evict least recently used responses beyond this many MB')
+    parser.add_argument('--metrics', metavar='PREFIX',
+                        help='write events to PREFIX.jsonl, a Prometheus textfile to PREFIX.prom '
+                             'and the run summary to PREFIX-summary.json')
+    parser.add_argument('--metrics-interval', type=float, default=15,
+                        help='seconds between rewrites of the Prometheus textfile')
+    parser.add_argument('--replay', action='store_true',
+                        help='rebuild ilthermo.db from the response cache without network access')
+    parser.add_argument('--update', action='store_true',
+                        help='list all known species again and download only datasets not in the database')
+    args = parser.parse_args()
+    if args.update and args.replay:
+        parser.error('--update needs network access')
+    refresh_listings = args.update
+
+    cache_args = None
+    if not args.no_cache:
+        from cache import ResponseCache
+        cache_args = dict(
+            path=args.cache,
+            ttl=args.cache_ttl * 86400 if args.cache_ttl is not None else None,
+            max_size=args.cache_size * 2**20,
+            offline=args.replay)
+        response_cache = ResponseCache(**cache_args)
+    elif args.replay:
+        parser.error('--replay needs the response cache')
+
+    if args.metrics:
+        metrics.open(args.metrics, args.metrics_interval)
+
+    replay_file = 'ilthermo.db.replay'
+    if args.replay:
+        # rebuild into a separate file, ilthermo.db is only replaced after a complete run
+        missing = missing_replay(args.url.rstrip('/'))
+        if missing:
+            sys.exit('Cannot replay, not in the response cache: %s' % ', '.join(missing))
+        for f in (replay_file, replay_file + '-wal', replay_file + '-shm'):
+            if os.path.exists(f):
+                os.remove(f)
+        engine = connect('sqlite:///' + replay_file)
+    else:
+        engine = connect()
+
+    run = start_run(args.update)
+    if args.processes > 1 or args.workers > 1:
+        import ilscraper
+        ilscraper.response_cache = response_cache
+        ilscraper.refresh_listings = refresh_listings
+        ilscraper.metrics = metrics
+    if args.processes > 1:
+        from sharded import crawl
+        crawl(processes=args.processes, threads=args.workers, root=args.url.rstrip('/'), batch=args.batch,
+              cache=cache_args, refresh=refresh_listings)
+    elif args.workers > 1:
+        from crawler import crawl
+        crawl(workers=args.workers, lookahead=args.lookahead, root=args.url.rstrip('/'))
+    else:
+        main(args.url.rstrip('/'))
+    finish_run(run)
+    if args.replay:
+        session.close()
+        engine.dispose()
+        for f in ('ilthermo.db-wal', 'ilthermo.db-shm'):
+            if os.path.exists(f):
+                os.remove(f)
+        os.replace(replay_file, 'ilthermo.db')
+    Log.write(metrics.report(metrics.close()))
@@ -0,0 +1,173 @@
+""" Batched writer for the crawler
+
+Keeps name/code/key --> id maps of Ion, Molecule, Paper, DataSet and
+DataGroup in memory, so lookups never hit the database, and queues new rows
+until commit(), which writes them with one executemany per table in a single transaction. Data rows
+are tuples and go out in executemany chunks of chunk_size as they arrive,
+inside the same transaction, so the queue never grows with the dataset size.
+The T/P bounding box of every (molecule, paper, property, phase) group is
+extended as rows pass and written to data_group/data_bounds at commit().
+"""
+
+from sqlalchemy import func, bindparam, text
+from db import *
+
+DATA_COLUMNS = ('molecule_id', 'paper_id', 'property_id', 'phase', 't', 'p', 'value', 'stderr')
+T_AMBIENT = 298.15     # stand-in for rows without t or p, as in ilthermo.bounds
+P_AMBIENT = 101.325
+
+
+class Ingest:
+    def __init__(self, session, chunk_size=5000):
+        self.session = session
+        self.chunk_size = chunk_size
+
+    def load(self):
+        """ (Re)read the key maps from the database and drop queued rows.
+        """
+        q = self.session.query
+        self.ions = dict(q(Ion.name, Ion.id))
+        self.molecules = dict(q(Molecule.name, Molecule.id))
+        self.papers = dict(q(Paper.title, Paper.id))
+        self.datasets = {}  # code --> [id, searched]
+        for id, code, searched in q(DataSet.id, DataSet.code, DataSet.searched).order_by(DataSet.id):
+            if code not in self.datasets or searched:
+                self.datasets[code] = [id, bool(searched)]
+
+        self.groups = {(mol, paper, prp, phase): id for id, mol, paper, prp, phase in
+                       q(DataGroup.id, DataGroup.molecule_id, DataGroup.paper_id, DataGroup.property_id, DataGroup.phase)}
+
+        self.next_id = {table: (q(func.max(table.id)).scalar() or 0) + 1
+                        for table in (Ion, Molecule, Paper, DataSet, DataGroup)}
+        self.rows = {table: [] for table in (Ion, Molecule, Paper, DataSet)}
+        self.data_rows = []
+        self.bounds = {}    # (molecule_id, paper_id, property_id, phase) --> [n, t_min, t_max, p_min, p_max]
+        self.searched_ions = set()
+        self.searched_datasets = set()
+
+    def new_id(self, table, row):
+        row['id'] = self.next_id[table]
+        self.next_id[table] += 1
+        self.rows[table].append(row)
+        return row['id']
+
+    def ion(self, name, charge):
+        """ Return (id, True if the ion is new).
+        """
+        if name in self.ions:
+            return self.ions[name], False
+        self.ions[name] = self.new_id(Ion, {'name': name, 'charge': charge, 'searched': False})
+        return self.ions[name], True
+
+    def molecule(self, molecule_info):
+        name = molecule_info['name']
+        if name not in self.molecules:
+            self.molecules[name] = self.new_id(Molecule, {
+                'code': molecule_info['code'],
+                'name': name,
+                'cation_id': self.ions[molecule_info['cation']],
+                'anion_id': self.ions[molecule_info['anion']],
+                'formula': molecule_info['formula']})
+        return self.molecules[name]
+
+    def paper(self, paper_info):
+        title = paper_info['title']
+        if title not in self.papers:
+            self.papers[title] = self.new_id(Paper, {
+                'year': paper_info['year'], 'title': title, 'author': paper_info['author']})
+        return self.papers[title]
+
+    def dataset(self, code):
+        """ Register a dataset code, return True if it has been searched.
+        """
+        if code not in self.datasets:
+            self.datasets[code] = [self.new_id(DataSet, {'code': code, 'searched': False}), False]
+        return self.datasets[code][1]
+
+    def mark_dataset(self, code):
+        self.dataset(code)
+        self.datasets[code][1] = True
+        self.searched_datasets.add(self.datasets[code][0])
+
+    def mark_ion(self, name):
+        if name in self.ions:
+            self.searched_ions.add(self.ions[name])
+
+    def data(self, rows):
+        """ Queue Data rows, tuples in DATA_COLUMNS order.
+        """
+        for row in rows:
+            self.data_rows.append(row)
+            t = T_AMBIENT if row[4] is None else row[4]
+            p = P_AMBIENT if row[5] is None else row[5]
+            box = self.bounds.get(row[:4])
+            if box is None:
+                self.bounds[row[:4]] = [1, t, t, p, p]
+            else:
+                box[0] += 1
+                box[1], box[2], box[3], box[4] = min(box[1], t), max(box[2], t), min(box[3], p), max(box[4], p)
+            if len(self.data_rows) >= self.chunk_size:
+                try:
+                    self.insert_data()
+                except:
+                    self.session.rollback()
+                    self.load()
+                    raise
+
+    def insert_data(self):
+        if self.data_rows:
+            self.session.execute(Data.__table__.insert(), [dict(zip(DATA_COLUMNS, row)) for row in self.data_rows])
+            self.data_rows.clear()
+
+    def write_bounds(self):
+        """ Extend the boxes of known groups and insert the new ones.
+        """
+        groups, boxes, new_groups, new_boxes = [], [], [], []
+        for key, (n, t_min, t_max, p_min, p_max) in self.bounds.items():
+            mol, paper, prp, phase = key
+            box = {'prp': prp, 't_min': t_min, 't_max': t_max, 'p_min': p_min, 'p_max': p_max}
+            if key in self.groups:
+                box['id'] = self.groups[key]
+                groups.append({'_id': box['id'], '_n': n})
+                boxes.append(box)
+            else:
+                box['id'] = self.groups[key] = self.next_id[DataGroup]
+                self.next_id[DataGroup] += 1
+                new_groups.append({'id': box['id'], 'molecule_id': mol, 'property_id': prp, 'paper_id': paper,
+                                   'phase': phase, 'n': n})
+                new_boxes.append(box)
+        if groups:
+            self.session.execute(DataGroup.__table__.update().where(DataGroup.id == bindparam('_id'))
+                                 .values(n=DataGroup.n + bindparam('_n')), groups)
+            self.session.execute(text('UPDATE data_bounds SET t_min = min(t_min, :t_min), t_max = max(t_max, :t_max), '
+                                      'p_min = min(p_min, :p_min), p_max = max(p_max, :p_max) WHERE id = :id'), boxes)
+        if new_groups:
+            self.session.execute(DataGroup.__table__.insert(), new_groups)
+            self.session.execute(text('INSERT INTO data_bounds VALUES (:id, :prp, :prp, :t_min, :t_max, :p_min, :p_max)'),
+                                 new_boxes)
+        self.bounds.clear()
+
+    def commit(self):
+        """ Write everything queued since the last commit in one transaction.
+        """
+        try:
+            for table, rows in self.rows.items():
+                if rows:
+                    self.session.execute(table.__table__.insert(), rows)
+            self.insert_data()
+            self.write_bounds()
+            for table, ids in ((DataSet, self.searched_datasets), (Ion, self.searched_ions)):
+                if ids:
+                    self.session.execute(
+                        table.__table__.update().where(table.id == bindparam('_id')).values(searched=True),
+                        [{'_id': id} for id in ids])
+            self.session.commit()
+        except:
+            self.session.rollback()
+            self.load()
+            raise
+
+        for rows in self.rows.values():
+            rows.clear()
+        self.searched_ions.clear()
+        self.searched_datasets.clear()
@@ -1,38 +1,57 @@
 """ Deal with molecule information
 """
-import re 
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+RE_RATIO = re.compile(r' \(\d:\d\)')
+RE_CHEMICAL = re.compile(r' Chemical.*')
+RE_DASH_SPACE = re.compile(r'- ')
+RE_ORGANIC_ANION = re.compile(r'\w-\d')
+
+SplitResult = namedtuple('SplitResult', ['name', 'cation', 'anion', 'error'])
+
+
+class SplitError(ValueError):
+    """ The name does not follow any known cation/anion pattern.
+    """
+
 
 def format_organic(name):
-    
+
     if name.endswith('-,') or name.endswith('-') or name.endswith('yl,'):
-        
+
         splitstr = name.split()
-        assert len(splitstr) == 2
+        if len(splitstr) != 2:
+            raise SplitError('cannot reorder organic name: %s' % name)
         return splitstr[1].rstrip(',') + splitstr[0].rstrip(',')
     else:
-        return re.sub('- ', '-', name)
+        return RE_DASH_SPACE.sub('-', name)
 
 
+@lru_cache(maxsize=65536)
 def split_molecule(name):
-    """Return cation, Anion"""
+    """Return cation, Anion. Raise SplitError if the name cannot be split"""
 
-    name = re.sub(' \(\d:\d\)', '', name)
-    name = re.sub(' Chemical.*', '', name)
+    name = RE_RATIO.sub('', name)
+    name = RE_CHEMICAL.sub('', name)
     splitstr = name.split(' ')
     if len(splitstr) == 2:
         return splitstr[0], splitstr[1]
 
     # salt ?
-    salt_pos = re.search('salt', name)
-    if salt_pos:
-        if re.search('salt with', name):
-            return format_organic(name[:salt_pos.span()[0] - 1]), name[salt_pos.span()[0] + 10:]
+    salt_pos = name.find('salt')
+    if salt_pos >= 0:
+        if 'salt with' in name:
+            return format_organic(name[:salt_pos - 1]), name[salt_pos + 10:]
         else:
-            assert splitstr[-1] == 'salt'
+            if splitstr[-1] != 'salt':
+                raise SplitError('"salt" is not the last word')
             return splitstr[-2], ' '.join(splitstr[:-2]).rstrip(',')
 
     # end with e?
-    assert name[-1] == 'e'
+    if not name.endswith('e'):
+        raise SplitError('anion does not end with "e"')
     if len(splitstr) >= 3:
         if splitstr[-1] == 'carboxylate' or splitstr[-2].endswith('yl') or splitstr[-2].endswith('hydrogen') or splitstr[-2] == 'bis':
             return format_organic(' '.join(splitstr[:-2])), ' '.join(splitstr[-2:])
@@ -40,11 +59,24 @@ def split_molecule(name):
             return format_organic(' '.join(splitstr[:-1])), splitstr[-1]
 
     # single word
-    organ_anion_pos = re.search('\w-\d', name)
+    organ_anion_pos = RE_ORGANIC_ANION.search(name)
     if organ_anion_pos:
         return name[:organ_anion_pos.span()[0] + 1], name[organ_anion_pos.span()[1] - 1:]
 
-    ium_pos = re.search('ium', name)
-    assert ium_pos
-    return name[:ium_pos.span()[1]], name[ium_pos.span()[1]:]
-        
+    ium_pos = name.find('ium')
+    if ium_pos < 0:
+        raise SplitError('single word without "ium"')
+    return name[:ium_pos + 3], name[ium_pos + 3:]
+
+
+def split_many(names):
+    """ Split a batch of names, return a list of SplitResult with error set instead of raising.
+    """
+    results = []
+    for name in names:
+        try:
+            cation, anion = split_molecule(name)
+            results.append(SplitResult(name, cation, anion, None))
+        except SplitError as e:
+            results.append(SplitResult(name, None, None, str(e)))
+    return results
@@ -0,0 +1,110 @@
+""" Incremental parsing of a JSON object from a stream of text chunks
+
+Only the current chunk and the value being decoded are kept in memory, and
+the elements of one array member (the `data` points of an ilset response)
+are yielded one by one instead of being built into a list.
+"""
+
+import json
+
+WHITESPACE = ' \t\n\r'
+NUMBER = '0123456789.eE+-'
+_decoder = json.JSONDecoder()
+
+
+class Reader:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """ Append the next chunk to the unread text, return False at the end of the stream.
+        """
+        for chunk in self.chunks:
+            if chunk:
+                self.buf = self.buf[self.pos:] + chunk
+                self.pos = 0
+                return True
+        self.eof = True
+        return False
+
+    def error(self, msg):
+        return json.JSONDecodeError(msg, self.buf, self.pos)
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise self.error('Unexpected end of stream')
+
+    def expect(self, chars):
+        c = self.peek()
+        if c not in chars:
+            raise self.error('Expecting one of %r' % chars)
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # a number cut at the end of the chunk decodes as its prefix, e.g. '1.' | '5' as 1
+                cut = isinstance(value, (int, float)) and not isinstance(value, bool) and \
+                    (end == len(self.buf) or self.buf[end] in NUMBER)
+                if not cut or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def end(self):
+        """ Raise unless only whitespace is left.
+        """
+        try:
+            self.peek()
+        except json.JSONDecodeError:
+            return
+        raise self.error('Extra data')
+
+
+def iter_items(chunks, array_key=None):
+    """ Yield (key, value) for every member of the top-level object in `chunks`.
+
+    If the member `array_key` is an array, (array_key, element) is yielded
+    for each of its elements instead. Raise json.JSONDecodeError on
+    malformed or truncated input, possibly after some items were yielded.
+    """
+    r = Reader(chunks)
+    r.expect('{')
+    if r.peek() == '}':
+        r.pos += 1
+        r.end()
+        return
+
+    while True:
+        key = r.value()
+        if not isinstance(key, str):
+            raise r.error('Expecting property name')
+        r.expect(':')
+        if key == array_key and r.peek() == '[':
+            r.pos += 1
+            if r.peek() == ']':
+                r.pos += 1
+            else:
+                while True:
+                    yield key, r.value()
+                    if r.expect(',]') == ']':
+                        break
+        else:
+            yield key, r.value()
+        if r.expect(',}') == '}':
+            break
+    r.end()
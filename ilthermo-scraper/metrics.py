@@ -0,0 +1,144 @@
+""" Crawl instrumentation
+
+Stage timings (request, parse, split, db), counters (bytes, retries, status
+codes, cache hits) and gauges (queue depth) are collected in memory from any
+thread. Every observation can be appended to a JSON lines file, the
+Prometheus textfile is rewritten at most every `interval` seconds, and
+summary() reports count, total and percentiles per stage at the end of a run.
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.stages = {}    # stage --> [seconds]
+        self.counters = {}
+        self.gauges = {}
+        self.events = None
+        self.prom_path = None
+        self.interval = None
+        self.last_write = 0
+
+    def open(self, prefix, interval=15):
+        """ Write events to <prefix>.jsonl and the Prometheus textfile to <prefix>.prom.
+        """
+        self.events = open(prefix + '.jsonl', 'a')
+        self.prom_path = prefix + '.prom'
+        self.interval = interval
+
+    def emit(self, event):
+        if self.events is not None:
+            event['time'] = round(time.time(), 4)
+            self.events.write(json.dumps(event) + '\n')
+
+    def observe(self, stage, seconds, **fields):
+        with self.lock:
+            self.stages.setdefault(stage, []).append(seconds)
+            self.emit(dict(stage=stage, seconds=round(seconds, 6), **fields))
+        self.maybe_write()
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        t0 = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.observe(stage, time.perf_counter() - t0, **fields)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+            self.emit({'gauge': name, 'value': value})
+        self.maybe_write()
+
+    def merge(self, stages, counters):
+        """ Add the observations of another process, e.g. a crawl worker.
+        """
+        with self.lock:
+            for stage, values in stages.items():
+                self.stages.setdefault(stage, []).extend(values)
+            for name, n in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def maybe_write(self):
+        if self.prom_path is not None and time.time() - self.last_write >= self.interval:
+            self.write_prom()
+
+    def write_prom(self):
+        """ Atomically rewrite the textfile for node_exporter's textfile collector.
+        """
+        with self.lock:
+            self.last_write = time.time()
+            lines = ['# TYPE ilscraper_stage_seconds summary']
+            for stage, values in sorted(self.stages.items()):
+                lines.append('ilscraper_stage_seconds_sum{stage="%s"} %.6f' % (stage, sum(values)))
+                lines.append('ilscraper_stage_seconds_count{stage="%s"} %i' % (stage, len(values)))
+            for name, value in sorted(self.counters.items()):
+                lines.append('# TYPE ilscraper_%s_total counter' % name)
+                lines.append('ilscraper_%s_total %s' % (name, value))
+            for name, value in sorted(self.gauges.items()):
+                lines.append('# TYPE ilscraper_%s gauge' % name)
+                lines.append('ilscraper_%s %s' % (name, value))
+            lines.append('ilscraper_uptime_seconds %.3f' % (time.time() - self.start))
+            if self.events is not None:
+                self.events.flush()
+        with open(self.prom_path + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(self.prom_path + '.tmp', self.prom_path)
+
+    def summary(self):
+        with self.lock:
+            stages = {}
+            for stage, values in sorted(self.stages.items()):
+                values = sorted(values)
+                stages[stage] = {
+                    'count': len(values),
+                    'total_s': sum(values),
+                    'mean_s': sum(values) / len(values),
+                    'p50_s': values[len(values) // 2],
+                    'p95_s': values[min(int(len(values) * 0.95), len(values) - 1)],
+                    'max_s': values[-1],
+                }
+            return {
+                'wall_s': time.time() - self.start,
+                'stages': stages,
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+            }
+
+    def close(self):
+        """ Write the final textfile and summary, return the summary.
+        """
+        summary = self.summary()
+        if self.prom_path is not None:
+            self.write_prom()
+            with open(os.path.splitext(self.prom_path)[0] + '-summary.json', 'w') as f:
+                json.dump(summary, f, indent=1)
+        if self.events is not None:
+            self.emit({'summary': summary})
+            self.events.close()
+            self.events = None
+        return summary
+
+    def report(self, summary=None):
+        """ Human-readable summary table.
+        """
+        summary = summary or self.summary()
+        lines = ['%-12s %8s %10s %10s %10s %10s' % ('stage', 'count', 'total s', 'mean ms', 'p95 ms', 'max ms')]
+        for stage, s in summary['stages'].items():
+            lines.append('%-12s %8i %10.2f %10.2f %10.2f %10.2f' % (
+                stage, s['count'], s['total_s'], s['mean_s'] * 1e3, s['p95_s'] * 1e3, s['max_s'] * 1e3))
+        lines.append('wall %.1f s, ' % summary['wall_s'] +
+                     ', '.join('%s %s' % item for item in sorted(summary['counters'].items())))
+        return '\n'.join(lines)
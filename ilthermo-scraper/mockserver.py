@@ -0,0 +1,196 @@
+#! /usr/bin/env python3
+""" Local stand-in for the ILThermo ilprpls/ilsearch/ilset endpoints
+
+    ./mockserver.py --port 8000 --latency 0.05 --error-rate 0.02 --malformed-rate 0.01
+    ./ilscraper.py --url http://127.0.0.1:8000 --no-cache
+
+Responses come from a fixture directory if given (ilprpls.json,
+ilsearch/<component>.json, ilset/<setid>.json, e.g. recorded from the live
+server), otherwise from a synthetic data set of cation/anion pairs. Every
+request waits `latency` seconds (plus up to `jitter`), and fails with a 503
+or returns truncated JSON at the given rates.
+"""
+
+import os
+import json
+import time
+import random
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CATIONS = ['1-%s-3-methylimidazolium' % alkyl for alkyl in ('ethyl', 'butyl', 'hexyl', 'octyl', 'decyl')] + \
+          ['1-butylpyridinium', '1-butyl-1-methylpyrrolidinium', 'tetrabutylammonium',
+           'tetrabutylphosphonium', 'trihexyltetradecylphosphonium']
+ANIONS = ['fluoride', 'chloride', 'bromide', 'iodide', 'nitrate', 'tetrafluoroborate', 'hexafluorophosphate',
+          'dicyanamide', 'thiocyanate', 'acetate', 'trifluoromethanesulfonate', 'bis(trifluoromethylsulfonyl)imide']
+PROPERTIES = ['Density', 'Viscosity', 'Heat capacity at constant pressure', 'Electrical conductivity',
+              'Speed of sound', 'Refractive index']
+SEARCH_HEADER = ['setid', 'ref', 'prp', 'phases', 'cmp1', 'nm1']
+
+
+class Fixtures:
+    """ Synthetic responses: every cation/anion pair has `sets` datasets of `points` points each.
+    """
+
+    def __init__(self, sets=3, points=30, seed=0):
+        rng = random.Random(seed)
+        self.prpls = {'plist': [{'name': PROPERTIES, 'key': ['p%02i' % i for i in range(len(PROPERTIES))]}]}
+        self.sets = {}
+        self.search = {}
+        for i, (cation, anion) in enumerate((c, a) for c in CATIONS for a in ANIONS):
+            molecule = '%s %s' % (cation, anion)
+            for j in range(sets):
+                code = 'S%03i%i' % (i, j)
+                prp = PROPERTIES[(i + j) % len(PROPERTIES)]
+                year = rng.randint(1995, 2020)
+                self.sets[code] = {
+                    'ref': {'title': 'Synthetic paper %i' % (i * sets + j),
+                            'full': 'Author, A.; Author, B. (%i) J. Synth. Data %i' % (year, i)},
+                    'components': [{'name': molecule, 'formula': 'C<SUB>%i</SUB>H<SUB>%i</SUB>N' % (i, 2 * i)}],
+                    'dhead': [['Temperature, K'], ['Pressure, kPa'], [prp]],
+                    'data': [[[round(283.15 + 5 * k, 2)], [101.325], [round(rng.uniform(1, 1500), 4), 0.01]]
+                             for k in range(points)],
+                }
+                row = [code, 'Author et al. (%i)' % year, prp, 'Liquid', 'M%04i' % i, molecule]
+                for ion in (cation, anion):
+                    self.search.setdefault(ion, {'header': SEARCH_HEADER, 'res': []})['res'].append(row)
+
+    def ilprpls(self):
+        return self.prpls
+
+    def ilsearch(self, name):
+        return self.search.get(name, {'res': []})
+
+    def ilset(self, code):
+        return self.sets.get(code)
+
+    def seeds(self):
+        """ Component names to start a crawl from.
+        """
+        return ['%s %s' % (CATIONS[0], ANIONS[0])]
+
+    def save(self, path):
+        """ Write the fixtures in the directory layout read by DirectoryFixtures.
+        """
+        for sub in ('ilsearch', 'ilset'):
+            os.makedirs(os.path.join(path, sub), exist_ok=True)
+        with open(os.path.join(path, 'ilprpls.json'), 'w') as f:
+            json.dump(self.prpls, f)
+        for name, result in self.search.items():
+            with open(os.path.join(path, 'ilsearch', name + '.json'), 'w') as f:
+                json.dump(result, f)
+        for code, data in self.sets.items():
+            with open(os.path.join(path, 'ilset', code + '.json'), 'w') as f:
+                json.dump(data, f)
+
+
+class DirectoryFixtures(Fixtures):
+    """ Recorded responses read from a directory, see Fixtures.save for the layout.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, *parts):
+        try:
+            with open(os.path.join(self.path, *parts)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def ilprpls(self):
+        return self.load('ilprpls.json')
+
+    def ilsearch(self, name):
+        return self.load('ilsearch', name + '.json') or {'res': []}
+
+    def ilset(self, code):
+        return self.load('ilset', code + '.json')
+
+    def seeds(self):
+        first = sorted(os.listdir(os.path.join(self.path, 'ilsearch')))[0]
+        result = self.load('ilsearch', first)
+        return [result['res'][0][result['header'].index('nm1')]]
+
+
+class Handler(BaseHTTPRequestHandler):
+    fixtures = None
+    latency = 0
+    jitter = 0
+    error_rate = 0
+    malformed_rate = 0
+    requests = 0
+    lock = threading.Lock()     # requests is incremented from the server's threads
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        with self.lock:
+            type(self).requests += 1
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        endpoint = url.path.rstrip('/').rsplit('/', 1)[-1]
+        if endpoint == 'ilprpls':
+            result = self.fixtures.ilprpls()
+        elif endpoint == 'ilsearch':
+            result = self.fixtures.ilsearch(query.get('cmp', [''])[0])
+        elif endpoint == 'ilset':
+            result = self.fixtures.ilset(query.get('set', [''])[0])
+        else:
+            result = None
+        if result is None:
+            return self.reply(404, b'Not found')
+        if random.random() < self.error_rate:
+            return self.reply(503, b'Service unavailable')
+
+        body = json.dumps(result).encode()
+        if random.random() < self.malformed_rate:
+            body = body[:len(body) // 2]
+        self.reply(200, body, 'application/json')
+
+    def reply(self, status, body, content_type='text/plain'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(fixtures, port=0, latency=0, jitter=0, error_rate=0, malformed_rate=0):
+    """ Start the server on a background thread, return it; its URL is http://127.0.0.1:<server.server_port>.
+    """
+    handler = type('MockHandler', (Handler,), dict(
+        fixtures=fixtures, latency=latency, jitter=jitter, error_rate=error_rate, malformed_rate=malformed_rate))
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve ILThermo-like responses locally')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--fixtures', help='directory of recorded responses (default: synthetic)')
+    parser.add_argument('--sets', type=int, default=3, help='synthetic datasets per molecule')
+    parser.add_argument('--points', type=int, default=30, help='synthetic points per dataset')
+    parser.add_argument('--save', help='write the synthetic fixtures to this directory and exit')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0, help='up to this many extra seconds, uniform')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests answered with 503')
+    parser.add_argument('--malformed-rate', type=float, default=0, help='fraction of truncated JSON responses')
+    args = parser.parse_args()
+
+    fixtures = DirectoryFixtures(args.fixtures) if args.fixtures else Fixtures(args.sets, args.points)
+    if args.save:
+        fixtures.save(args.save)
+    else:
+        server = serve(fixtures, args.port, args.latency, args.jitter, args.error_rate, args.malformed_rate)
+        print('Serving on http://127.0.0.1:%i' % server.server_port)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -0,0 +1,183 @@
+""" Multi-process crawl with a single writer
+
+Worker processes download and parse ilsearch/ilset pages, each with a few
+download threads. Species are sharded to workers by a hash of their name and
+datasets by a hash of their code. The workers send parsed records back over
+one queue. The calling process owns the frontier and the only SQLite
+connection: it decides which datasets to download, so no dataset is fetched
+twice when its cation and anion are listed at the same time, and it commits
+in batches of about `batch` points.
+
+A species is marked searched in the first commit after all datasets it
+claimed are stored, so an interrupted crawl lists it again.
+"""
+
+import time
+import zlib
+import queue
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import ilscraper
+from ilscraper import *
+
+
+def shard(key, n):
+    return zlib.crc32(key.encode()) % n
+
+
+def fetch(root, task):
+    """ Run one download task, return the message for the writer.
+    """
+    kind, name = task[:2]
+    try:
+        if kind == 'search':
+            return kind, name, get_paper_table(root + '/ILT2/ilsearch', search_params(name)), None
+        line = task[2]
+        return kind, name, (line, get_data_table(root + '/ILT2/ilset', {'set': line['code']})), None
+    except SearchFailedError:
+        return kind, name, task[2:], 'failed'
+    except SpecialCaseError:
+        return kind, name, task[2:], 'special'
+    except Exception as e:
+        return kind, name, task[2:], repr(e)
+
+
+def worker(index, tasks, results, root, threads, cache=None, refresh=False):
+    """ Process tasks until None arrives, then send the metrics of this process.
+    """
+    Log.logfile = open('ilscraper-%s-w%i.log' % (time.strftime('%y%m%d-%H%M%S'), index), 'w')
+    if cache is not None:
+        from cache import ResponseCache
+        ilscraper.response_cache = ResponseCache(**cache)
+    ilscraper.refresh_listings = refresh
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for task in iter(tasks.get, None):
+            pool.submit(fetch, root, task).add_done_callback(lambda future: results.put(future.result()))
+    results.put(('done', index, ilscraper.metrics.stages, ilscraper.metrics.counters))
+
+
+def crawl(processes=4, threads=4, root=None, batch=200000, cache=None, refresh=False):
+    """ Crawl with `processes` worker processes of `threads` download threads each.
+
+    `cache` holds the ResponseCache arguments for the workers, `refresh`
+    makes them bypass the cache for listings as in --update.
+    """
+    root = root or ilscraper.root_url
+    metrics = ilscraper.metrics
+
+    prp_table = get_prp_table(root + '/ILT2/ilprpls')
+    prp_index = put_prp_table(prp_table)
+    search_queue = init_search_queue()
+
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    tasks = [ctx.Queue() for i in range(processes)]
+    procs = [ctx.Process(target=worker, args=(i, tasks[i], results, root, threads, cache, refresh), daemon=True)
+             for i in range(processes)]
+    for proc in procs:
+        proc.start()
+
+    window = processes * threads * 4    # tasks in flight
+    backlog = deque()                   # dataset tasks not sent yet
+    claimed = set()                     # dataset codes in flight
+    waiting = {}                        # species --> number of its datasets not stored yet
+    done_species = []
+    in_flight = 0
+    points = 0
+    last_commit = time.time()
+
+    def send(task):
+        nonlocal in_flight
+        key = task[2]['code'] if task[0] == 'set' else task[1]
+        tasks[shard(key, processes)].put(task)
+        in_flight += 1
+
+    def dispatch():
+        while in_flight < window:
+            if backlog:
+                send(backlog.popleft())
+            elif not search_queue.empty():
+                name = search_queue.get()
+                if name not in waiting:
+                    waiting[name] = None
+                    send(('search', name))
+            else:
+                break
+
+    def release(name):
+        waiting[name] -= 1
+        if waiting[name] == 0:
+            del waiting[name]
+            done_species.append(name)
+
+    def commit():
+        nonlocal points, last_commit
+        for name in done_species:
+            ingest.mark_ion(name)
+        with metrics.timer('db_commit', points=points):
+            ingest.commit()
+        metrics.count('species', len(done_species))
+        done_species.clear()
+        points = 0
+        last_commit = time.time()
+        Log.flush()
+
+    def receive():
+        while True:
+            try:
+                return results.get(timeout=5)
+            except queue.Empty:
+                dead = [i for i, proc in enumerate(procs) if not proc.is_alive()]
+                if dead:
+                    raise RuntimeError('Crawl worker %s died' % dead)
+
+    try:
+        dispatch()
+        while in_flight:
+            metrics.gauge('queue_depth', search_queue.qsize() + len(waiting))
+            kind, name, result, error = receive()
+            in_flight -= 1
+
+            if kind == 'search':
+                if error:
+                    Log.write('Cannot search %s (%s). Skip this...' % (name, error))
+                    del waiting[name]
+                else:
+                    lines = [line for line in filter_paper_table(result) if line['code'] not in claimed]
+                    print('Search species: %s, %d papers, %d need to be downloaded' % (name, len(result), len(lines)))
+                    claimed.update(line['code'] for line in lines)
+                    backlog.extend(('set', name, line) for line in lines)
+                    waiting[name] = len(lines) + 1
+                    release(name)
+            else:
+                line = result[0]
+                claimed.discard(line['code'])
+                if error:
+                    Log.write('Cannot get data of %s (%s). Skipping...' % (line['code'], error))
+                elif not ingest.dataset(line['code']):
+                    paper_info, molecule_info, data_table = result[1]
+                    store_data_table(line, prp_index, paper_info, molecule_info, data_table, search_queue)
+                    points += len(data_table)
+                release(name)
+
+            metrics.gauge('pending_datasets', len(backlog) + len(claimed))
+            if points >= batch or (done_species and time.time() - last_commit > 10):
+                commit()
+            dispatch()
+        commit()
+
+        for q in tasks:
+            q.put(None)
+        for i in range(processes):
+            kind, index, stages, counters = receive()
+            metrics.merge(stages, counters)
+    finally:
+        for proc in procs:
+            proc.join(timeout=10)
+            if proc.is_alive():
+                proc.terminate()
+
+    print('Finished')
@@ -0,0 +1,143 @@
+""" T/P bounding boxes of the data per (molecule, property, paper, phase)
+
+Every DataGroup row has a box over (property id, t, p) with the same id in the
+data_bounds R*Tree, so a screen like "viscosity between 298 and 323 K below
+200 kPa" is an index probe instead of a scan of data. The scraper extends the
+boxes as it writes data (see ilthermo-scraper/ingest.py), rebuild() recomputes
+them from data, e.g. after curation moved points to other molecules.
+
+    python -m ilthermo.bounds rebuild
+    python -m ilthermo.bounds query Viscosity --T 298 323 --P 0 200
+
+The R*Tree keeps 32-bit floats and rounds boxes outwards, so a box can
+overlap a window that its points only miss by the rounding: the molecules
+returned are candidates, their points still have to be filtered.
+"""
+
+import time
+import argparse
+
+from sqlalchemy import text
+
+from .models import session
+
+T_AMBIENT = 298.15
+P_AMBIENT = 101.325
+CHUNK = 500
+
+
+def create(conn=None):
+    """ Create the R*Tree if data_group was created without it, e.g. by a foreign dialect.
+    """
+    conn = conn or session
+    conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS data_bounds USING rtree('
+                 'id, property_min, property_max, t_min, t_max, p_min, p_max)')
+
+
+def rebuild(conn=None, molecule_ids=None):
+    """ Recompute groups and boxes of all or the given molecules from data, return the number of groups.
+
+    Runs in the transaction of `conn` (default: session), the caller commits.
+    """
+    conn = conn or session
+    create(conn)
+    if molecule_ids is None:
+        conn.execute('DELETE FROM data_bounds')
+        conn.execute('DELETE FROM data_group')
+        chunks = [None]
+    else:
+        molecule_ids = sorted(set(molecule_ids))
+        chunks = [molecule_ids[i:i + CHUNK] for i in range(0, len(molecule_ids), CHUNK)]
+
+    next_id = conn.execute('SELECT coalesce(max(id), 0) + 1 FROM data_group').scalar()
+    n = 0
+    for ids in chunks:
+        where = ''
+        if ids is not None:
+            where = 'WHERE molecule_id IN (%s)' % ', '.join(str(int(id)) for id in ids)
+            conn.execute('DELETE FROM data_bounds WHERE id IN (SELECT id FROM data_group %s)' % where)
+            conn.execute('DELETE FROM data_group %s' % where)
+        rows = conn.execute(
+            'SELECT molecule_id, property_id, paper_id, phase, count(*), '
+            'min(coalesce(t, %(T)r)), max(coalesce(t, %(T)r)), min(coalesce(p, %(P)r)), max(coalesce(p, %(P)r)) '
+            'FROM data %(where)s GROUP BY molecule_id, property_id, paper_id, phase'
+            % {'T': T_AMBIENT, 'P': P_AMBIENT, 'where': where}).fetchall()
+        groups, boxes = [], []
+        for id, (mol, prp, paper, phase, count, t_min, t_max, p_min, p_max) in enumerate(rows, next_id):
+            groups.append({'id': id, 'mol': mol, 'prp': prp, 'paper': paper, 'phase': phase, 'n': count})
+            boxes.append({'id': id, 'prp': prp, 't_min': t_min, 't_max': t_max, 'p_min': p_min, 'p_max': p_max})
+        if groups:
+            conn.execute(text('INSERT INTO data_group (id, molecule_id, property_id, paper_id, phase, n) '
+                              'VALUES (:id, :mol, :prp, :paper, :phase, :n)'), groups)
+            conn.execute(text('INSERT INTO data_bounds VALUES (:id, :prp, :prp, :t_min, :t_max, :p_min, :p_max)'), boxes)
+        next_id += len(rows)
+        n += len(rows)
+    return n
+
+
+def window(value):
+    """ None, a number or a (low, high) pair with None for open ends --> (low, high).
+    """
+    if value is None:
+        return None, None
+    if isinstance(value, (int, float)):
+        return value, value
+    return tuple(value)
+
+
+def candidates(property, T=None, P=None, phase=None, min_points=1, conn=None):
+    """ {molecule id: number of points in its groups} for groups whose box overlaps the window.
+
+    `property` is a Property id or name, T and P are a value or a (low, high)
+    pair in K and kPa. The count is an upper bound of the points inside the
+    window. Rows without t or p count as T_AMBIENT and P_AMBIENT, like the
+    `Data.p == None` branch of the usual ambient filter.
+    """
+    conn = conn or session
+    if isinstance(property, str):
+        property = conn.execute(text('SELECT id FROM property WHERE name = :name'), {'name': property}).scalar()
+        if property is None:
+            return {}
+
+    conditions = ['b.property_min <= :prp', 'b.property_max >= :prp']
+    params = {'prp': property, 'min_points': min_points}
+    for column, (low, high) in (('t', window(T)), ('p', window(P))):
+        if low is not None:
+            conditions.append('b.%s_max >= :%s_low' % (column, column))
+            params[column + '_low'] = low
+        if high is not None:
+            conditions.append('b.%s_min <= :%s_high' % (column, column))
+            params[column + '_high'] = high
+    if phase is not None:
+        conditions.append('g.phase = :phase')
+        params['phase'] = phase
+
+    rows = conn.execute(text(
+        'SELECT g.molecule_id, sum(g.n) FROM data_bounds b JOIN data_group g ON g.id = b.id '
+        'WHERE %s GROUP BY g.molecule_id HAVING sum(g.n) >= :min_points' % ' AND '.join(conditions)), params)
+    return dict(rows.fetchall())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain and query the T/P bounding boxes of ilthermo.db')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild', help='recompute all boxes from data')
+    query_parser = sub.add_parser('query', help='print candidate molecules and their number of points')
+    query_parser.add_argument('property', help='property name or id, e.g. Viscosity')
+    query_parser.add_argument('--T', nargs=2, type=float, metavar=('LOW', 'HIGH'))
+    query_parser.add_argument('--P', nargs=2, type=float, metavar=('LOW', 'HIGH'))
+    query_parser.add_argument('--phase')
+    query_parser.add_argument('--min-points', type=int, default=1)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    if args.command == 'rebuild':
+        n = rebuild()
+        session.commit()
+        print('%i groups (%.1f s)' % (n, time.time() - t0))
+    else:
+        prp = int(args.property) if args.property.isdigit() else args.property
+        result = candidates(prp, args.T, args.P, args.phase, args.min_points)
+        for mol, n in sorted(result.items()):
+            print(mol, n, sep='\t')
+        print('%i molecules (%.1f ms)' % (len(result), (time.time() - t0) * 1e3))
@@ -0,0 +1,102 @@
+""" SMARTS categorization of ions
+
+An ion gets the category of the first rule whose SMARTS pattern matches it.
+The rule table is compiled once in every worker of a process pool, ions are
+classified in chunks and the categories are written with one bulk update.
+
+A rules file has one `SMARTS category` pair per line, in priority order;
+blank lines and lines starting with # are ignored.
+"""
+
+from multiprocessing import Pool
+
+import pybel
+
+from .models import session, Ion
+
+RULES = [
+    ('[n+]1ccnc1', 'cIm'),
+    ('[n+]1ccccc1', 'cPy'),
+    ('[N+]1CCCC1', 'cPyrr'),
+    ('C1CCCC[NX4+]1', 'cN4pi'),
+    ('[NX4+]', 'cN4'),
+    ('[PX4+]', 'cP4'),
+    ('N~[C+](~N)~N', 'cGua'),
+    ('S(=O)(=O)[N-]S(=O)(=O)', 'aSI'),
+    ('[B-]C#N', 'aNC[B]'),
+    ('[C-]C#N', 'aNC[C]'),
+    ('[N-]C#N', 'aNC[N]'),
+    ('[S-]C#N', 'aNC[S]'),
+    ('[Cl-]', 'a0Cl'),
+    ('[Br-]', 'a0Br'),
+    ('[I-]', 'a0I'),
+    ('[O-]c1ccccc1', 'aPhO'),
+    ('C(=O)[O-]', 'aCO2'),
+    ('[!O]S(=O)(=O)[O-]', 'aSO3'),
+    ('OS(=O)(=O)[O-]', 'aSO4'),
+    ('[O-][N+](=O)[O-]', 'aNO3'),
+    ('[O-][Cl](=O)(=O)=O', 'aClO4'),
+    ('[O-]P(=O)', 'aPO2'),
+    ('[BX4-]', 'aXB4'),
+    ('[PX6-]', 'aXP6'),
+]
+
+_compiled = None
+
+
+def load_rules(path):
+    rules = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            smarts, category = line.split()
+            rules.append((smarts, category))
+    return rules
+
+
+def compile_rules(rules):
+    global _compiled
+    _compiled = [(pybel.Smarts(smarts), category) for smarts, category in rules]
+
+
+def classify(chunk):
+    """ [(id, smiles)] --> [(id, category or None)] with the rules compiled in this process.
+    """
+    result = []
+    for id, smiles in chunk:
+        category = None
+        try:
+            py_mol = pybel.readstring('smi', smiles)
+        except (IOError, OSError, TypeError):
+            py_mol = None
+        if py_mol is not None:
+            for s, c in _compiled:
+                if s.findall(py_mol):
+                    category = c
+                    break
+        result.append((id, category))
+    return result
+
+
+def categorize(rules=None, workers=None, chunk_size=200):
+    """ Re-classify all ions that are not ignored, return {ion id: category}.
+
+    `rules` is a list of (SMARTS, category) or the path of a rules file.
+    """
+    if rules is None:
+        rules = RULES
+    elif isinstance(rules, str):
+        rules = load_rules(rules)
+
+    ions = session.query(Ion.id, Ion.smiles).filter(Ion.ignored == False).all()
+    chunks = [ions[i:i + chunk_size] for i in range(0, len(ions), chunk_size)]
+    categories = {}
+    with Pool(workers, initializer=compile_rules, initargs=(rules,)) as pool:
+        for result in pool.imap(classify, chunks):
+            categories.update(result)
+
+    session.bulk_update_mappings(Ion, [{'id': id, 'category': c} for id, c in categories.items()])
+    session.commit()
+    return categories
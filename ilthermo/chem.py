@@ -0,0 +1,60 @@
+""" Columns of Ion derived from its SMILES
+
+Parsing SMILES with pybel is slow, so canonical SMILES, formula, heavy-atom
+count, molecular weight and formal charge are computed once per distinct
+SMILES on a process pool and stored on the ion together with the sha1 of the
+SMILES they came from. Setting Ion.smiles clears that hash, and
+update_chemistry() only recomputes ions whose hash no longer matches.
+
+    python -m ilthermo.chem
+"""
+
+import hashlib
+from multiprocessing import Pool
+
+import pybel
+
+from .models import session, Ion, DERIVED
+
+
+def smiles_hash(smiles):
+    return hashlib.sha1(smiles.encode()).hexdigest()
+
+
+def derive(smiles):
+    """ Derived columns for one SMILES, all None if pybel cannot read it.
+    """
+    try:
+        m = pybel.readstring('smi', smiles)
+    except (IOError, OSError, TypeError):
+        return dict.fromkeys(DERIVED)
+    return dict(
+        canonical_smiles=m.write('can').strip(),
+        formula=m.formula,
+        n_heavy=m.OBMol.NumHvyAtoms(),
+        weight=m.molwt,
+        formal_charge=m.charge,
+    )
+
+
+def update_chemistry(workers=None, force=False):
+    """ Recompute derived columns of ions whose SMILES changed, return the number of ions updated.
+    """
+    stale = [(id, smiles) for id, smiles, hash in
+             session.query(Ion.id, Ion.smiles, Ion.smiles_hash).filter(Ion.smiles != None)
+             if force or hash != smiles_hash(smiles)]
+    if not stale:
+        return 0
+
+    unique = sorted({smiles for id, smiles in stale})
+    with Pool(workers) as pool:
+        derived = dict(zip(unique, pool.map(derive, unique, chunksize=32)))
+
+    session.bulk_update_mappings(Ion, [
+        dict(id=id, smiles_hash=smiles_hash(smiles), **derived[smiles]) for id, smiles in stale])
+    session.commit()
+    return len(stale)
+
+
+if __name__ == '__main__':
+    print('Updated %i ions' % update_chemistry())
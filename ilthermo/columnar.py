@@ -0,0 +1,292 @@
+""" Columnar snapshot of the data table
+
+export() writes every column of `data`, joined with the cation/anion ids of
+its molecule, to one .npy file per column, sorted by (molecule, property,
+phase, t). index.npy holds the [start, stop) offsets of each (molecule,
+property) group, so ColumnStore can hand out memory-mapped, zero-copy slices.
+segments.npy refines this to (molecule, property, phase), where rows are
+sorted by t, so ColumnStore.select and .nearest answer T/P window and nearest
+point queries by binary search without touching the database.
+
+Re-exporting is incremental: a GROUP BY over `data` fingerprints each
+(molecule, property) group by count, id sums and totals of value, t, p and
+phase, and only groups whose fingerprint changed since the last snapshot are
+read from the database again, so in-place edits are picked up too.
+
+    python -m ilthermo.columnar snapshot/
+"""
+
+import os
+import json
+import time
+
+import numpy as np
+from sqlalchemy import select, func, tuple_
+
+from .models import session, Molecule, Data
+
+COLUMNS = ['id', 'molecule_id', 'paper_id', 'property_id', 't', 'p', 'value', 'stderr']
+INDEX_DTYPE = [('molecule_id', 'i8'), ('property_id', 'i8'), ('start', 'i8'), ('stop', 'i8'),
+               ('count', 'i8'), ('max_id', 'i8'), ('sum_id', 'i8'),
+               ('sum_value', 'f8'), ('sum_t', 'f8'), ('sum_p', 'f8'), ('sum_phase', 'f8')]
+FINGERPRINT = ['count', 'max_id', 'sum_id', 'sum_value', 'sum_t', 'sum_p', 'sum_phase']
+SEGMENT_DTYPE = [('key', 'i8'), ('start', 'i8'), ('stop', 'i8')]
+FETCH_SIZE = 100000
+P_AMBIENT = 101.325
+
+
+def fingerprints():
+    """ Structured array of (molecule_id, property_id) and the FINGERPRINT columns per group.
+    """
+    rows = session.query(Data.molecule_id, Data.property_id, func.count(Data.id), func.max(Data.id), func.sum(Data.id),
+                         func.total(Data.value), func.total(Data.t), func.total(func.coalesce(Data.p, -1)),
+                         func.total(func.length(Data.phase) * func.unicode(Data.phase))) \
+        .group_by(Data.molecule_id, Data.property_id).all()
+    fp = np.zeros(len(rows), dtype=INDEX_DTYPE)
+    for name, col in zip(['molecule_id', 'property_id'] + FINGERPRINT, zip(*rows) if rows else []):
+        fp[name] = [x if x is not None else -1 for x in col]
+    return fp
+
+
+def fetch(groups, phases):
+    """ Read the rows of the given (molecule_id, property_id) groups, or all rows if groups is None.
+    """
+    columns = [getattr(Data, c) for c in COLUMNS] + [Data.phase]
+    queries = []
+    if groups is None:
+        queries.append(select(columns))
+    else:
+        pairs = sorted(set(zip(groups['molecule_id'].tolist(), groups['property_id'].tolist())))
+        for i in range(0, len(pairs), 400):     # stay below SQLite's bound parameter limit
+            queries.append(select(columns).where(tuple_(Data.molecule_id, Data.property_id).in_(pairs[i:i + 400])))
+
+    numeric, phase = [], []
+    for query in queries:
+        result = session.connection().execute(query)
+        while True:
+            rows = result.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            numeric.append(np.array([row[:-1] for row in rows], dtype=float).reshape(-1, len(COLUMNS)))
+            phase.append(np.array([phases.setdefault(row[-1], len(phases)) for row in rows], dtype='i2'))
+
+    numeric = np.concatenate(numeric) if numeric else np.zeros((0, len(COLUMNS)))
+    cols = {c: numeric[:, i] for i, c in enumerate(COLUMNS)}
+    for c in ['id', 'molecule_id', 'paper_id', 'property_id']:
+        cols[c] = np.nan_to_num(cols[c], nan=-1).astype('i8')
+    cols['phase'] = np.concatenate(phase) if phase else np.zeros(0, dtype='i2')
+    return cols
+
+
+def build_index(cols, fp):
+    """ Offsets of each (molecule, property) group in sorted columns, with fingerprints.
+    """
+    mol, prp = cols['molecule_id'], cols['property_id']
+    starts = np.flatnonzero(np.r_[True, (mol[1:] != mol[:-1]) | (prp[1:] != prp[:-1])]) if len(mol) else np.zeros(0, int)
+    index = np.zeros(len(starts), dtype=INDEX_DTYPE)
+    index['molecule_id'], index['property_id'] = mol[starts], prp[starts]
+    index['start'], index['stop'] = starts, np.r_[starts[1:], len(mol)]
+    pos = np.searchsorted(group_key(fp), group_key(index))
+    for name in FINGERPRINT:
+        index[name] = fp[name][pos]
+    return index
+
+
+def group_key(a):
+    return a['molecule_id'] * 2**20 + a['property_id']
+
+
+def segment_key(molecule_id, property_id, phase):
+    return (molecule_id * 2**20 + property_id) * 2**8 + phase
+
+
+def build_segments(cols):
+    """ Offsets of each (molecule, property, phase) segment in sorted columns, sorted by key.
+    """
+    key = segment_key(cols['molecule_id'], cols['property_id'], cols['phase'].astype('i8'))
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if len(key) else np.zeros(0, int)
+    segments = np.zeros(len(starts), dtype=SEGMENT_DTYPE)
+    segments['key'], segments['start'], segments['stop'] = key[starts], starts, np.r_[starts[1:], len(key)]
+    return segments
+
+
+def unchanged(fp, old_index):
+    """ Mask of the groups in `fp` with the same fingerprint in `old_index`.
+    """
+    if len(old_index) == 0 or not set(FINGERPRINT) <= set(old_index.dtype.names):
+        return np.zeros(len(fp), bool)
+    keys = group_key(old_index)
+    order = np.argsort(keys)
+    pos = order[np.searchsorted(keys, group_key(fp), sorter=order).clip(0, len(keys) - 1)]
+    same = keys[pos] == group_key(fp)
+    for name in FINGERPRINT:
+        same &= old_index[name][pos] == fp[name]
+    return same
+
+
+def save(path, name, array):
+    tmp = os.path.join(path, '.%s.tmp.npy' % name)
+    np.save(tmp, array)
+    os.replace(tmp, os.path.join(path, name + '.npy'))     # readers keep their old mapping
+
+
+def export(path, full=False):
+    """ Write or update the snapshot in directory `path`, return the number of groups re-read.
+    """
+    os.makedirs(path, exist_ok=True)
+    fp = fingerprints()
+    fp.sort(order=['molecule_id', 'property_id'])
+
+    old = None if full else ColumnStore.open_or_none(path)
+    if old is None:
+        phases = {}
+        cols = fetch(None, phases)
+        changed = len(fp)
+    else:
+        phases = {name: i for i, name in enumerate(old.meta['phases'])}
+        same = unchanged(fp, old.index)
+        kept = old.index[np.isin(group_key(old.index), group_key(fp[same]))]
+        keep = np.zeros(len(old.columns['id']), bool)
+        for start, stop in zip(kept['start'], kept['stop']):
+            keep[start:stop] = True
+
+        new = fetch(fp[~same], phases)
+        cols = {c: np.concatenate([np.asarray(old.columns[c])[keep], new[c]]) for c in COLUMNS + ['phase']}
+        changed = int((~same).sum())
+        old.close()
+
+    order = np.lexsort((cols['id'], cols['t'], cols['phase'], cols['property_id'], cols['molecule_id']))
+    cols = {c: a[order] for c, a in cols.items()}
+
+    ions = np.array(session.query(Molecule.id, Molecule.cation_id, Molecule.anion_id).all(), dtype=float).reshape(-1, 3)
+    ions = np.nan_to_num(ions, nan=-1).astype('i8')
+    lookup = np.full((max(ions[:, 0].max(initial=0), cols['molecule_id'].max(initial=0)) + 1, 2), -1, dtype='i8')
+    lookup[ions[:, 0]] = ions[:, 1:]
+    cols['cation_id'], cols['anion_id'] = lookup[cols['molecule_id'].clip(0)].T
+
+    for name, array in cols.items():
+        save(path, name, array)
+    save(path, 'index', build_index(cols, fp))
+    save(path, 'segments', build_segments(cols))
+    meta = {
+        'columns': list(cols),
+        'phases': sorted(phases, key=phases.get),
+        'rows': len(cols['id']),
+        'max_id': int(cols['id'].max(initial=0)),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    with open(os.path.join(path, '.meta.json.tmp'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(os.path.join(path, '.meta.json.tmp'), os.path.join(path, 'meta.json'))
+    return changed
+
+
+class ColumnStore:
+    """ Read-only view of a snapshot, all columns memory-mapped.
+
+    >>> store = ColumnStore('snapshot')
+    >>> rows = store.group(molecule_id, property_id)     # dict of zero-copy column slices
+    >>> rows = store.select(molecule_id, property_id, 'Liquid', T=(290, 350), P=(0, 200))
+    >>> row = store.nearest(molecule_id, property_id, 298.15)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.columns = {c: np.load(os.path.join(path, c + '.npy'), mmap_mode='r') for c in self.meta['columns']}
+        self.index = np.load(os.path.join(path, 'index.npy'))
+        self.offsets = {(int(m), int(p)): (int(start), int(stop)) for m, p, start, stop in
+                        zip(self.index['molecule_id'], self.index['property_id'], self.index['start'], self.index['stop'])}
+        segments = os.path.join(path, 'segments.npy')
+        self.segments = np.load(segments) if os.path.exists(segments) else build_segments(self.columns)
+
+    @classmethod
+    def load(cls, path='snapshot', refresh=False):
+        """ Open the snapshot in `path`, exporting it first if it is missing or `refresh` is set.
+        """
+        if refresh or not os.path.exists(os.path.join(path, 'meta.json')):
+            export(path)
+        return cls(path)
+
+    @classmethod
+    def open_or_none(cls, path):
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            return None
+        return cls(path)
+
+    def close(self):
+        self.columns = {}
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def group(self, molecule_id, property_id, columns=None):
+        """ Columns of one (molecule, property) group, sorted by phase and t; empty if absent.
+        """
+        start, stop = self.offsets.get((molecule_id, property_id), (0, 0))
+        return {c: self.columns[c][start:stop] for c in (columns or self.columns)}
+
+    def phase_code(self, phase):
+        return self.meta['phases'].index(phase)
+
+    def segment(self, molecule_id, property_id, phase='Liquid'):
+        """ [start, stop) of the rows of one (molecule, property, phase), sorted by t.
+        """
+        if phase not in self.meta['phases']:
+            return 0, 0
+        key = segment_key(molecule_id, property_id, self.phase_code(phase))
+        i = np.searchsorted(self.segments['key'], key)
+        if i == len(self.segments) or self.segments['key'][i] != key:
+            return 0, 0
+        return int(self.segments['start'][i]), int(self.segments['stop'][i])
+
+    def window(self, molecule_id, property_id, phase='Liquid', T=None, P=None):
+        """ Absolute row numbers of a segment within T = (min, max) and P = (min, max), inclusive.
+
+        Rows without pressure count as P_AMBIENT.
+        """
+        start, stop = self.segment(molecule_id, property_id, phase)
+        if T is not None:
+            t = self.columns['t'][start:stop]
+            start, stop = start + np.searchsorted(t, T[0], 'left'), start + np.searchsorted(t, T[1], 'right')
+        rows = np.arange(start, stop)
+        if P is not None:
+            p = np.nan_to_num(self.columns['p'][start:stop], nan=P_AMBIENT)
+            rows = rows[(p >= P[0]) & (p <= P[1])]
+        return rows
+
+    def select(self, molecule_id, property_id, phase='Liquid', T=None, P=None, columns=None):
+        """ Columns of the rows in a T/P window, see window(); slices are zero-copy without a P window.
+        """
+        if P is None:
+            rows = self.window(molecule_id, property_id, phase, T)
+            rows = slice(rows[0], rows[-1] + 1) if len(rows) else slice(0, 0)
+        else:
+            rows = self.window(molecule_id, property_id, phase, T, P)
+        return {c: self.columns[c][rows] for c in (columns or self.columns)}
+
+    def nearest(self, molecule_id, property_id, T, phase='Liquid', P=None):
+        """ {column: value} of the row with t nearest to T (ties to the lower t), None if there is none.
+        """
+        rows = self.window(molecule_id, property_id, phase, P=P)
+        t = self.columns['t'][rows]
+        n = np.searchsorted(t, np.nan) if len(t) else 0    # rows without t are sorted last
+        if n == 0:
+            return None
+        i = np.searchsorted(t[:n], T)
+        if i == n or i > 0 and T - t[i - 1] <= t[i] - T:
+            i -= 1
+        return {c: self.columns[c][rows[i]].item() for c in self.columns}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Export the data table to memory-mappable columns')
+    parser.add_argument('path', nargs='?', default='snapshot')
+    parser.add_argument('--full', action='store_true', help='ignore the previous snapshot')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    n = export(args.path, args.full)
+    print('Re-exported %i groups in %.1f s' % (n, time.time() - t0))
@@ -0,0 +1,213 @@
+""" Cross-paper consensus of overlapping data and outlier scores per paper
+
+Data of one (molecule, property, phase) from several papers is compared on a
+shared temperature grid. Each paper's series is interpolated linearly onto
+the grid points inside its T range, but not across gaps wider than
+`max_gap`. The consensus at a grid point is the median over papers, and its
+spread the median absolute deviation (MAD). Every paper then gets
+
+    deviation   median over its grid points of (value - consensus) / |consensus|
+    score       median of (value - consensus) / scale, a modified z-score
+    outlier     |score| > z_max
+
+where scale = 1.4826 MAD, but at least min_deviation |consensus| / z_max, so
+papers within min_deviation of the consensus are never flagged and papers
+republishing the same data (MAD = 0) still get a finite score. Scores only
+use grid points with at least three papers.
+
+Only points at ambient pressure (no p or p < 200 kPa) take part. All groups
+are handled at once by sorting and np.bincount, the results replace the
+consensus table, and extract.load_points(outliers=False) leaves out the
+points of flagged papers. dedup.merge_ions rebuilds the rows of the
+molecules it merges with the default parameters.
+
+    python -m ilthermo.consensus [--step 5] [--max-gap 20]
+"""
+
+import time
+import argparse
+
+import numpy as np
+from sqlalchemy import select, and_, or_
+
+from .models import session, Data, Consensus
+
+CHUNK = 500     # molecule ids per IN (...), below SQLite's variable limit
+
+
+def chunks(molecule_ids):
+    """ Sorted unique ids in lists of at most CHUNK, [None] for all molecules.
+    """
+    if molecule_ids is None:
+        return [None]
+    ids = sorted(set(molecule_ids))
+    return [ids[i:i + CHUNK] for i in range(0, len(ids), CHUNK)]
+
+
+def group_median(g, x):
+    """ Median of x per group, `g` numbers the groups 0..m-1 and none is empty.
+    """
+    order = np.lexsort((x, g))
+    xs = x[order]
+    counts = np.bincount(g)
+    start = np.cumsum(counts) - counts
+    return (xs[start + (counts - 1) // 2] + xs[start + counts // 2]) / 2
+
+
+def dense(keys):
+    """ Unique rows of `keys` and the index of every row among them.
+    """
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    return unique, inverse.reshape(-1)
+
+
+def load_series(molecule_ids=None):
+    """ Return (keys, s, t, value, phases) for ambient points of groups with at least two papers.
+
+    keys holds [molecule_id, property_id, phase index, paper_id] per series
+    and s the series of every point. Points are sorted by series and t, and
+    repeated temperatures of one series are averaged.
+    """
+    rows = []
+    for ids in chunks(molecule_ids):
+        condition = and_(Data.t != None, Data.value != None, or_(Data.p == None, Data.p < 200))
+        if ids is not None:
+            condition = and_(condition, Data.molecule_id.in_(ids))
+        rows += session.execute(select([Data.molecule_id, Data.property_id, Data.paper_id, Data.t, Data.value,
+                                        Data.phase]).where(condition)).fetchall()
+    phases, phase_idx = np.unique(np.array([row[5] or '' for row in rows], dtype=str), return_inverse=True)
+    numbers = np.array([row[:5] for row in rows], dtype=float).reshape(-1, 5)
+    cols = np.stack([numbers[:, 0], numbers[:, 1], phase_idx.reshape(-1), numbers[:, 2]], -1).astype('i8')
+    t, value = numbers[:, 3], numbers[:, 4]
+
+    keys, s = dense(cols)
+    group = dense(keys[:, :3])[1]
+    keep = (np.bincount(group)[group] >= 2)[s] & np.isfinite(value)
+    if not keep.any():
+        return keys[:0], np.zeros(0, 'i8'), np.zeros(0), np.zeros(0), phases
+    keys, s = dense(cols[keep])
+    t, value = t[keep], value[keep]
+
+    # average repeated (series, t)
+    order = np.lexsort((t, s))
+    s, t, value = s[order], t[order], value[order]
+    first = np.flatnonzero(np.concatenate([[True], (np.diff(s) != 0) | (np.diff(t) != 0)]))
+    counts = np.diff(np.concatenate([first, [len(s)]]))
+    value = np.add.reduceat(value, first) / counts
+    return keys, s[first], t[first], value, phases
+
+
+def interpolate(s, t, value, step, max_gap):
+    """ Values of every series at the grid points T = k * step inside its T range.
+
+    Return (series, k, value) of the grid points that are measured or lie
+    between two points at most max_gap apart.
+    """
+    n = s.max() + 1
+    first = np.searchsorted(s, np.arange(n))
+    last = np.searchsorted(s, np.arange(n), side='right') - 1
+    lo = np.ceil(t[first] / step).astype('i8')
+    hi = np.floor(t[last] / step).astype('i8')
+    counts = np.maximum(hi - lo + 1, 0)
+
+    gs = np.repeat(np.arange(n), counts)
+    k = lo[gs] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    span = np.ceil(t.max() - min(t.min(), 0) + step + 1)    # integer, so keys of grid-aligned t are exact
+    key = s * span + t
+    query = gs * span + k * step
+    right = np.minimum(np.searchsorted(key, query), len(key) - 1)
+    exact = np.isclose(key[right], query, rtol=0, atol=1e-6)
+    left = np.where(exact, right, right - 1)
+    gap = t[right] - t[left]
+    w = np.divide(k * step - t[left], gap, out=np.zeros(len(gap)), where=gap > 0)
+    ok = exact | (gap <= max_gap)
+    return gs[ok], k[ok], (value[left] + w * (value[right] - value[left]))[ok]
+
+
+def consensus(step=5., max_gap=20., z_max=3.5, min_deviation=0.01, molecule_ids=None):
+    """ Score every paper against the others, return a list of Consensus row dicts.
+    """
+    keys, s, t, value, phases = load_series(molecule_ids)
+    if not len(s):
+        return []
+    gs, k, v = interpolate(s, t, value, step, max_gap)
+    group = dense(keys[:, :3])[1]
+
+    # cells: (group, grid point) with at least two papers
+    cells, c = dense(np.stack([group[gs], k], -1))
+    n_papers = np.bincount(c)
+    keep = n_papers[c] >= 2
+    gs, v = gs[keep], v[keep]
+    cells, c = dense(cells[c[keep]])
+    n_papers = np.bincount(c)
+
+    med = group_median(c, v)
+    mad = group_median(c, np.abs(v - med[c]))
+    scale = np.maximum(1.4826 * mad, min_deviation * np.abs(med) / z_max)
+    rel = np.divide(v - med[c], np.abs(med[c]), out=np.zeros(len(v)), where=med[c] != 0)
+    z = np.divide(v - med[c], scale[c], out=np.zeros(len(v)), where=scale[c] > 0)
+
+    series, si = np.unique(gs, return_inverse=True)
+    si = si.reshape(-1)
+    deviation = group_median(si, rel)
+    n_grid = np.bincount(si)
+    most = np.zeros(len(series), int)
+    np.maximum.at(most, si, n_papers[c])
+
+    scored = n_papers[c] >= 3
+    score = np.full(len(series), np.nan)
+    if scored.any():
+        with_score, wi = np.unique(si[scored], return_inverse=True)
+        score[with_score] = group_median(wi.reshape(-1), z[scored])
+
+    rows = []
+    for i, (mol, prp, phase, paper) in enumerate(keys[series].tolist()):
+        rows.append({
+            'molecule_id': mol, 'property_id': prp, 'phase': phases[phase] or None, 'paper_id': paper,
+            'n_grid': int(n_grid[i]), 'n_papers': int(most[i]), 'deviation': float(deviation[i]),
+            'score': None if np.isnan(score[i]) else float(score[i]),
+            'outlier': bool(abs(score[i]) > z_max) if not np.isnan(score[i]) else False,
+        })
+    return rows
+
+
+def rebuild(molecule_ids=None, **kwargs):
+    """ Replace the consensus rows of all or the given molecules, return the rows.
+
+    Runs in the transaction of session, the caller commits.
+    """
+    rows = consensus(molecule_ids=molecule_ids, **kwargs)
+    for ids in chunks(molecule_ids):
+        query = session.query(Consensus)
+        if ids is not None:
+            query = query.filter(Consensus.molecule_id.in_(ids))
+        query.delete(synchronize_session=False)
+    if rows:
+        session.execute(Consensus.__table__.insert(), rows)
+    return rows
+
+
+def update(**kwargs):
+    """ Recompute the consensus table, return (papers scored, outliers).
+    """
+    try:
+        rows = rebuild(**kwargs)
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    return len(rows), sum(row['outlier'] for row in rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score papers against the cross-paper consensus')
+    parser.add_argument('--step', type=float, default=5, help='temperature grid step, K')
+    parser.add_argument('--max-gap', type=float, default=20, help='do not interpolate across wider gaps, K')
+    parser.add_argument('--z-max', type=float, default=3.5, help='modified z-score above which a paper is an outlier')
+    parser.add_argument('--min-deviation', type=float, default=0.01,
+                        help='relative deviation below which a paper is never an outlier')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    n, outliers = update(step=args.step, max_gap=args.max_gap, z_max=args.z_max, min_deviation=args.min_deviation)
+    print('%i papers scored, %i outliers (%.1f s)' % (n, outliers, time.time() - t0))
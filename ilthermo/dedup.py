@@ -0,0 +1,88 @@
+""" Merge ions that describe the same species
+
+Ions are grouped by SMILES (or canonical SMILES, or InChIKey), and in every
+group the ion used by most molecules is kept. Molecules are repointed to the
+kept ions with bulk UPDATEs; a molecule that would then duplicate another
+(cation_id, anion_id) pair is merged into it, moving its data points along.
+Everything runs in one transaction.
+"""
+
+from multiprocessing import Pool
+
+from sqlalchemy import func, or_, bindparam
+
+from .models import session, Ion, Molecule, Data
+from . import bounds, consensus
+
+
+def inchikey(smiles):
+    import pybel    # only the inchikey key needs openbabel
+    try:
+        return pybel.readstring('smi', smiles).write('inchikey').strip() or None
+    except (IOError, OSError, TypeError):
+        return None
+
+
+def ion_groups(key='smiles'):
+    """ Return {ion id: kept ion id} for every ion with a duplicate.
+
+    `key` is 'smiles', 'canonical' (Ion.canonical_smiles, see ilthermo.chem)
+    or 'inchikey'.
+    """
+    column = Ion.canonical_smiles if key == 'canonical' else Ion.smiles
+    rows = session.query(Ion.id, column, func.count(Molecule.id)) \
+        .outerjoin(Molecule, or_(Molecule.cation_id == Ion.id, Molecule.anion_id == Ion.id)) \
+        .filter(column != None) \
+        .group_by(Ion.id).all()
+
+    if key == 'inchikey':
+        smiles = sorted({row[1] for row in rows})
+        with Pool() as pool:
+            keys = dict(zip(smiles, pool.map(inchikey, smiles, chunksize=32)))
+        rows = [(id, keys[smi] or smi, n) for id, smi, n in rows]
+
+    kept = {}
+    for id, k, n in sorted(rows, key=lambda row: (-row[2], row[0])):
+        kept.setdefault(k, id)
+    return {id: kept[k] for id, k, n in rows if kept[k] != id}
+
+
+def merge_ions(mapping):
+    """ Repoint molecules and data according to {ion id: kept ion id}, return (updated, merged) molecules.
+    """
+    molecules = session.query(Molecule.id, Molecule.cation_id, Molecule.anion_id).order_by(Molecule.id).all()
+    owner = {}      # (cation_id, anion_id) after remapping --> molecule kept for it
+    for id, cation_id, anion_id in molecules:
+        if cation_id not in mapping and anion_id not in mapping:
+            owner[(cation_id, anion_id)] = id
+
+    updated, merged = [], []
+    for id, cation_id, anion_id in molecules:
+        if cation_id not in mapping and anion_id not in mapping:
+            continue
+        pair = (mapping.get(cation_id, cation_id), mapping.get(anion_id, anion_id))
+        if pair in owner:
+            merged.append({'_old': id, '_new': owner[pair]})
+        else:
+            owner[pair] = id
+            updated.append({'_id': id, '_cation': pair[0], '_anion': pair[1]})
+
+    molecule, data, ion = Molecule.__table__, Data.__table__, Ion.__table__
+    try:
+        if merged:
+            session.execute(data.update().where(data.c.molecule_id == bindparam('_old'))
+                            .values(molecule_id=bindparam('_new')), merged)
+            session.execute(molecule.delete().where(molecule.c.id == bindparam('_old')), merged)
+            bounds.rebuild(session, [m['_old'] for m in merged] + [m['_new'] for m in merged])
+            consensus.rebuild([m['_old'] for m in merged] + [m['_new'] for m in merged])
+        if updated:
+            session.execute(molecule.update().where(molecule.c.id == bindparam('_id'))
+                            .values(cation_id=bindparam('_cation'), anion_id=bindparam('_anion')), updated)
+        if mapping:
+            session.execute(ion.update().where(ion.c.id == bindparam('_id')).values(duplicate=bindparam('_kept')),
+                            [{'_id': id, '_kept': kept} for id, kept in mapping.items()])
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    return len(updated), len(merged)
@@ -0,0 +1,110 @@
+""" Set-based extraction of property tables
+
+All points of the requested properties for the selected molecules are read
+with one query into NumPy arrays, and the point nearest to each target
+temperature is picked per molecule without touching ORM objects.
+"""
+
+import numpy as np
+from sqlalchemy import or_, and_, exists
+from sqlalchemy.orm import aliased
+
+from .models import session, Molecule, Ion, Data, Property, Consensus
+
+# key --> (property name, value scale, liquid at ambient pressure only)
+PROPERTIES = {
+    'density': ('Density', 1e-3, True),
+    'viscosity': ('Viscosity', 1e3, True),
+    'cp': ('Heat capacity at constant pressure', 1, True),
+    'diffusion': ('Self-diffusion coefficient', 1, True),
+    'hvap': ('Enthalpy of vaporization or sublimation', 1, False),
+}
+
+ID, MOL, PRP, TEMP, PRES, VALUE = range(6)
+
+
+def load_points(keys, selected=True, ambient=True, outliers=True):
+    """ Return {key: property id} and an array of [id, molecule_id, property_id, t, p, value] rows.
+
+    Liquid-only properties are restricted to p < 200 kPa unless `ambient` is False.
+    Unless `outliers` is True, points of papers flagged by ilthermo.consensus are left out.
+    """
+    names = {PROPERTIES[key][0]: key for key in keys}
+    prp_ids = {names[name]: id for id, name in
+               session.query(Property.id, Property.name).filter(Property.name.in_(names))}
+    liquid = [prp_ids[key] for key in prp_ids if PROPERTIES[key][2]]
+    other = [prp_ids[key] for key in prp_ids if not PROPERTIES[key][2]]
+
+    conditions = [Data.property_id.in_(liquid), Data.phase == 'Liquid']
+    if ambient:
+        conditions.append(or_(Data.p == None, Data.p < 200))
+    query = session.query(Data.id, Data.molecule_id, Data.property_id, Data.t, Data.p, Data.value) \
+        .filter(or_(and_(*conditions), Data.property_id.in_(other)))
+    if selected:
+        query = query.join(Molecule, Data.molecule_id == Molecule.id).filter(Molecule.selected == True)
+    if not outliers:
+        query = query.filter(~exists().where(and_(
+            Consensus.molecule_id == Data.molecule_id, Consensus.property_id == Data.property_id,
+            Consensus.phase == Data.phase, Consensus.paper_id == Data.paper_id, Consensus.outlier == True)))
+
+    points = np.array(query.all(), dtype=float).reshape(-1, 6)
+    return prp_ids, points
+
+
+def nearest(points, prp_id, T=None):
+    """ Rows of `points` nearest to T for each molecule, or at the lowest T if T is None.
+
+    Ties go to the lower temperature, then to the lower data id.
+    """
+    points = points[points[:, PRP] == prp_id]
+    dist = points[:, TEMP] if T is None else np.abs(points[:, TEMP] - T)
+    order = np.lexsort((points[:, ID], points[:, TEMP], dist, points[:, MOL]))
+    first = np.unique(points[order, MOL], return_index=True)[1]
+    return points[order[first]]
+
+
+def molecule_info(selected=True):
+    """ molecule id --> (id, cation smiles, anion smiles, cation category, anion category, name)
+    """
+    cation = aliased(Ion)
+    anion = aliased(Ion)
+    query = session.query(Molecule.id, cation.smiles, anion.smiles, cation.category, anion.category, Molecule.name) \
+        .join(cation, Molecule.cation_id == cation.id) \
+        .join(anion, Molecule.anion_id == anion.id)
+    if selected:
+        query = query.filter(Molecule.selected == True)
+    return {row[0]: row for row in query}
+
+
+def format_line(mol, T, P, val):
+    id, cation_smiles, anion_smiles, cation_category, anion_category, name = mol
+    return '%i %s.%s %i %i %.3f 1.0 %s %s %s %s %s' % (
+        id, cation_smiles, anion_smiles, T, P, val, cation_smiles, anion_smiles,
+        cation_category, anion_category, name.replace(' ', '_'))
+
+
+def extract(tables, selected=True, outliers=True):
+    """ Build several property tables in one pass.
+
+    `tables` is a list of (property key, T) with keys from PROPERTIES; T is
+    ignored for 'hvap', which reports the lowest-temperature point. With
+    `outliers` False, papers flagged by ilthermo.consensus are skipped.
+    Return {(key, T): list of formatted lines}.
+    """
+    prp_ids, points = load_points({key for key, T in tables}, selected, outliers=outliers)
+    mols = molecule_info(selected)
+
+    results = {}
+    for key, T in tables:
+        lines = []
+        if key in prp_ids:
+            scale, liquid = PROPERTIES[key][1:]
+            rows = nearest(points, prp_ids[key], T if key != 'hvap' else None)
+            if liquid:
+                P = np.where(np.isnan(rows[:, PRES]), 1, rows[:, PRES] // 100)
+            else:
+                P = np.zeros(len(rows))
+            for row, p in zip(rows, P):
+                lines.append(format_line(mols[int(row[MOL])], int(row[TEMP]), int(p), row[VALUE] * scale))
+        results[(key, T)] = lines
+    return results
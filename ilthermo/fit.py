@@ -0,0 +1,205 @@
+""" T/P correlations of liquid properties stored in Molecule.fit
+
+    density:   rho = a + b * T + c * P            (kg/m3, K, kPa)
+    viscosity: ln(eta) = A + B / (T - C)   (VFT, Pa s, K, ambient pressure)
+
+All molecules of a chunk are fitted at once: least-squares sums are
+accumulated per molecule with np.bincount, and chunks run on a process pool.
+Molecule.fit holds a JSON object {property key: {'func', 'coef', 'n', 'rmsd',
+'r2', 't_range', 'p_range'}} which evaluate() reads without the data table.
+"""
+
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .models import session, Molecule
+from .extract import load_points, MOL, PRP, TEMP, PRES, VALUE
+
+P_AMBIENT = 101.325
+
+FUNCTIONS = {
+    'linear': lambda c, T, P: c[0] + c[1] * T + c[2] * P,
+    'vft': lambda c, T, P: np.exp(c[0] + c[1] / (T - c[2])),
+}
+
+# property key --> correlation
+CORRELATIONS = {
+    'density': 'linear',
+    'viscosity': 'vft',
+}
+
+
+def group_sums(g, m, *columns):
+    return [np.bincount(g, weights=col, minlength=m) for col in columns]
+
+
+def fit_linear(g, m, T, P, y):
+    """ Least squares y = a + b*T + c*P for m molecules, `g` maps points to molecules.
+
+    Columns are centered per molecule and solved with a pseudo-inverse, so a
+    molecule measured at a single pressure simply gets c = 0.
+    """
+    n, Tm, Pm, ym = group_sums(g, m, np.ones_like(T), T, P, y)
+    Tm, Pm, ym = Tm / n, Pm / n, ym / n
+    dT, dP, dy = T - Tm[g], P - Pm[g], y - ym[g]
+    STT, STP, SPP, STy, SPy = group_sums(g, m, dT * dT, dT * dP, dP * dP, dT * dy, dP * dy)
+
+    M = np.stack([np.stack([STT, STP], -1), np.stack([STP, SPP], -1)], -2)
+    b, c = np.einsum('mij,mj->mi', np.linalg.pinv(M), np.stack([STy, SPy], -1)).T
+    a = ym - b * Tm - c * Pm
+    return np.stack([a, b, c], -1)
+
+
+def fit_vft(g, m, T, y, grid=np.arange(0, 300, 5.), refine=np.arange(-5, 5.01, 0.25)):
+    """ Fit ln(eta) = A + B / (T - C) by scanning C; for a fixed C the fit is linear.
+
+    Molecules with less than three temperatures get the Arrhenius form (C = 0).
+    """
+    n, Tmin = group_sums(g, m, np.ones_like(T))[0], np.full(m, np.inf)
+    np.minimum.at(Tmin, g, T)
+    distinct = np.bincount(np.unique(np.stack([g, T], -1), axis=0)[:, 0].astype(int), minlength=m)
+
+    def scan(C):
+        x = 1 / (T - C[g])
+        xm, ym = group_sums(g, m, x, y)
+        xm, ym = xm / n, ym / n
+        dx, dy = x - xm[g], y - ym[g]
+        Sxx, Sxy = group_sums(g, m, dx * dx, dx * dy)
+        B = np.divide(Sxy, Sxx, out=np.zeros(m), where=Sxx > 0)
+        A = ym - B * xm
+        sse = group_sums(g, m, (A[g] + B[g] * x - y) ** 2)[0]
+        sse[C > Tmin - 10] = np.inf
+        return np.stack([A, B, C], -1), sse
+
+    can_scan = distinct >= 3
+
+    def try_C(C):
+        coef, sse = scan(np.where(can_scan, np.maximum(C, 0), 0))
+        better = sse < best_sse
+        best[better], best_sse[better] = coef[better], sse[better]
+
+    # C close to a measured T overflows or divides by zero; such C get sse inf or nan and never win
+    with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+        best, best_sse = scan(np.zeros(m))
+        for C in grid:
+            try_C(np.full(m, C))
+        coarse = best[:, 2].copy()
+        for dC in refine:
+            try_C(coarse + dC)
+    return best
+
+
+def fit_chunk(args):
+    """ Fit one property for a chunk of molecules, return [(molecule id, fit dict)].
+    """
+    key, mol, T, P, value = args
+    mol_ids, g = np.unique(mol, return_inverse=True)
+    m = len(mol_ids)
+    func = CORRELATIONS[key]
+
+    if func == 'linear':
+        coef = fit_linear(g, m, T, P, value)
+    else:
+        coef = fit_vft(g, m, T, np.log(value))
+    pred = FUNCTIONS[func](coef[g].T, T, P)
+
+    n, sse, sst, ym = group_sums(g, m, np.ones_like(T), (pred - value) ** 2, value ** 2, value)
+    sst = sst - ym ** 2 / n
+    r2 = 1 - np.divide(sse, sst, out=np.zeros(m), where=sst > 0)
+    Tmin, Tmax, Pmin, Pmax = np.full(m, np.inf), np.full(m, -np.inf), np.full(m, np.inf), np.full(m, -np.inf)
+    np.minimum.at(Tmin, g, T)
+    np.maximum.at(Tmax, g, T)
+    np.minimum.at(Pmin, g, P)
+    np.maximum.at(Pmax, g, P)
+
+    return [(int(mol_ids[i]), {
+        'func': func,
+        'coef': coef[i].tolist(),
+        'n': int(n[i]),
+        'rmsd': float(np.sqrt(sse[i] / n[i])),
+        'r2': float(r2[i]),
+        't_range': [float(Tmin[i]), float(Tmax[i])],
+        'p_range': [float(Pmin[i]), float(Pmax[i])],
+    }) for i in range(m)]
+
+
+def split_chunks(key, points, chunk_size):
+    """ Yield fit_chunk arguments, never splitting one molecule across chunks.
+    """
+    points = points[np.argsort(points[:, MOL], kind='stable')]
+    bounds = np.flatnonzero(np.diff(points[:, MOL])) + 1
+    starts = np.concatenate([[0], bounds])[::chunk_size]
+    for start, end in zip(starts, np.concatenate([starts[1:], [len(points)]])):
+        p = points[start:end]
+        yield key, p[:, MOL].astype(int), p[:, TEMP], p[:, PRES], p[:, VALUE]
+
+
+def fit_all(keys=('density', 'viscosity'), selected=True, workers=None, chunk_size=200, min_points=2):
+    """ Fit correlations for all (selected) molecules and store them in Molecule.fit.
+
+    Only the `keys` entries of molecules fitted in this call are replaced,
+    fits of other properties and molecules are kept. Return the number of
+    molecules with at least one fit.
+    """
+    prp_ids, points = load_points(keys, selected, ambient=False)
+    points[:, PRES] = np.where(np.isnan(points[:, PRES]), P_AMBIENT, points[:, PRES])
+    points = points[~np.isnan(points[:, TEMP]) & (points[:, VALUE] > 0)]
+
+    tasks = []
+    for key, prp_id in prp_ids.items():
+        p = points[points[:, PRP] == prp_id]
+        if CORRELATIONS[key] == 'vft':
+            p = p[p[:, PRES] < 200]
+        counts = np.bincount(p[:, MOL].astype(int))
+        p = p[counts[p[:, MOL].astype(int)] >= min_points]
+        tasks.extend(split_chunks(key, p, chunk_size))
+
+    fits = {}
+    with ProcessPoolExecutor(workers) as pool:
+        for (key, *_), results in zip(tasks, pool.map(fit_chunk, tasks)):
+            for mol_id, fit in results:
+                fits.setdefault(mol_id, {})[key] = fit
+
+    mappings = []
+    ids = sorted(fits)
+    for i in range(0, len(ids), 500):
+        for id, fit in session.query(Molecule.id, Molecule.fit).filter(Molecule.id.in_(ids[i:i + 500])):
+            mappings.append({'id': id, 'fit': json.dumps(dict(json.loads(fit) if fit else {}, **fits[id]))})
+    session.bulk_update_mappings(Molecule, mappings)
+    session.commit()
+    return len(fits)
+
+
+def evaluate(fit, key, T, P=P_AMBIENT):
+    """ Evaluate the correlation of property `key` from a Molecule.fit value (str or dict).
+
+    Return None if the molecule has no fit for this property.
+    """
+    if isinstance(fit, str):
+        fit = json.loads(fit)
+    if not fit or key not in fit:
+        return None
+    return FUNCTIONS[fit[key]['func']](fit[key]['coef'], T, P)
+
+
+class Correlations:
+    """ All stored fits, parsed once, for repeated evaluation at any (T, P).
+
+    >>> corr = Correlations()
+    >>> corr(mol_id, 'density', 298.15)
+    """
+
+    def __init__(self, selected=False):
+        query = session.query(Molecule.id, Molecule.fit).filter(Molecule.fit != None)
+        if selected:
+            query = query.filter(Molecule.selected == True)
+        self.fits = {id: json.loads(fit) for id, fit in query}
+
+    def __call__(self, mol_id, key, T, P=P_AMBIENT):
+        return evaluate(self.fits.get(mol_id), key, T, P)
+
+
+if __name__ == '__main__':
+    print('Fitted %i molecules' % fit_all())
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+""" Upgrade an existing ilthermo.db in place
+
+The applied schema version is kept in PRAGMA user_version, every entry in
+MIGRATIONS brings the database one version further.
+
+    python -m ilthermo.migrate ilthermo.db
+    python -m ilthermo.migrate --benchmark ilthermo.db   # times a copy before/after
+"""
+
+import os
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+
+from sqlalchemy import create_engine, inspect
+
+from .models import metadata, DERIVED
+from . import bounds
+
+
+def add_columns(conn, name, columns=None):
+    """ Create table `name`, or add those of its `columns` (default: all) that are missing.
+    """
+    inspector = inspect(conn)
+    table = metadata.tables[name]
+    if name not in inspector.get_table_names():
+        table.create(conn)
+        return
+    exist_columns = {c['name'] for c in inspector.get_columns(name)}
+    for column in table.columns:
+        if column.name not in exist_columns and (columns is None or column.name in columns):
+            conn.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                name, column.name, column.type.compile(dialect=conn.dialect)))
+
+
+def add_missing_columns(conn):
+    """ Create missing tables and columns, e.g. for a database written by ilthermo-scraper.
+    """
+    for table in metadata.sorted_tables:
+        add_columns(conn, table.name)
+
+
+def add_indexes(conn):
+    inspector = inspect(conn)
+    for table in metadata.sorted_tables:
+        exist_indexes = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in exist_indexes:
+                index.create(conn)
+    conn.execute('ANALYZE')
+
+
+def add_ion_chemistry(conn):
+    """ Ion columns derived from smiles, see ilthermo.chem.
+    """
+    add_columns(conn, 'ion', ['smiles_hash'] + DERIVED)
+
+
+def add_identifier(conn):
+    """ Cache of resolved names, see ilthermo.resolver.
+    """
+    add_columns(conn, 'identifier')
+
+
+def add_bounds(conn):
+    """ data_group and the data_bounds R*Tree, see ilthermo.bounds.
+    """
+    add_columns(conn, 'data_group')
+    bounds.rebuild(conn)
+
+
+def add_crawl_run(conn):
+    """ Watermarks of ilthermo-scraper/ilscraper.py --update.
+    """
+    add_columns(conn, 'crawl_run')
+
+
+def add_consensus(conn):
+    """ Paper scores against the cross-paper consensus, see ilthermo.consensus.
+    """
+    add_columns(conn, 'consensus')
+
+
+# version i is reached by MIGRATIONS[i - 1], never reorder or change a released step
+MIGRATIONS = [
+    add_missing_columns,
+    add_indexes,
+    add_ion_chemistry,
+    add_identifier,
+    add_bounds,
+    add_crawl_run,
+    add_consensus,
+]
+
+
+def migrate(db_path):
+    """ Apply pending migrations, return (old version, new version).
+    """
+    engine = create_engine('sqlite:///' + db_path)
+    with engine.begin() as conn:
+        old = version = conn.execute('PRAGMA user_version').scalar()
+        for step in MIGRATIONS[version:]:
+            print('Migration %i: %s' % (version + 1, step.__name__))
+            step(conn)
+            version += 1
+            conn.execute('PRAGMA user_version=%i' % version)
+
+    # journal mode cannot be changed inside a transaction, and it persists in the file
+    with engine.connect() as conn:
+        conn.execute('PRAGMA journal_mode=WAL')
+    engine.dispose()
+    return old, version
+
+
+def time_queries(db, repeat=3):
+    """ Time the lookups done by get-data.py and ilscraper on a database.
+
+    db is a path, or an engine to run the queries through, e.g. to count them.
+    """
+    db = sqlite3.connect(db) if isinstance(db, str) else db.connect()
+    property_ids = [row[0] for row in db.execute('SELECT id FROM property')]
+    molecule_ids = [row[0] for row in db.execute('SELECT id FROM molecule')]
+    codes = [row[0] for row in db.execute('SELECT code FROM dataset LIMIT 1000')]
+    ion_columns = [row[1] for row in db.execute('PRAGMA table_info(ion)')]
+    smiles = [row[0] for row in db.execute('SELECT smiles FROM ion WHERE smiles IS NOT NULL LIMIT 1000')] \
+        if 'smiles' in ion_columns else []
+
+    def data_by_molecule():
+        for prp in property_ids[:5]:
+            for mol in molecule_ids:
+                db.execute("SELECT t, p, value FROM data WHERE molecule_id=? AND property_id=? AND phase='Liquid' "
+                           "AND (p IS NULL OR p < 200)", (mol, prp)).fetchall()
+
+    def dataset_by_code():
+        for code in codes:
+            db.execute('SELECT id, searched FROM dataset WHERE code=?', (code,)).fetchall()
+
+    def ion_by_smiles():
+        for smi in smiles:
+            db.execute('SELECT id FROM ion WHERE smiles=?', (smi,)).fetchall()
+
+    timings = {}
+    for func in (data_by_molecule, dataset_by_code, ion_by_smiles):
+        t0 = time.time()
+        for i in range(repeat):
+            func()
+        timings[func.__name__] = (time.time() - t0) / repeat
+    db.close()
+    return timings
+
+
+def benchmark(db_path):
+    """ Migrate a temporary copy of the database and compare query times.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        copy = os.path.join(tmpdir, os.path.basename(db_path))
+        shutil.copy(db_path, copy)
+        before = time_queries(copy)
+        migrate(copy)
+        after = time_queries(copy)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print('%-20s %12s %12s %8s' % ('query', 'before (s)', 'after (s)', 'speedup'))
+    for name in before:
+        print('%-20s %12.4f %12.4f %8.1f' % (name, before[name], after[name], before[name] / max(after[name], 1e-9)))
+    return before, after
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Upgrade an ilthermo.db in place')
+    parser.add_argument('db', nargs='?', default='ilthermo.db')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='migrate a temporary copy and compare query times instead')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.db)
+    else:
+        old, new = migrate(args.db)
+        print('Schema version %i --> %i' % (old, new))
@@ -0,0 +1,239 @@
+""" DuckDB mirror of ilthermo.db for aggregate queries
+
+sync() copies property, paper, ion and molecule completely (they are small
+and curation rewrites them) and appends the rows of `data` whose id is above
+the largest id already mirrored. Rows at or below that id are checked by
+ranges of RANGE ids: data_ranges keeps SQLite's count and total() of every
+(range, property) as of the last sync, and a range whose rows were deleted,
+repointed, e.g. by dedup.merge_ions, or edited in place is copied again. The
+scraper keeps writing to SQLite; analytics read the DuckDB file.
+
+    python -m ilthermo.mirror sync [--full]
+    python -m ilthermo.mirror query "SELECT category, count(*) FROM ion GROUP BY 1"
+
+Needs the optional duckdb package; Mirror.arrow() also needs pyarrow.
+"""
+
+import time
+import sqlite3
+import argparse
+
+import numpy as np
+from sqlalchemy import Integer, Float, Boolean
+
+try:
+    import duckdb
+except ImportError:
+    raise ImportError('ilthermo.mirror needs duckdb: pip install duckdb')
+
+from . import models
+
+TABLES = ['property', 'paper', 'ion', 'molecule']
+DUCK_FILE = 'ilthermo.duckdb'
+FETCH_SIZE = 100000
+RANGE = 65536
+
+
+def duck_type(column):
+    if isinstance(column.type, Boolean):
+        return 'BOOLEAN'
+    if isinstance(column.type, Integer):
+        return 'BIGINT'
+    if isinstance(column.type, Float):
+        return 'DOUBLE'
+    return 'VARCHAR'
+
+
+def create_tables(con):
+    for name in TABLES + ['data']:
+        table = models.metadata.tables[name]
+        con.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (
+            name, ', '.join('%s %s' % (c.name, duck_type(c)) for c in table.columns)))
+    con.execute('CREATE TABLE IF NOT EXISTS sync_state (time DOUBLE, max_id BIGINT, rows BIGINT, full_copy BOOLEAN)')
+    con.execute('CREATE TABLE IF NOT EXISTS data_ranges (range BIGINT, property_id BIGINT, n BIGINT, '
+                'sum_molecule BIGINT, total_value DOUBLE, total_t DOUBLE, total_p DOUBLE)')
+
+
+def insert(con, name, columns, rows):
+    """ Append rows (a list of tuples) to a DuckDB table through a registered dict of NumPy arrays.
+    """
+    if not rows:
+        return
+    table = models.metadata.tables[name]
+    arrays = {}
+    select = []
+    for i, c in enumerate(columns):
+        values = [row[i] for row in rows]
+        kind = duck_type(table.columns[c])
+        if kind == 'VARCHAR':
+            # object arrays are converted element by element, fixed-width unicode is not
+            arrays[c] = np.array(['' if v is None else v for v in values], dtype=str)
+            arrays[c + '_null'] = np.array([v is None for v in values])
+            select.append('CASE WHEN %s_null THEN NULL ELSE %s END' % (c, c))
+        else:
+            arrays[c] = np.array(values, dtype=float)    # None --> NaN --> NULL
+            select.append('CAST(%s AS %s)' % (c, kind))
+    con.register('_chunk', arrays)
+    con.execute('INSERT INTO %s (%s) SELECT %s FROM _chunk' % (name, ', '.join(columns), ', '.join(select)))
+    con.unregister('_chunk')
+
+
+def copy_rows(src, con, name, where='', params=()):
+    columns = [c.name for c in models.metadata.tables[name].columns]
+    cursor = src.execute('SELECT %s FROM %s %s' % (', '.join(columns), name, where), params)
+    n = 0
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return n
+        insert(con, name, columns, rows)
+        n += len(rows)
+
+
+def data_checksum(src, max_id, min_range=0):
+    """ {(id // RANGE, property_id): (count, sum of molecule_id, totals of value, t and p)} of SQLite rows with id <= max_id.
+
+    Sums are per property, so an edit of a small diffusion coefficient is not
+    lost in the sum of all densities. Every range is read in rowid order by
+    the same query, so unchanged rows give bit-identical totals.
+    """
+    checksum = {}
+    for r in range(min_range, max_id // RANGE + 1):
+        rows = src.execute('SELECT coalesce(property_id, -1), count(*), coalesce(sum(molecule_id), 0), total(value), '
+                           'total(t), total(coalesce(p, 0)) FROM data WHERE id BETWEEN ? AND ? GROUP BY 1',
+                           [r * RANGE, min((r + 1) * RANGE - 1, max_id)]).fetchall()
+        checksum.update(((r, row[0]), tuple(row[1:])) for row in rows)
+    return checksum
+
+
+def stored_checksum(con):
+    rows = con.execute('SELECT range, property_id, n, sum_molecule, total_value, total_t, total_p FROM data_ranges')
+    return {tuple(row[:2]): tuple(row[2:]) for row in rows.fetchall()}
+
+
+def store_checksum(con, checksum):
+    con.execute('DELETE FROM data_ranges')
+    if checksum:
+        con.executemany('INSERT INTO data_ranges VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        [key + value for key, value in sorted(checksum.items())])
+
+
+def sync(db_path=None, duck_path=DUCK_FILE, full=False):
+    """ Bring the mirror up to date, return the number of data rows copied.
+    """
+    db_path = db_path or models.engine.url.database
+    src = sqlite3.connect('file:%s?mode=ro' % db_path, uri=True)
+    src.execute('BEGIN')    # one snapshot of the source for checksums and copies
+    con = duckdb.connect(duck_path)
+    con.execute('BEGIN TRANSACTION')
+    try:
+        create_tables(con)
+        max_id = con.execute('SELECT coalesce(max(id), 0) FROM data').fetchone()[0]
+        stale, checksum = [], {}
+        if not full and max_id:
+            stored = stored_checksum(con)
+            if not stored:
+                full = True
+            else:
+                checksum = data_checksum(src, max_id)
+                stale = sorted({key[0] for key in set(stored) | set(checksum) if stored.get(key) != checksum.get(key)})
+
+        for name in TABLES:
+            con.execute('DELETE FROM %s' % name)
+            copy_rows(src, con, name)
+        if full:
+            con.execute('DELETE FROM data')
+            max_id = 0
+        n = 0
+        for r in stale:
+            low, high = r * RANGE, min((r + 1) * RANGE - 1, max_id)
+            con.execute('DELETE FROM data WHERE id BETWEEN ? AND ?', [low, high])
+            n += copy_rows(src, con, 'data', 'WHERE id BETWEEN ? AND ? ORDER BY id', [low, high])
+        n += copy_rows(src, con, 'data', 'WHERE id > ? ORDER BY id', [max_id])
+        new_max = con.execute('SELECT coalesce(max(id), 0) FROM data').fetchone()[0]
+        # ranges below the one max_id was in are unchanged since they were summed
+        last = max_id // RANGE
+        checksum = {key: value for key, value in checksum.items() if key[0] < last}
+        checksum.update(data_checksum(src, new_max, last))
+        store_checksum(con, checksum)
+        con.execute('INSERT INTO sync_state VALUES (?, ?, ?, ?)', [time.time(), new_max, n, full])
+        con.execute('COMMIT')
+    except:
+        con.execute('ROLLBACK')
+        raise
+    finally:
+        con.close()
+        src.close()
+    return n
+
+
+class Mirror:
+    """ Read-only queries on the DuckDB file.
+
+    >>> m = Mirror()
+    >>> m.numpy('SELECT t, value FROM data WHERE molecule_id = ?', [42])     # dict of arrays
+    """
+
+    def __init__(self, duck_path=DUCK_FILE):
+        self.con = duckdb.connect(duck_path, read_only=True)
+
+    def close(self):
+        self.con.close()
+
+    def numpy(self, sql, params=None):
+        return self.con.execute(sql, params or []).fetchnumpy()
+
+    def arrow(self, sql, params=None):
+        return self.con.execute(sql, params or []).arrow()
+
+    def rows(self, sql, params=None):
+        return self.con.execute(sql, params or []).fetchall()
+
+    def coverage_by_category(self, property_name):
+        """ Number of molecules and points per (cation category, anion category) for one property.
+        """
+        return self.numpy('''
+            SELECT c.category AS cation_category, a.category AS anion_category,
+                   count(DISTINCT d.molecule_id) AS molecules, count(*) AS points
+            FROM data d JOIN property p ON p.id = d.property_id
+                 JOIN molecule m ON m.id = d.molecule_id
+                 JOIN ion c ON c.id = m.cation_id JOIN ion a ON a.id = m.anion_id
+            WHERE p.name = ?
+            GROUP BY ALL ORDER BY points DESC''', [property_name])
+
+    def points_per_paper(self):
+        return self.numpy('''
+            SELECT pa.id, pa.year, count(*) AS points, count(DISTINCT d.molecule_id) AS molecules,
+                   count(DISTINCT d.property_id) AS properties
+            FROM data d JOIN paper pa ON pa.id = d.paper_id
+            GROUP BY ALL ORDER BY points DESC''')
+
+    def t_histogram(self, property_name, bin_width=10):
+        """ Number of points per temperature bin of `bin_width` K.
+        """
+        return self.numpy('''
+            SELECT floor(d.t / ?) * ? AS t_bin, count(*) AS points
+            FROM data d JOIN property p ON p.id = d.property_id
+            WHERE p.name = ? AND d.t IS NOT NULL
+            GROUP BY 1 ORDER BY 1''', [bin_width, bin_width, property_name])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mirror ilthermo.db into DuckDB and query it')
+    parser.add_argument('--db', help='SQLite database (default: $ILTHERMO_DB or ilthermo.db)')
+    parser.add_argument('--duck', default=DUCK_FILE, help='DuckDB file')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sync_parser = sub.add_parser('sync', help='copy new rows into the mirror')
+    sync_parser.add_argument('--full', action='store_true', help='copy the data table again')
+    query_parser = sub.add_parser('query', help='run SQL on the mirror and print the rows')
+    query_parser.add_argument('sql')
+    args = parser.parse_args()
+
+    if args.command == 'sync':
+        t0 = time.time()
+        n = sync(args.db, args.duck, args.full)
+        print('%i data rows copied to %s (%.1f s)' % (n, args.duck, time.time() - t0))
+    else:
+        mirror = Mirror(args.duck)
+        for row in mirror.rows(args.sql):
+            print(*row, sep='\t')
@@ -1,18 +1,70 @@
-import numpy as np
-import requests, pybel, json
+""" ORM models of ilthermo.db
+
+The database is taken from $ILTHERMO_DB (an SQLAlchemy URL or a file path,
+default ./ilthermo.db) and can be changed with configure(). `session` is a
+scoped session, so every thread gets its own; worker processes should call
+worker_init() first so they do not reuse connections inherited through fork.
+Importing this module opens nothing and does not import pybel or numpy.
+"""
+
+import os
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy import create_engine
-from sqlalchemy import Column, Integer, Float, Text, Boolean, String, ForeignKey, UniqueConstraint
+from sqlalchemy.orm import sessionmaker, scoped_session, relationship
+from sqlalchemy import create_engine, event, DDL
+from sqlalchemy import Column, Integer, Float, Text, Boolean, String, ForeignKey, UniqueConstraint, Index
 
 Base = declarative_base()
 metadata = Base.metadata
 
-db_file = 'sqlite:///ilthermo.db?check_same_thread=False'
+db_file = os.environ.get('ILTHERMO_DB', 'sqlite:///ilthermo.db?check_same_thread=False')
+
+
+def set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA cache_size=-65536')  # 64 MB
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+
+def make_engine(url=None):
+    """ Engine for an SQLAlchemy URL or an SQLite file path, default db_file.
+    """
+    url = url or db_file
+    if '://' not in url:
+        url = 'sqlite:///%s?check_same_thread=False' % url
+    engine = create_engine(url, echo=False)
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', set_pragmas)
+    return engine
 
-engine = create_engine(db_file, echo=False)
+
+engine = make_engine()
 Session = sessionmaker(engine)
-session = Session()
+session = scoped_session(Session)
+
+
+def configure(url):
+    """ Point engine, Session and session at another database.
+    """
+    global engine
+    session.remove()
+    engine.dispose()
+    engine = make_engine(url)
+    Session.configure(bind=engine)
+    return engine
+
+
+def worker_init(url=None):
+    """ Pool initializer: forget the parent's connections and session, optionally switch database.
+    """
+    session.remove()
+    if url:
+        configure(url)
+    else:
+        engine.dispose()
 
 
 class Property(Base):
@@ -42,7 +94,7 @@ class Paper(Base):
 class DataSet(Base):
     __tablename__ = 'dataset'
     id = Column(Integer, primary_key=True)
-    code = Column(String(5))
+    code = Column(String(5), index=True)
     searched = Column(Boolean)
 
 
@@ -54,7 +106,7 @@ class Ion(Base):
     searched = Column(Boolean)
     popular = Column(Boolean, default=False)
     selected = Column(Boolean, default=False)
-    smiles = Column(Text)
+    smiles = Column(Text, index=True)
     iupac = Column(Text)
     ignored = Column('validated', Boolean, default=False)
     duplicate = Column(Integer)
@@ -62,6 +114,14 @@ class Ion(Base):
     n_paper = Column(Integer)
     times = Column(Integer)
 
+    # derived from smiles by ilthermo.chem, valid while smiles_hash matches smiles
+    smiles_hash = Column(String(40))
+    canonical_smiles = Column(Text)
+    formula = Column(Text)
+    n_heavy = Column(Integer)
+    weight = Column(Float)
+    formal_charge = Column(Integer)
+
     molecules_cation = relationship('Molecule', lazy='dynamic', foreign_keys='Molecule.cation_id')
     molecules_anion = relationship('Molecule', lazy='dynamic', foreign_keys='Molecule.anion_id')
 
@@ -78,33 +138,40 @@ class Ion(Base):
         else:
             return self.molecules_anion
 
-    @property
-    def n_heavy(self):
-        try:
-            py_mol = pybel.readstring('smi', self.smiles)
-        except:
-            raise Exception('Smiles not valid')
-        return py_mol.OBMol.NumHvyAtoms()
-
     def update_smiles_from_pubchem(self):
-        r = requests.get(
-            'https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/%s/%s/property/IUPACName,CanonicalSMILES,IsomericSMILES,MolecularFormula/JSON'
-            % ('name', self.name), timeout=5)
-        j = r.json()
-        print(j)
+        from .resolver import Resolver
+        smiles, iupac, source = Resolver.shared().lookup(self.name)
+        print(self.name, smiles, iupac, source)
 
         try:
-            self.cid = j['PropertyTable']['Properties'][0]['CID']
-            self.iupac = j['PropertyTable']['Properties'][0]['IUPACName']
-            smiles = j['PropertyTable']['Properties'][0]['CanonicalSMILES']
+            import pybel
             py_mol = pybel.readstring('smi', smiles)
+            self.iupac = iupac
             self.smiles = py_mol.write('can').strip()
-            self.formula = py_mol.formula
+            self.update_formula()
         except Exception as e:
             print(repr(e))
 
     def update_formula(self):
-        self.formula = pybel.readstring('smi', self.smiles).formula
+        """ Refresh the columns derived from smiles for this ion only, see ilthermo.chem for batches.
+        """
+        from .chem import derive, smiles_hash
+        for key, value in derive(self.smiles).items():
+            setattr(self, key, value)
+        self.smiles_hash = smiles_hash(self.smiles)
+
+
+DERIVED = ['canonical_smiles', 'formula', 'n_heavy', 'weight', 'formal_charge']
+
+
+@event.listens_for(Ion.smiles, 'set')
+def clear_chemistry(ion, value, oldvalue, initiator):
+    """ Forget the columns derived from the old smiles, so nobody reads them for the new one.
+    """
+    if value != oldvalue:
+        ion.smiles_hash = None
+        for key in DERIVED:
+            setattr(ion, key, None)
 
 
 class Molecule(Base):
@@ -129,8 +196,23 @@ class Molecule(Base):
         return '<Molecule: %i %s>' % (self.id, self.name)
 
 
+class Identifier(Base):
+    """ Cached name --> SMILES resolution of ilthermo.resolver, source is None if not found.
+    """
+    __tablename__ = 'identifier'
+    name = Column(Text, primary_key=True)
+    smiles = Column(Text)
+    iupac = Column(Text)
+    source = Column(String(20))
+    time = Column(Float)
+
+    def __repr__(self):
+        return '<Identifier: %s %s>' % (self.name, self.smiles)
+
+
 class Data(Base):
     __tablename__ = 'data'
+    __table_args__ = (Index('ix_data_molecule_property', 'molecule_id', 'property_id', 'phase', 't'),)
     id = Column(Integer, primary_key=True)
     molecule_id = Column(Integer, ForeignKey(Molecule.id))
     paper_id = Column(Integer, ForeignKey(Paper.id))
@@ -147,3 +229,59 @@ class Data(Base):
 
     def __repr__(self):
         return '<Data: %s: %.1f %.1f %f>' % (self.property.name, self.t or 0, self.p or 0, self.value)
+
+
+class DataGroup(Base):
+    """ Data points of one molecule, property, paper and phase.
+
+    Their bounding box over (property id, t, p) has the same id in the
+    data_bounds R*Tree; rows without t or p count as 298.15 K and 101.325 kPa.
+    """
+    __tablename__ = 'data_group'
+    __table_args__ = (UniqueConstraint('molecule_id', 'property_id', 'paper_id', 'phase', name='data_group_key'),)
+    id = Column(Integer, primary_key=True)
+    molecule_id = Column(Integer, ForeignKey(Molecule.id))
+    property_id = Column(Integer, ForeignKey(Property.id))
+    paper_id = Column(Integer, ForeignKey(Paper.id))
+    phase = Column(String(20))
+    n = Column(Integer)
+
+
+event.listen(DataGroup.__table__, 'after_create', DDL(
+    'CREATE VIRTUAL TABLE IF NOT EXISTS data_bounds USING rtree('
+    'id, property_min, property_max, t_min, t_max, p_min, p_max)').execute_if(dialect='sqlite'))
+event.listen(DataGroup.__table__, 'after_drop', DDL('DROP TABLE IF EXISTS data_bounds').execute_if(dialect='sqlite'))
+
+
+class CrawlRun(Base):
+    """ One ilscraper run, DataSet codes with an id above dataset_id were first listed during it.
+    """
+    __tablename__ = 'crawl_run'
+    id = Column(Integer, primary_key=True)
+    mode = Column(String(10))   # 'crawl' or 'update'
+    started = Column(Float)
+    finished = Column(Float)
+    dataset_id = Column(Integer)
+    species = Column(Integer)
+    datasets = Column(Integer)
+    points = Column(Integer)
+    response_bytes = Column(Integer)
+
+
+class Consensus(Base):
+    """ Agreement of one paper's data with the other papers on the same molecule, property and phase.
+
+    Written by ilthermo.consensus, see there for deviation, score and outlier.
+    """
+    __tablename__ = 'consensus'
+    __table_args__ = (UniqueConstraint('molecule_id', 'property_id', 'phase', 'paper_id', name='consensus_key'),)
+    id = Column(Integer, primary_key=True)
+    molecule_id = Column(Integer, ForeignKey(Molecule.id))
+    property_id = Column(Integer, ForeignKey(Property.id))
+    phase = Column(String(20))
+    paper_id = Column(Integer, ForeignKey(Paper.id))
+    n_grid = Column(Integer)
+    n_papers = Column(Integer)
+    deviation = Column(Float)
+    score = Column(Float)
+    outlier = Column(Boolean)
@@ -0,0 +1,171 @@
+""" Name --> SMILES resolution through PubChem and ChemSpider
+
+Requests go through one pooled requests.Session from a thread pool, limited
+per service by a token bucket. Every answer, including "not found", is kept
+in the identifier table, so a name is only sent to the services once.
+Base URLs are parameters, so the resolver can run against local stub servers.
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .models import session, Identifier
+
+PUBCHEM_URL = 'https://pubchem.ncbi.nlm.nih.gov/rest/pug'
+CHEMSPIDER_URL = 'https://api.rsc.org/compounds/v1'
+
+
+class TokenBucket:
+    """ Allow `rate` calls per second on average and bursts of `burst` calls, across threads.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Resolver:
+    _shared = None
+
+    def __init__(self, pubchem_url=PUBCHEM_URL, chemspider_url=CHEMSPIDER_URL, chemspider_token=None,
+                 rate=5, workers=8, timeout=10, poll_timeout=30):
+        self.pubchem_url = pubchem_url
+        self.chemspider_url = chemspider_url
+        self.chemspider_token = chemspider_token
+        self.workers = workers
+        self.timeout = timeout
+        self.poll_timeout = poll_timeout
+        self.buckets = {'pubchem': TokenBucket(rate, burst=rate), 'chemspider': TokenBucket(rate, burst=rate)}
+
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=workers,
+                              max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504]))
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+
+    @classmethod
+    def shared(cls):
+        """ Resolver with default settings, reused by Ion.update_smiles_from_pubchem.
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def get(self, service, url, **kwargs):
+        self.buckets[service].acquire()
+        return self.http.get(url, timeout=self.timeout, **kwargs)
+
+    def pubchem(self, name):
+        """ [(smiles, iupac)] of all PubChem compounds with this name.
+        """
+        r = self.get('pubchem', '%s/compound/name/%s/property/IUPACName,CanonicalSMILES,IsomericSMILES/JSON'
+                     % (self.pubchem_url, requests.utils.quote(name, safe='')))
+        if r.status_code == 404:
+            return []
+        r.raise_for_status()
+        return [(p.get('IsomericSMILES') or p.get('CanonicalSMILES'), p.get('IUPACName'))
+                for p in r.json()['PropertyTable']['Properties']]
+
+    def chemspider(self, name):
+        """ [smiles] of all ChemSpider records with this name, empty without a token.
+
+        The status of the search is polled with backoff for at most
+        poll_timeout seconds, a search still running then raises requests.Timeout,
+        so resolve_all reports the name and does not cache it as not found.
+        """
+        if not self.chemspider_token:
+            return []
+        headers = {'apikey': self.chemspider_token}
+        self.buckets['chemspider'].acquire()
+        r = self.http.post(self.chemspider_url + '/filter/name', json={'name': name}, headers=headers,
+                           timeout=self.timeout)
+        r.raise_for_status()
+        query = r.json()['queryId']
+        deadline = time.monotonic() + self.poll_timeout
+        delay = 0.2
+        while True:
+            status = self.get('chemspider', '%s/filter/%s/status' % (self.chemspider_url, query),
+                              headers=headers).json()['status']
+            if status == 'Complete':
+                break
+            if status in ('Failed', 'Suspended', 'Not Found'):
+                return []
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise requests.Timeout('ChemSpider search for %s still running after %g s' % (name, self.poll_timeout))
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 5)
+        ids = self.get('chemspider', '%s/filter/%s/results' % (self.chemspider_url, query),
+                       headers=headers).json()['results']
+        return [self.get('chemspider', '%s/records/%s/details' % (self.chemspider_url, id),
+                         params={'fields': 'SMILES'}, headers=headers).json()['smiles'] for id in ids[:2]]
+
+    def resolve(self, name):
+        """ (smiles, iupac, source) from the first service with exactly one match, or (None, None, None).
+        """
+        pc = self.pubchem(name)
+        if len(pc) == 1:
+            return pc[0][0], pc[0][1], 'pubchem'
+        cs = self.chemspider(name)
+        if len(cs) == 1:
+            return cs[0], None, 'chemspider'
+        return None, None, None
+
+    def lookup(self, name):
+        """ Cached resolve() of a single name, the new Identifier is flushed and the caller commits.
+        """
+        return self.resolve_all([name], commit=False)[name]
+
+    def resolve_all(self, names, retry_missing=False, commit_every=50, commit=True):
+        """ Return {name: (smiles, iupac, source)}, querying the services only for uncached names.
+
+        Failed requests are reported and not cached, `retry_missing` asks
+        again for names cached as not found. Without `commit` the new
+        Identifier rows are only flushed into the session's transaction.
+        """
+        names = list(dict.fromkeys(names))
+        results = {}
+        for i in range(0, len(names), 500):
+            for row in session.query(Identifier).filter(Identifier.name.in_(names[i:i + 500])):
+                if row.source or not retry_missing:
+                    results[row.name] = (row.smiles, row.iupac, row.source)
+        todo = [name for name in names if name not in results]
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = [(name, pool.submit(self.resolve, name)) for name in todo]
+            for n, (name, future) in enumerate(futures, 1):
+                try:
+                    results[name] = future.result()
+                except (requests.RequestException, ValueError, KeyError) as e:
+                    print('Cannot resolve %s: %r' % (name, e))
+                    results[name] = (None, None, None)
+                    continue
+                smiles, iupac, source = results[name]
+                session.merge(Identifier(name=name, smiles=smiles, iupac=iupac, source=source, time=time.time()))
+                if commit and n % commit_every == 0:
+                    session.commit()
+        if commit:
+            session.commit()
+        else:
+            session.flush()
+        return results
@@ -0,0 +1,394 @@
+""" Local HTTP query service over ilthermo.db
+
+One asyncio process answers property lookups for many simulation and fitting
+jobs, so they do not each open the database. Queries run on a small thread
+pool with a pool of read-only connections. Results are kept in an LRU cache
+with a TTL, and identical requests that arrive while one is running share it.
+
+    python -m ilthermo.service --db ilthermo.db --port 8642
+
+    GET /properties
+    GET /molecules?cation=SMILES&anion=SMILES     (or smiles=CATION.ANION, name=..., molecule=ID)
+    GET /data?property=Density&smiles=CATION.ANION&phase=Liquid&t=290,350&p=,200[&outliers=0][&format=npy]
+    GET /candidates?property=Viscosity&t=298,323&p=,200     (molecules from the R*Tree, see ilthermo.bounds)
+    GET /metrics                                            (Prometheus text, cache hit rate)
+
+Windows are inclusive `low,high` with either end optional, and points
+without t or p count as 298.15 K and 101.325 kPa, as in /candidates. Answers are JSON objects of columns, or
+with format=npy a structured array in .npy format for np.load(io.BytesIO(body)).
+"""
+
+import io
+import json
+import time
+import asyncio
+import argparse
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import QueuePool
+
+from . import bounds
+
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+# endpoint --> columns of the answer, (name, dtype of the .npy payload)
+COLUMNS = {
+    'properties': [('id', 'i8'), ('name', 'U')],
+    'molecules': [('id', 'i8'), ('name', 'U'), ('cation_smiles', 'U'), ('anion_smiles', 'U')],
+    'data': [('molecule_id', 'i8'), ('paper_id', 'i8'), ('phase', 'U'),
+             ('t', 'f8'), ('p', 'f8'), ('value', 'f8'), ('stderr', 'f8')],
+    'candidates': [('molecule_id', 'i8'), ('points', 'i8')],
+}
+
+
+class QueryError(Exception):
+    pass
+
+
+class LRUCache:
+    """ Up to max_size answers and max_bytes of bodies, each valid for ttl seconds,
+    least recently used dropped first. Larger answers are not cached at all.
+    """
+
+    def __init__(self, max_size=1024, ttl=300, max_bytes=256 * 2**20):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()    # key --> (expires, answer)
+        self.bytes = 0
+        self.hits = self.misses = self.expired = self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            self.drop(key)
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, answer):
+        if key in self.entries:
+            self.drop(key)
+        if len(answer[2]) > self.max_bytes:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, answer)
+        self.bytes += len(answer[2])
+        while len(self.entries) > self.max_size or self.bytes > self.max_bytes:
+            self.drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def drop(self, key):
+        self.bytes -= len(self.entries.pop(key)[1][2])
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def hit_rate(self):
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.
+
+
+def read_only_engine(db_path, pool_size):
+    """ Engine with a pool of read-only SQLite connections usable from any thread.
+    """
+    engine = create_engine('sqlite:///file:%s?mode=ro&uri=true' % db_path, poolclass=QueuePool,
+                           pool_size=pool_size, max_overflow=0, connect_args={'check_same_thread': False})
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA query_only=1')
+        cursor.execute('PRAGMA cache_size=-65536')  # 64 MB
+        cursor.execute('PRAGMA mmap_size=268435456')
+        cursor.close()
+
+    return engine
+
+
+def window(params, name):
+    """ 'low,high' with optional ends --> (low, high), None if the parameter is absent.
+    """
+    if name not in params:
+        return None
+    try:
+        low, high = (float(x) if x.strip() else None for x in params[name].split(','))
+    except ValueError:
+        raise QueryError('%s must be low,high' % name)
+    return low, high
+
+
+def encode(columns, rows, fmt):
+    """ Answer body and content type, JSON {column: values} or a structured .npy array.
+    """
+    if fmt == 'npy':
+        arrays = []
+        for i, (name, dtype) in enumerate(columns):
+            values = [row[i] for row in rows]
+            if dtype == 'U':
+                arrays.append(np.array(['' if v is None else v for v in values], dtype=str))
+            else:
+                arrays.append(np.array([np.nan if v is None else v for v in values], dtype=dtype))
+        out = np.empty(len(rows), dtype=[(name, a.dtype) for (name, dtype), a in zip(columns, arrays)])
+        for (name, dtype), a in zip(columns, arrays):
+            out[name] = a
+        f = io.BytesIO()
+        np.save(f, out)
+        return 'application/octet-stream', f.getvalue()
+    if fmt not in (None, 'json'):
+        raise QueryError('format must be json or npy')
+    body = {name: [row[i] for row in rows] for i, (name, dtype) in enumerate(columns)}
+    return 'application/json', json.dumps(body).encode()
+
+
+class Service:
+    def __init__(self, db_path='ilthermo.db', workers=4, cache_size=1024, ttl=300, cache_bytes=256 * 2**20):
+        self.engine = read_only_engine(db_path, workers)
+        self.executor = ThreadPoolExecutor(workers)
+        self.cache = LRUCache(cache_size, ttl, cache_bytes)
+        self.pending = {}       # key --> future of an answer being computed
+        self.shared = 0         # requests answered by a pending identical one
+        self.requests = {}      # endpoint --> [count, seconds]
+        self.start = time.time()
+
+    # queries, run on the executor
+
+    def property_id(self, conn, params):
+        name = params.get('property')
+        if name is None:
+            raise QueryError('property is required')
+        if name.isdigit():
+            return int(name)
+        id = conn.execute(text('SELECT id FROM property WHERE name = :name'), {'name': name}).scalar()
+        if id is None:
+            raise QueryError('unknown property %s' % name)
+        return id
+
+    def molecule_ids(self, conn, params):
+        """ Ids of the molecules selected by molecule, name, smiles or cation/anion, None for all.
+        """
+        if 'molecule' in params:
+            try:
+                return [int(x) for x in params['molecule'].split(',')]
+            except ValueError:
+                raise QueryError('molecule must be ids separated by commas')
+        conditions, args = [], {}
+        if 'name' in params:
+            conditions.append('m.name = :name')
+            args['name'] = params['name']
+        if 'smiles' in params:
+            parts = params['smiles'].split('.')
+            if len(parts) != 2:
+                raise QueryError('smiles must be CATION.ANION')
+            params = dict(params, cation=parts[0], anion=parts[1])
+        for side in ('cation', 'anion'):
+            if side in params:
+                conditions.append('(%s.smiles = :%s OR %s.canonical_smiles = :%s)' % (side, side, side, side))
+                args[side] = params[side]
+        if not conditions:
+            return None
+        return [id for id, in conn.execute(text(
+            'SELECT m.id FROM molecule m JOIN ion cation ON cation.id = m.cation_id '
+            'JOIN ion anion ON anion.id = m.anion_id WHERE %s ORDER BY m.id' % ' AND '.join(conditions)), args)]
+
+    def query_properties(self, conn, params):
+        return conn.execute(text('SELECT id, name FROM property ORDER BY id')).fetchall()
+
+    def query_molecules(self, conn, params):
+        ids = self.molecule_ids(conn, params)
+        if ids is None:
+            raise QueryError('give molecule, name, smiles, cation or anion')
+        if not ids:
+            return []
+        return conn.execute(text(
+            'SELECT m.id, m.name, cation.smiles, anion.smiles FROM molecule m '
+            'JOIN ion cation ON cation.id = m.cation_id JOIN ion anion ON anion.id = m.anion_id '
+            'WHERE m.id IN (%s) ORDER BY m.id' % ', '.join(str(id) for id in ids))).fetchall()
+
+    def query_data(self, conn, params):
+        conditions = ['d.property_id = :prp']
+        args = {'prp': self.property_id(conn, params), 't_ambient': bounds.T_AMBIENT, 'p_ambient': bounds.P_AMBIENT}
+        ids = self.molecule_ids(conn, params)
+        if ids is not None:
+            if not ids:
+                return []
+            conditions.append('d.molecule_id IN (%s)' % ', '.join(str(id) for id in ids))
+        if 'phase' in params:
+            conditions.append('d.phase = :phase')
+            args['phase'] = params['phase']
+        for column, expr in (('t', 'coalesce(d.t, :t_ambient)'), ('p', 'coalesce(d.p, :p_ambient)')):
+            low, high = window(params, column) or (None, None)
+            if low is not None:
+                conditions.append('%s >= :%s_low' % (expr, column))
+                args[column + '_low'] = low
+            if high is not None:
+                conditions.append('%s <= :%s_high' % (expr, column))
+                args[column + '_high'] = high
+        if params.get('outliers') == '0':
+            conditions.append('NOT EXISTS (SELECT 1 FROM consensus c WHERE c.molecule_id = d.molecule_id '
+                              'AND c.property_id = d.property_id AND c.phase = d.phase '
+                              'AND c.paper_id = d.paper_id AND c.outlier)')
+        return conn.execute(text(
+            'SELECT d.molecule_id, d.paper_id, d.phase, d.t, d.p, d.value, d.stderr FROM data d '
+            'WHERE %s ORDER BY d.molecule_id, d.phase, d.t' % ' AND '.join(conditions)), args).fetchall()
+
+    def query_candidates(self, conn, params):
+        try:
+            min_points = int(params.get('min_points', 1))
+        except ValueError:
+            raise QueryError('min_points must be an integer')
+        result = bounds.candidates(self.property_id(conn, params), window(params, 't'), window(params, 'p'),
+                                   params.get('phase'), min_points, conn=conn)
+        return sorted(result.items())
+
+    def answer(self, endpoint, params):
+        """ (status, content type, body) of one request.
+        """
+        try:
+            with self.engine.connect() as conn:
+                rows = getattr(self, 'query_' + endpoint)(conn, params)
+            return (200,) + encode(COLUMNS[endpoint], rows, params.get('format'))
+        except QueryError as e:
+            return 400, 'application/json', json.dumps({'error': str(e)}).encode()
+
+    # HTTP
+
+    def metrics(self):
+        c = self.cache
+        lines = [
+            '# TYPE ilthermo_service_cache_hits_total counter', 'ilthermo_service_cache_hits_total %i' % c.hits,
+            '# TYPE ilthermo_service_cache_misses_total counter', 'ilthermo_service_cache_misses_total %i' % c.misses,
+            '# TYPE ilthermo_service_cache_expired_total counter', 'ilthermo_service_cache_expired_total %i' % c.expired,
+            '# TYPE ilthermo_service_cache_evictions_total counter',
+            'ilthermo_service_cache_evictions_total %i' % c.evictions,
+            '# TYPE ilthermo_service_shared_total counter', 'ilthermo_service_shared_total %i' % self.shared,
+            '# TYPE ilthermo_service_cache_hit_ratio gauge', 'ilthermo_service_cache_hit_ratio %.6f' % c.hit_rate(),
+            '# TYPE ilthermo_service_cache_entries gauge', 'ilthermo_service_cache_entries %i' % len(c.entries),
+            '# TYPE ilthermo_service_cache_bytes gauge', 'ilthermo_service_cache_bytes %i' % c.bytes,
+            '# TYPE ilthermo_service_query_seconds summary',
+        ]
+        for endpoint, (n, seconds) in sorted(self.requests.items()):
+            lines.append('ilthermo_service_query_seconds_sum{endpoint="%s"} %.6f' % (endpoint, seconds))
+            lines.append('ilthermo_service_query_seconds_count{endpoint="%s"} %i' % (endpoint, n))
+        lines += ['# TYPE ilthermo_service_uptime_seconds gauge',
+                  'ilthermo_service_uptime_seconds %.3f' % (time.time() - self.start)]
+        return 200, 'text/plain; version=0.0.4', ('\n'.join(lines) + '\n').encode()
+
+    async def respond(self, method, target):
+        url = urlsplit(target)
+        endpoint = url.path.strip('/')
+        if method != 'GET':
+            return 405, 'text/plain', b'GET only\n'
+        if endpoint == 'metrics':
+            return self.metrics()
+        if endpoint not in COLUMNS:
+            return 404, 'text/plain', b'Unknown endpoint\n'
+
+        params = dict(parse_qsl(url.query))
+        key = (endpoint, tuple(sorted(params.items())))
+        answer = self.cache.get(key)
+        if answer is not None:
+            return answer
+        if key in self.pending:
+            self.shared += 1
+            return await asyncio.shield(self.pending[key])
+
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self.answer, endpoint, params)
+        self.pending[key] = future
+        t0 = time.perf_counter()
+        try:
+            answer = await future
+        finally:
+            del self.pending[key]
+            stats = self.requests.setdefault(endpoint, [0, 0.])
+            stats[0] += 1
+            stats[1] += time.perf_counter() - t0
+        if answer[0] == 200:
+            self.cache.put(key, answer)
+        return answer
+
+    async def handle(self, reader, writer):
+        """ Serve HTTP/1.1 requests on one connection until the client closes it.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get('content-length', 0)):
+                    await reader.readexactly(int(headers['content-length']))
+
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    method, target, version = None, None, 'HTTP/1.0'
+                    status, content_type, body = 400, 'text/plain', b'Bad request line\n'
+                if method is not None:
+                    try:
+                        status, content_type, body = await self.respond(method, target)
+                    except Exception as e:
+                        status, content_type, body = 500, 'application/json', json.dumps({'error': repr(e)}).encode()
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                writer.write(('HTTP/1.1 %i %s\r\nContent-Type: %s\r\nContent-Length: %i\r\nConnection: %s\r\n\r\n' % (
+                    status, STATUS[status], content_type, len(body), 'keep-alive' if keep_alive else 'close'))
+                    .encode('latin-1') + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8642):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def query(endpoint, url='http://127.0.0.1:8642', **params):
+    """ Ask a running service; return a structured array for format='npy', else the decoded JSON.
+
+    >>> query('data', property='Density', smiles='CCCC[n+]1ccn(C)c1.F[B-](F)(F)F', t='290,350', format='npy')
+    """
+    with urlopen('%s/%s?%s' % (url.rstrip('/'), endpoint, urlencode(params))) as r:
+        body = r.read()
+    if params.get('format') == 'npy':
+        return np.load(io.BytesIO(body))
+    return json.loads(body)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve property lookups on ilthermo.db over HTTP')
+    parser.add_argument('--db', default='ilthermo.db', help='SQLite database, opened read-only')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8642)
+    parser.add_argument('--workers', type=int, default=4, help='query threads and pooled connections')
+    parser.add_argument('--cache-size', type=int, default=1024, help='cached answers')
+    parser.add_argument('--cache-mb', type=float, default=256, help='MB of cached answer bodies')
+    parser.add_argument('--ttl', type=float, default=300, help='seconds an answer stays cached')
+    args = parser.parse_args()
+
+    service = Service(args.db, args.workers, args.cache_size, args.ttl, int(args.cache_mb * 2**20))
+    print('Serving %s on http://%s:%i' % (args.db, args.host, args.port))
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
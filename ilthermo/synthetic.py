@@ -0,0 +1,211 @@
+""" Synthetic ilthermo.db files for benchmarks
+
+Ions are built from real cation cores and anions, molecules pair them with
+Zipf-distributed popularity (a few ions such as [C4mim] and [NTf2] appear in
+most papers), and every dataset is a temperature series of one property from
+one paper with values from plausible correlations.
+
+    python -m ilthermo.synthetic bench.db --molecules 5000 --points 2000000
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+
+import numpy as np
+from sqlalchemy import create_engine
+
+from .models import metadata
+from .migrate import MIGRATIONS
+from . import bounds
+
+CATION_CORES = [
+    ('imidazolium', '1-{0}-3-methylimidazolium', 'C[n+]1ccn(C)c1', 'cIm'),
+    ('pyridinium', '1-{0}pyridinium', 'C[n+]1ccccc1', 'cPy'),
+    ('pyrrolidinium', '1-{0}-1-methylpyrrolidinium', 'C[N+]1(C)CCCC1', 'cPyrr'),
+    ('piperidinium', '1-{0}-1-methylpiperidinium', 'C[N+]1(C)CCCCC1', 'cN4pi'),
+    ('ammonium', '{0}trimethylammonium', 'C[N+](C)(C)C', 'cN4'),
+    ('phosphonium', 'trihexyl{0}phosphonium', 'C[P+](CCCCCC)(CCCCCC)CCCCCC', 'cP4'),
+]
+ALKYLS = ['methyl', 'ethyl', 'propyl', 'butyl', 'pentyl', 'hexyl', 'heptyl', 'octyl', 'nonyl', 'decyl',
+          'undecyl', 'dodecyl', 'tridecyl', 'tetradecyl', 'pentadecyl', 'hexadecyl']
+ANIONS = [
+    ('bis[(trifluoromethyl)sulfonyl]imide', 'FC(F)(F)S(=O)(=O)[N-]S(=O)(=O)C(F)(F)F', 'aSI'),
+    ('tetrafluoroborate', 'F[B-](F)(F)F', 'aXB4'),
+    ('hexafluorophosphate', 'F[P-](F)(F)(F)(F)F', 'aXP6'),
+    ('chloride', '[Cl-]', 'a0Cl'),
+    ('bromide', '[Br-]', 'a0Br'),
+    ('iodide', '[I-]', 'a0I'),
+    ('dicyanamide', 'N#C[N-]C#N', 'aNC[N]'),
+    ('thiocyanate', '[S-]C#N', 'aNC[S]'),
+    ('tricyanomethanide', 'N#C[C-](C#N)C#N', 'aNC[C]'),
+    ('tetracyanoborate', 'N#C[B-](C#N)(C#N)C#N', 'aNC[B]'),
+    ('acetate', 'CC(=O)[O-]', 'aCO2'),
+    ('trifluoroacetate', 'FC(F)(F)C(=O)[O-]', 'aCO2'),
+    ('trifluoromethanesulfonate', 'FC(F)(F)S(=O)(=O)[O-]', 'aSO3'),
+    ('methanesulfonate', 'CS(=O)(=O)[O-]', 'aSO3'),
+    ('methyl sulfate', 'COS(=O)(=O)[O-]', 'aSO4'),
+    ('ethyl sulfate', 'CCOS(=O)(=O)[O-]', 'aSO4'),
+    ('hydrogen sulfate', 'OS(=O)(=O)[O-]', 'aSO4'),
+    ('nitrate', '[O-][N+](=O)[O-]', 'aNO3'),
+    ('perchlorate', '[O-]Cl(=O)(=O)=O', 'aClO4'),
+    ('diethyl phosphate', 'CCOP(=O)([O-])OCC', 'aPO2'),
+    ('dimethyl phosphate', 'COP(=O)([O-])OC', 'aPO2'),
+]
+# property name --> (share of datasets, liquid phase only)
+PROPERTIES = {
+    'Density': (0.32, True),
+    'Viscosity': (0.18, True),
+    'Heat capacity at constant pressure': (0.10, True),
+    'Electrical conductivity': (0.09, True),
+    'Speed of sound': (0.05, True),
+    'Refractive index': (0.05, True),
+    'Surface tension liquid-gas': (0.05, True),
+    'Self-diffusion coefficient': (0.03, True),
+    'Thermal conductivity': (0.03, True),
+    'Normal melting temperature': (0.05, False),
+    'Enthalpy of vaporization or sublimation': (0.02, False),
+    'Equilibrium pressure': (0.03, False),
+}
+PHASES = ['Liquid', 'Crystal', 'Gas']
+
+
+def make_ions(n_cations):
+    cations = []
+    for i in range(n_cations):
+        core, name, smiles, category = CATION_CORES[i % len(CATION_CORES)]
+        chain = i // len(CATION_CORES)
+        alkyl = ALKYLS[chain % len(ALKYLS)] + ('-%i' % (chain // len(ALKYLS)) if chain >= len(ALKYLS) else '')
+        # longer chains wrap around with a suffix, so some cations share a SMILES as in the real data
+        cations.append((name.format(alkyl), 'C' * (chain % len(ALKYLS)) + smiles, category))
+    return cations, ANIONS
+
+
+def zipf_weights(n, s=1.1):
+    w = 1 / np.arange(1, n + 1) ** s
+    return w / w.sum()
+
+
+def values(prp, T, P, rng, base):
+    """ Plausible values of a property along a temperature series.
+    """
+    if prp == 'Density':
+        return base * (1 - 6e-4 * (T - 298.15)) + 4e-4 * (P - 101.325)
+    if prp == 'Viscosity':
+        return np.exp(-9 + 900 / (T - 160)) * base / 1200
+    if prp == 'Electrical conductivity':
+        return np.exp(2 - 900 / (T - 160)) * 1200 / base
+    if prp == 'Self-diffusion coefficient':
+        return 1e-11 * np.exp(-2500 * (1 / T - 1 / 298.15))
+    if prp == 'Heat capacity at constant pressure':
+        return base / 3 + 0.5 * (T - 298.15)
+    return base / 1000 * (1 + 1e-3 * (T - 298.15)) * rng.normal(1, 0.01)
+
+
+def generate(path, n_molecules=2000, n_points=500000, n_papers=None, seed=0, chunk=200000):
+    """ Write a synthetic database to `path`, return row counts per table.
+    """
+    rng = np.random.default_rng(seed)
+    n_papers = n_papers or max(n_points // 150, 1)
+    if os.path.exists(path):
+        os.remove(path)
+
+    engine = create_engine('sqlite:///' + path)
+    metadata.create_all(engine)
+    engine.dispose()
+
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA journal_mode=OFF')
+    db.execute('PRAGMA synchronous=OFF')
+    db.execute('PRAGMA user_version=%i' % len(MIGRATIONS))
+
+    prp_names = sorted(PROPERTIES)
+    db.executemany('INSERT INTO property (id, name) VALUES (?, ?)', enumerate(prp_names, 1))
+
+    n_cations = max(int(n_molecules ** 0.5 * 3), 1)
+    cations, anions = make_ions(n_cations)
+    ions = [(name, 1, smiles, category) for name, smiles, category in cations] + \
+           [(name, -1, smiles, category) for name, smiles, category in anions]
+    db.executemany('INSERT INTO ion (id, name, charge, smiles, category, searched, popular, selected, validated) '
+                   'VALUES (?, ?, ?, ?, ?, 1, ?, ?, 0)',
+                   [(i, name, charge, smiles, category, i <= 40 if charge > 0 else i - len(cations) <= 8,
+                     i <= 20 if charge > 0 else i - len(cations) <= 5)
+                    for i, (name, charge, smiles, category) in enumerate(ions, 1)])
+
+    # molecules: distinct (cation, anion) pairs drawn by popularity
+    pairs = set()
+    wc, wa = zipf_weights(len(cations)), zipf_weights(len(anions), 0.8)
+    while len(pairs) < min(n_molecules, len(cations) * len(anions)):
+        c = rng.choice(len(cations), size=n_molecules, p=wc)
+        a = rng.choice(len(anions), size=n_molecules, p=wa)
+        pairs.update(zip(c.tolist(), a.tolist()))
+    pairs = sorted(pairs)[:n_molecules]
+    rng.shuffle(pairs)
+    molecules = [(i, '%s %s' % (cations[c][0], anions[a][0]), c + 1, len(cations) + a + 1,
+                  bool(c < 20 and a < 5)) for i, (c, a) in enumerate(pairs, 1)]
+    db.executemany('INSERT INTO molecule (id, name, cation_id, anion_id, selected, popular) VALUES (?, ?, ?, ?, ?, ?)',
+                   [m + (m[4],) for m in molecules])
+
+    db.executemany('INSERT INTO paper (id, year, title, author) VALUES (?, ?, ?, ?)',
+                   [(i, int(y), 'Synthetic paper %i' % i, 'Author %i et al. (%i)' % (i % 997, y))
+                    for i, y in enumerate(rng.integers(1990, 2025, n_papers), 1)])
+
+    # datasets: one paper, one molecule, one property, a temperature series
+    n_sets = max(n_points // 25, 1)
+    set_sizes = np.maximum(rng.geometric(1 / 25, n_sets), 1)
+    set_sizes = np.maximum((set_sizes * n_points / set_sizes.sum()).astype(int), 1)
+    n_sets = len(set_sizes)
+    set_mol = rng.choice(len(molecules), size=n_sets, p=zipf_weights(len(molecules), 0.9)) + 1
+    set_paper = rng.integers(1, n_papers + 1, n_sets)
+    shares = np.array([PROPERTIES[name][0] for name in prp_names])
+    set_prp = rng.choice(len(prp_names), size=n_sets, p=shares / shares.sum()) + 1
+    set_highp = rng.random(n_sets) < 0.08
+    db.executemany('INSERT INTO dataset (id, code, searched) VALUES (?, ?, 1)',
+                   [(i, np.base_repr(i, 36).rjust(5, '0')) for i in range(1, n_sets + 1)])
+
+    mol_base = rng.uniform(900, 1600, len(molecules) + 1)
+    rows = []
+    n = 0
+    for s in range(n_sets):
+        size = int(set_sizes[s])
+        prp = prp_names[set_prp[s] - 1]
+        liquid = PROPERTIES[prp][1]
+        T = np.round(np.sort(rng.uniform(258, 373, size)), 2)
+        if set_highp[s] and liquid:
+            P = rng.choice([101.325, 1e4, 2e4, 5e4, 1e5], size)
+        else:
+            P = np.where(rng.random() < 0.5, np.nan, 101.325) * np.ones(size)
+        value = values(prp, T, np.nan_to_num(P, nan=101.325), rng, mol_base[set_mol[s]]) * rng.normal(1, 0.003, size)
+        phase = 'Liquid' if liquid else PHASES[rng.integers(len(PHASES))]
+        rows.extend(zip([int(set_mol[s])] * size, [int(set_paper[s])] * size, [int(set_prp[s])] * size,
+                        [phase] * size, T.tolist(), [None if np.isnan(p) else p for p in P.tolist()],
+                        value.tolist(), (np.abs(value) * 0.01).tolist()))
+        if len(rows) >= chunk or s == n_sets - 1:
+            db.executemany('INSERT INTO data (molecule_id, paper_id, property_id, phase, t, p, value, stderr) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            n += len(rows)
+            rows = []
+
+    db.commit()
+    with engine.begin() as conn:
+        bounds.rebuild(conn)
+    engine.dispose()
+    db.execute('ANALYZE')
+    db.execute('PRAGMA journal_mode=WAL')
+    db.close()
+    return {'ion': len(ions), 'molecule': len(molecules), 'paper': n_papers, 'dataset': n_sets, 'data': n}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic ilthermo.db')
+    parser.add_argument('path')
+    parser.add_argument('--molecules', type=int, default=2000)
+    parser.add_argument('--points', type=int, default=500000)
+    parser.add_argument('--papers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    counts = generate(args.path, args.molecules, args.points, args.papers, args.seed)
+    print(' '.join('%s=%i' % item for item in counts.items()), '(%.1f s)' % (time.time() - t0))
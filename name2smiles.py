@@ -1,37 +1,31 @@
 #!/usr/bin/env python3
 
 import os
-import time
+import argparse
+import pybel
 from ilthermo.models import *
-from pubchempy import get_compounds, get_properties
-from chemspipy import ChemSpider
+from ilthermo.resolver import Resolver, PUBCHEM_URL, CHEMSPIDER_URL
 
-cs_token = os.environ['CHEMSPIDER_TOKEN']
-cs = ChemSpider(cs_token)
+parser = argparse.ArgumentParser(description='Resolve SMILES of ions without one from their names')
+parser.add_argument('-j', '--workers', type=int, default=8)
+parser.add_argument('--rate', type=float, default=5, help='requests per second to each service')
+parser.add_argument('--retry-missing', action='store_true', help='ask again for names cached as not found')
+parser.add_argument('--pubchem-url', default=PUBCHEM_URL)
+parser.add_argument('--chemspider-url', default=CHEMSPIDER_URL)
+args = parser.parse_args()
+
+resolver = Resolver(args.pubchem_url, args.chemspider_url, os.environ.get('CHEMSPIDER_TOKEN'),
+                    rate=args.rate, workers=args.workers)
+
+ions = session.query(Ion).filter(Ion.smiles == None).all()
+results = resolver.resolve_all([ion.name for ion in ions], retry_missing=args.retry_missing)
 
-ions = session.query(Ion)
 n = 0
-for ion in ions.filter(Ion.smiles == None):
-    MATCHED = False
-    pc_d_list = get_properties('IUPACName,IsomericSMILES,CanonicalSMILES', ion.name, 'name')
-    print('PubChem: ', ion, pc_d_list)
-    if len(pc_d_list) == 1:
-        d = pc_d_list[0]
-        iupac = d.get('IUPACName')
-        smiles = d.get('IsomericSMILES') or d.get('CanonicalSMILES')
-        MATCHED = True
-
-    if not MATCHED:
-        cs_results = cs.search(ion.name)
-        cs_results.wait()
-        print('ChemSpider: ', ion, cs_results)
-        if len(cs_results) == 1:
-            result = cs_results[0]
-            iupac = None
-            smiles = result.smiles
-            MATCHED = True
-
-    if MATCHED:
+for ion in ions:
+    smiles, iupac, source = results[ion.name]
+    print(source, ion, smiles)
+
+    if smiles is not None:
         m = pybel.readstring('smi', smiles)
         # Neutral species, obviously wrong
         if m.charge != 0:
@@ -39,9 +33,7 @@ for ion in ions.filter(Ion.smiles == None):
             ion.smiles = m.write('can').strip()
 
     n += 1
-    if n % 10 == 0:
+    if n % 100 == 0:
         session.commit()
 
-    time.sleep(0.5)
-
 session.commit()
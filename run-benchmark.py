@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+""" Time the extraction and curation steps on a (synthetic) database
+
+    python -m ilthermo.synthetic bench.db --molecules 5000 --points 2000000
+    ./run-benchmark.py bench.db [--steps extract fit ...] [-j 8] [-o report.json]
+
+Every step runs in a forked child on its own copy of the database, so steps
+that write do not affect each other and peak RSS is measured per step. The
+report is JSON with wall time, number of SQL statements and peak RSS (MB,
+including worker processes) of every step.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import resource
+import multiprocessing
+from sqlalchemy import event
+
+from ilthermo import models
+from ilthermo.migrate import time_queries
+
+TABLES = [('density', 298), ('density', 343), ('viscosity', 343), ('cp', 343), ('diffusion', 343), ('hvap', None)]
+
+
+def step_extract(workdir, workers):
+    from ilthermo.extract import extract
+    return sum(len(lines) for lines in extract(TABLES).values())
+
+
+def step_load_points(workdir, workers):
+    from ilthermo.extract import load_points
+    return len(load_points({key for key, T in TABLES})[1])
+
+
+def step_fit(workdir, workers):
+    from ilthermo.fit import fit_all
+    return fit_all(selected=False, workers=workers)
+
+
+def step_export(workdir, workers):
+    from ilthermo.columnar import export
+    return export(os.path.join(workdir, 'snapshot'), full=True)
+
+
+def setup_export_incremental(workdir):
+    from ilthermo.columnar import export
+    export(os.path.join(workdir, 'snapshot'), full=True)
+    models.session.execute("UPDATE data SET value = value * 1.001 WHERE molecule_id IN "
+                           "(SELECT id FROM molecule ORDER BY id LIMIT 10)")
+    models.session.commit()
+
+
+def step_export_incremental(workdir, workers):
+    from ilthermo.columnar import export
+    edited = models.session.execute("SELECT count(DISTINCT molecule_id || ',' || property_id) FROM data WHERE molecule_id IN "
+                                    "(SELECT id FROM molecule ORDER BY id LIMIT 10)").scalar()
+    changed = export(os.path.join(workdir, 'snapshot'))
+    assert changed == edited, 'edited %i groups, re-exported %i' % (edited, changed)
+    return changed
+
+
+def step_chemistry(workdir, workers):
+    from ilthermo.chem import update_chemistry
+    return update_chemistry(workers, force=True)
+
+
+def step_categorize(workdir, workers):
+    from ilthermo.category import categorize
+    return len(categorize(workers=workers))
+
+
+def step_dedup(workdir, workers):
+    from ilthermo.dedup import ion_groups, merge_ions
+    mapping = ion_groups()
+    merge_ions(mapping)
+    return len(mapping)
+
+
+def step_consensus(workdir, workers):
+    from ilthermo.consensus import update
+    return update()
+
+
+def step_point_queries(workdir, workers):
+    return time_queries(models.engine, repeat=1)
+
+
+def step_screen(workdir, workers):
+    from ilthermo.bounds import candidates
+    from ilthermo.extract import PROPERTIES
+    return sum(len(candidates(PROPERTIES[key][0], T and (T - 5, T + 5), (None, 200))) for key, T in TABLES)
+
+
+# name --> (setup or None, step); setup is not timed
+STEPS = {
+    'extract': (None, step_extract),
+    'load_points': (None, step_load_points),
+    'fit': (None, step_fit),
+    'export': (None, step_export),
+    'export_incremental': (setup_export_incremental, step_export_incremental),
+    'chemistry': (None, step_chemistry),
+    'categorize': (None, step_categorize),
+    'dedup': (None, step_dedup),
+    'consensus': (None, step_consensus),
+    'point_queries': (None, step_point_queries),
+    'screen': (None, step_screen),
+}
+
+
+def peak_rss_mb():
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def child(conn, db_path, workdir, name, workers):
+    """ Point the shared session at db_path, run one step and send back its measurements.
+    """
+    engine = models.configure(db_path)
+    queries = [0]
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count(conn, cursor, statement, parameters, context, executemany):
+        queries[0] += 1
+
+    setup, func = STEPS[name]
+    try:
+        if setup:
+            setup(workdir)
+        queries[0] = 0
+        t0 = time.perf_counter()
+        result = func(workdir, workers)
+        wall = time.perf_counter() - t0
+        conn.send({'wall_s': wall, 'queries': queries[0], 'peak_rss_mb': peak_rss_mb(), 'result': result})
+    except Exception as e:
+        conn.send({'error': repr(e)})
+    finally:
+        conn.close()
+
+
+def run_step(db_path, name, workers):
+    workdir = tempfile.mkdtemp()
+    try:
+        copy = os.path.join(workdir, 'ilthermo.db')
+        shutil.copy(db_path, copy)
+        parent, conn = multiprocessing.Pipe()
+        proc = multiprocessing.get_context('fork').Process(target=child, args=(conn, copy, workdir, name, workers))
+        proc.start()
+        report = parent.recv() if parent.poll(None) else {'error': 'no result'}
+        proc.join()
+        if proc.exitcode:
+            report.setdefault('error', 'exit code %i' % proc.exitcode)
+        return report
+    except EOFError:
+        return {'error': 'step crashed'}
+    finally:
+        shutil.rmtree(workdir)
+
+
+def table_sizes(db_path):
+    import sqlite3
+    db = sqlite3.connect(db_path)
+    sizes = {table: db.execute('SELECT count(*) FROM %s' % table).fetchone()[0]
+             for table in ('ion', 'molecule', 'paper', 'dataset', 'data')}
+    db.close()
+    return sizes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark extraction and curation steps')
+    parser.add_argument('db', help='database to benchmark, e.g. written by python -m ilthermo.synthetic')
+    parser.add_argument('--steps', nargs='*', default=list(STEPS), help='steps to run: %s' % ', '.join(STEPS))
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('-o', '--out', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+    for name in args.steps:
+        if name not in STEPS:
+            parser.error('unknown step %s' % name)
+
+    report = {
+        'db': os.path.abspath(args.db),
+        'size_mb': os.path.getsize(args.db) / 2 ** 20,
+        'rows': table_sizes(args.db),
+        'workers': args.workers or os.cpu_count(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'steps': {},
+    }
+    for name in args.steps:
+        report['steps'][name] = run_step(args.db, name, args.workers)
+        print('%-20s %s' % (name, ' '.join('%s=%s' % (k, v) for k, v in report['steps'][name].items()
+                                            if k != 'result')), file=sys.stderr)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
@@ -1,24 +1,96 @@
 #!/usr/bin/env python3
+""" Write SVG drawings and 3D mol2 structures of the selected and popular ions
 
+Structures are generated on a process pool and cached under CACHE by a hash
+of the canonical SMILES and the generation settings, so an ion is only
+embedded again when its SMILES or SETTINGS change, and an output file is only
+rewritten when it is older than its cached structure.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import argparse
+from multiprocessing import Pool
+import pybel
 from ilthermo.models import *
+from ilthermo.chem import smiles_hash
 
-ions = session.query(Ion).filter(Ion.selected == True).filter(Ion.smiles != None)
-for ion in ions:
-    m = pybel.readstring('smi', ion.smiles)
-    # prefix = 'C' if ion.charge > 0 else 'A'
-    prefix = ion.category
-    m.write('svg', 'svg/%s_%03i.svg' % (prefix, ion.id), overwrite=True)
-    m.addh()
-    m.make3D()
-    m.write('mol2', 'mol2/%s_%03i.mol2' % (prefix, ion.id), overwrite=True)
-
-ions = session.query(Ion).filter(Ion.popular == True).filter(Ion.smiles != None)
-for ion in ions:
-    break
-    m = pybel.readstring('smi', ion.smiles)
-    # prefix = 'C' if ion.charge > 0 else 'A'
-    prefix = ion.category
-    m.write('svg', 'svg-pop/%s-%03i.svg' % (prefix, ion.id), overwrite=True)
+CACHE = 'structure-cache'
+SETTINGS = {'forcefield': 'mmff94', 'steps': 50}
+
+# ion set --> (filter, svg directory, mol2 directory, file name pattern)
+ION_SETS = {
+    'selected': (Ion.selected, 'svg', 'mol2', '%s_%03i'),
+    'popular': (Ion.popular, 'svg-pop', 'mol2-pop', '%s-%03i'),
+}
+
+
+def cache_key(smiles):
+    return hashlib.sha1(json.dumps([smiles, sorted(SETTINGS.items())]).encode()).hexdigest()
+
+
+def generate(smiles):
+    """ Make sure CACHE/<key>.svg and .mol2 exist for `smiles`, return the key.
+    """
+    key = cache_key(smiles)
+    base = os.path.join(CACHE, key)
+    if os.path.exists(base + '.svg') and os.path.exists(base + '.mol2'):
+        return key
+
+    m = pybel.readstring('smi', smiles)
+    m.write('svg', base + '.svg.tmp', overwrite=True)
     m.addh()
-    m.make3D()
-    m.write('mol2', 'mol2-pop/%s-%03i.mol2' % (prefix, ion.id), overwrite=True)
+    m.make3D(**SETTINGS)
+    m.write('mol2', base + '.mol2.tmp', overwrite=True)
+    os.replace(base + '.svg.tmp', base + '.svg')
+    os.replace(base + '.mol2.tmp', base + '.mol2')
+    return key
+
+
+def install(src, dst):
+    """ Copy src to dst unless dst is already up to date, return True if copied.
+    """
+    if os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src):
+        return False
+    shutil.copy(src, dst)
+    return True
+
+
+def save_structures(sets=('selected', 'popular'), workers=None):
+    os.makedirs(CACHE, exist_ok=True)
+    jobs = []
+    for name in sets:
+        flag, svg_dir, mol2_dir, pattern = ION_SETS[name]
+        os.makedirs(svg_dir, exist_ok=True)
+        os.makedirs(mol2_dir, exist_ok=True)
+        for ion in session.query(Ion).filter(flag == True).filter(Ion.smiles != None):
+            # prefix = 'C' if ion.charge > 0 else 'A'
+            prefix = ion.category
+            out = pattern % (prefix, ion.id)
+            # canonical_smiles only while it was derived from the current smiles
+            smi = ion.canonical_smiles if ion.smiles_hash == smiles_hash(ion.smiles) else ion.smiles
+            jobs.append((smi or ion.smiles,
+                         os.path.join(svg_dir, out + '.svg'), os.path.join(mol2_dir, out + '.mol2')))
+
+    smiles = sorted({job[0] for job in jobs})
+    with Pool(workers) as pool:
+        keys = dict(zip(smiles, pool.map(generate, smiles)))
+
+    written = 0
+    for smi, svg, mol2 in jobs:
+        base = os.path.join(CACHE, keys[smi])
+        written += install(base + '.svg', svg) | install(base + '.mol2', mol2)
+    print('%i ions, %i structures, %i ions written' % (len(jobs), len(smiles), written))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('sets', nargs='*', help='ion sets to write: %s (default: all)' % ', '.join(ION_SETS))
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    args = parser.parse_args()
+    for name in args.sets:
+        if name not in ION_SETS:
+            parser.error('unknown ion set %s' % name)
+    save_structures(args.sets or list(ION_SETS), args.workers)
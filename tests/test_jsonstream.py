@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from jsonstream import iter_items
+
+DOC = {
+    'header': ['T, K', 'Density, kg/m3'],
+    'n': 1.25,
+    'm': 25,
+    'e': 2e3,
+    'data': [298.15, -12.75, 2e-3, 123456789, 1.0E+10, -0.0, [1.5, 0.25], True, None],
+    'ref': {'full': 'A, B. (2020) J. 1', 'n': 1.25},
+    'last': -7.5e-5,
+}
+
+
+def split(text, *offsets):
+    bounds = [0, *offsets, len(text)]
+    return [text[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+@pytest.mark.parametrize('separators', [(',', ':'), (', ', ': ')])
+def test_numbers_split_at_every_offset(separators):
+    text = json.dumps(DOC, separators=separators)
+    expected = [(key, x) for key, value in DOC.items() for x in (value if key == 'data' else [value])]
+    for i in range(1, len(text)):
+        assert list(iter_items(split(text, i), 'data')) == expected, text[:i] + ' | ' + text[i:]
+
+
+@pytest.mark.parametrize('text', ['{"a": 1.5, "b": [1.25, 2e3]}', '{"a": -0.5e-1}', '{"a": 25}'])
+def test_one_character_chunks(text):
+    assert dict(iter_items(list(text))) == json.loads(text)
+
+
+def test_truncated_number_at_end_of_stream():
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_items(['{"a": 1.']))
@@ -0,0 +1,117 @@
+import json
+import time
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ilthermo import models
+from ilthermo.models import session, Identifier, Ion
+from ilthermo.resolver import Resolver
+
+
+class Stub(BaseHTTPRequestHandler):
+    """ PubChem and ChemSpider stand-ins: 'good' has one PubChem match, 'flaky' fails once,
+    'slow' is a ChemSpider search that never completes, everything else is not found.
+    """
+    requests = []
+    lock = threading.Lock()
+    failed = set()
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        with Stub.lock:
+            Stub.requests.append((time.monotonic(), self.path))
+        parts = self.path.split('/')
+        if parts[1] == 'pubchem':
+            name = parts[4]
+            if name == 'flaky' and name not in Stub.failed:
+                Stub.failed.add(name)
+                return self.reply(503)
+            if name in ('good', 'flaky'):
+                return self.reply(200, {'PropertyTable': {'Properties': [
+                    {'CanonicalSMILES': 'C[n+]1ccn(C)c1', 'IUPACName': '1,3-dimethylimidazolium'}]}})
+            return self.reply(404)
+        if parts[-1] == 'status':
+            return self.reply(200, {'status': 'Processing' if parts[-2] == 'slow' else 'Not Found'})
+        self.reply(404)
+
+    def do_POST(self):
+        name = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['name']
+        self.reply(200, {'queryId': name})
+
+
+@pytest.fixture
+def stub():
+    Stub.requests, Stub.failed = [], set()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:%i' % server.server_port
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'ilthermo.db')
+    models.metadata.create_all(models.configure(path))
+    yield path
+    models.session.remove()
+
+
+def resolver(url, **kwargs):
+    return Resolver(url + '/pubchem', url + '/chemspider', chemspider_token='token', **kwargs)
+
+
+def test_positive_and_negative_answers_are_cached(stub, db):
+    r = resolver(stub)
+    assert r.resolve_all(['good', 'missing']) == {
+        'good': ('C[n+]1ccn(C)c1', '1,3-dimethylimidazolium', 'pubchem'), 'missing': (None, None, None)}
+    assert session.query(Identifier).get('missing').source is None
+
+    n = len(Stub.requests)
+    assert r.resolve_all(['good', 'missing'])['good'][2] == 'pubchem'
+    assert len(Stub.requests) == n
+    r.resolve_all(['good', 'missing'], retry_missing=True)
+    paths = [path for t, path in Stub.requests[n:]]
+    assert paths and all('/missing/' in path for path in paths)
+
+
+def test_server_errors_are_retried(stub, db):
+    assert resolver(stub).resolve_all(['flaky'])['flaky'][2] == 'pubchem'
+    assert len(Stub.requests) == 2
+
+
+def test_rate_limit(stub, db):
+    names = ['missing%i' % i for i in range(30)]
+    t0 = time.monotonic()
+    resolver(stub, rate=20, workers=8).resolve_all(names)
+    pubchem = [t for t, path in Stub.requests if path.startswith('/pubchem')]
+    assert len(pubchem) == 30
+    assert time.monotonic() - t0 >= (30 - 20) / 20 * 0.9     # burst of 20, then 20 per second
+
+
+def test_slow_chemspider_search_is_not_cached(stub, db):
+    assert resolver(stub, poll_timeout=0.5).resolve_all(['slow']) == {'slow': (None, None, None)}
+    assert session.query(Identifier).get('slow') is None
+
+
+def test_lookup_leaves_the_commit_to_the_caller(stub, db):
+    session.add(Ion(name='pending', charge=1))
+    assert resolver(stub).lookup('good')[2] == 'pubchem'
+    other = sqlite3.connect(db)
+    assert other.execute('SELECT count(*) FROM ion').fetchone()[0] == 0
+    assert other.execute('SELECT count(*) FROM identifier').fetchone()[0] == 0
+    other.close()
+    session.commit()
+    assert session.query(Identifier).get('good').source == 'pubchem'